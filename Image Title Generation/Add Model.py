@@ -1,7 +1,17 @@
 import os
 import sys
+import itertools
+import importlib.util
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook
+
+# 每次生成并写入的组合行数，内存占用只与该值有关，与图片数量和型号数量无关
+CHUNK_ROWS = 50000
+
+# 输出文件的列顺序
+OUTPUT_COLUMNS = ['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译', '图片编号', '型号']
 
 def get_project_root():
     """获取项目根目录，兼容开发环境和PyInstaller打包环境"""
@@ -25,6 +35,17 @@ def get_project_root():
         project_root = os.path.dirname(os.path.dirname(script_dir))
     return project_root
 
+def load_shared_module(module_name, script_name):
+    """加载同目录下的共用模块（如Model Catalog.py），各个步骤共用同一个模块对象和其中的缓存"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        module_path = Path(os.path.dirname(os.path.abspath(__file__))) / script_name
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return module
+
 def get_result_folder_from_config(config_file):
     """从配置文件中读取结果文件夹路径"""
     result_folder = None
@@ -47,6 +68,216 @@ def get_result_folder_from_config(config_file):
     os.makedirs(result_folder, exist_ok=True)
     return result_folder
 
+def build_combination_chunk(df_images, df_models, catalog, image_positions, model_positions):
+    """按(图片位置, 型号位置)列表组合图片和型号，生成输出行"""
+    df_chunk = pd.concat([
+        df_images.iloc[image_positions].reset_index(drop=True),
+        df_models.iloc[model_positions].reset_index(drop=True),
+    ], axis=1)
+    
+    # 组合图片名称和手机型号（移除型号中的空格）
+    # 示例: iPhone X -> iPhoneX
+    df_chunk['图片名称'] = df_chunk['图片编号'].astype(str) + df_chunk['_型号名称']
+    
+    # 构造带有型号和尺寸的新标题，格式: for iPhone X Case 5.8 inch ... / for Samsung Galaxy S24 Case ...
+    df_chunk['亚马逊产品标题'] = catalog.expand_titles(
+        df_chunk['_品牌'],
+        model=df_chunk['_基础型号'],
+        size=df_chunk['_尺寸'],
+        content=df_chunk['_标题主体'],
+    )
+    return df_chunk[OUTPUT_COLUMNS]
+
+def iter_combination_chunks(df_images, df_models, catalog, allowed_models=None, chunk_rows=CHUNK_ROWS):
+    """
+    分块生成图片与型号的组合（保持图片在外、型号在内的顺序），每块约chunk_rows行
+    
+    Args:
+        allowed_models: 与df_images对应的列表，每项为允许的型号位置列表（None表示所有型号）；
+                        不传时所有图片与所有型号组合
+    """
+    all_models = np.arange(len(df_models))
+    image_parts = []
+    model_parts = []
+    pending_rows = 0
+    for image_position in range(len(df_images)):
+        models = all_models
+        if allowed_models is not None and allowed_models[image_position] is not None:
+            models = np.asarray(allowed_models[image_position], dtype=all_models.dtype)
+        image_parts.append(np.full(len(models), image_position))
+        model_parts.append(models)
+        pending_rows += len(models)
+        if pending_rows >= chunk_rows:
+            yield build_combination_chunk(df_images, df_models, catalog,
+                                          np.concatenate(image_parts), np.concatenate(model_parts))
+            image_parts, model_parts, pending_rows = [], [], 0
+    if pending_rows:
+        yield build_combination_chunk(df_images, df_models, catalog,
+                                      np.concatenate(image_parts), np.concatenate(model_parts))
+
+def write_chunks(chunks, output_excel=None, parquet_writer=None):
+    """
+    逐块写入结果，返回写入的行数
+    
+    Args:
+        output_excel: 使用只写模式的工作簿写入的Excel文件，为None时不写Excel
+        parquet_writer: Stage Data.py中的ParquetChunkWriter，为None时不写parquet
+    """
+    ws = None
+    if output_excel is not None:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        ws.append(OUTPUT_COLUMNS)
+    
+    total_rows = 0
+    for df_chunk in chunks:
+        if ws is not None:
+            # 空值写为空单元格（与DataFrame.to_excel一致）
+            values = df_chunk.astype(object).where(df_chunk.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                ws.append(row)
+        if parquet_writer is not None:
+            parquet_writer.write(df_chunk)
+        total_rows += len(df_chunk)
+        print(f"进度: {total_rows} 行已写入")
+    
+    if ws is not None:
+        wb.save(output_excel)
+    if parquet_writer is not None:
+        parquet_writer.close()
+    return total_rows
+
+def prepare_combinations(df_input, project_root):
+    """
+    读取型号文件，准备标题数据与型号的组合
+    
+    Args:
+        df_input: Title Generation生成的标题数据（Image_Titles_Doubao.xlsx的内容）
+        project_root: 项目根目录，用于查找"需要的excel文件"中的型号文件和兼容型号表
+    
+    Returns:
+        tuple: (分块生成组合的迭代器, 组合总数)；型号文件不存在或缺少必要的列时返回None
+    """
+    model_excel = Path(project_root) / "需要的excel文件" / "型号.xlsx"
+    
+    # 检查模型文件是否存在
+    if not model_excel.exists():
+        print(f"模型文件不存在: {model_excel}")
+        return None
+    
+    print(f"正在读取模型文件: {model_excel}")
+    catalog_module = load_shared_module('model_catalog', "Model Catalog.py")
+    catalog, df_model = catalog_module.load_model_catalog(model_excel)
+    
+    print(f"输入文件包含 {len(df_input)} 行数据")
+    print(f"模型文件包含 {len(df_model)} 行数据")
+    
+    # 检查必要的列是否存在
+    required_input_columns = ['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译']
+    missing_input_columns = [col for col in required_input_columns if col not in df_input.columns]
+    if missing_input_columns:
+        print(f"输入文件缺少必要的列: {missing_input_columns}")
+        return None
+    
+    required_model_columns = ['手机型号', '尺寸']
+    missing_model_columns = [col for col in required_model_columns if col not in df_model.columns]
+    if missing_model_columns:
+        print(f"模型文件缺少必要的列: {missing_model_columns}")
+        return None
+    
+    # 标题中的型号前缀只与原标题有关，先对每张图片整理一次标题主体，再按品牌模板与所有型号组合
+    title_content = catalog.normalize_titles(df_input['亚马逊产品标题'])
+    
+    df_images = pd.DataFrame({
+        '图片编号': df_input['图片名称'],
+        '父类编号': df_input['父类编号'],
+        '亚马逊产品标题翻译': df_input['亚马逊产品标题翻译'],
+        '短标题': df_input['短标题'],
+        '短标题翻译': df_input['短标题翻译'],
+        '_标题主体': title_content,
+    })
+    df_models = pd.DataFrame({
+        '型号': [model.name for model in catalog.models],
+        '_型号名称': [model.normalized_name for model in catalog.models],
+        '_品牌': [model.brand for model in catalog.models],
+        '_基础型号': [model.base_model for model in catalog.models],
+        '_尺寸': [str(model.size) for model in catalog.models],
+    })
+    
+    # 读取可选的兼容型号表，只生成图片与兼容型号的组合
+    compatibility = catalog_module.load_compatibility_rules(
+        Path(project_root) / "需要的excel文件" / "兼容型号.xlsx", catalog)
+    allowed_models = None
+    total_combinations = len(df_images) * len(df_models)
+    if compatibility is not None:
+        allowed_models = [compatibility.allowed_models(image_name, parent_id)
+                          for image_name, parent_id in zip(df_input['图片名称'], df_input['父类编号'])]
+        total_combinations = sum(len(df_models) if models is None else len(models)
+                                 for models in allowed_models)
+        print(f"已读取兼容型号表: {len(compatibility.rules)} 条规则，"
+              f"{sum(models is not None for models in allowed_models)} 张图片只与兼容型号组合")
+    
+    # 输入文件中的每一行与模型文件中的行组合，分块生成，不在内存中保存全部组合
+    print(f"正在生成 {total_combinations} 个组合...")
+    chunks = iter_combination_chunks(df_images, df_models, catalog, allowed_models)
+    
+    # 显示一些结果示例
+    first_chunk = next(chunks, None)
+    if first_chunk is not None:
+        print("前5行结果:")
+        print(first_chunk.head())
+        chunks = itertools.chain([first_chunk], chunks)
+    
+    return chunks, total_combinations
+
+def add_models(df_input, project_root):
+    """
+    分块生成所有组合（main.py在同一进程中依次运行各步骤时使用），传给save_combinations逐块写入
+    
+    Returns:
+        iterator: 每块为列顺序为OUTPUT_COLUMNS的DataFrame；无法生成时返回None
+    """
+    prepared = prepare_combinations(df_input, project_root)
+    if prepared is None:
+        return None
+    chunks, _ = prepared
+    return chunks
+
+def save_combinations(chunks, result_dir, config_file):
+    """保存组合结果到Image_Titles_Add_Model，返回写入的文件路径列表（后续步骤读取的文件在前）"""
+    output_excel = Path(result_dir) / "Image_Titles_Add_Model.xlsx"
+    output_parquet = Path(result_dir) / "Image_Titles_Add_Model.parquet"
+    
+    # INTERMEDIATE_FORMAT=parquet时，后续步骤读取parquet文件，xlsx只作为供人工查看的导出文件
+    stage_data = load_shared_module('stage_data', "Stage Data.py")
+    parquet_writer = None
+    if stage_data.get_intermediate_format(config_file) == 'parquet':
+        parquet_writer = stage_data.ParquetChunkWriter(output_parquet, string_columns=OUTPUT_COLUMNS)
+    
+    final_output_excel = None
+    if parquet_writer is None or stage_data.export_intermediate_xlsx(config_file):
+        # 检查文件是否存在，如果存在则重命名
+        final_output_excel = output_excel
+        counter = 1
+        while final_output_excel.exists():
+            # 获取文件名和扩展名
+            name, ext = final_output_excel.stem, final_output_excel.suffix
+            # 在文件名中添加计数器
+            final_output_excel = Path(final_output_excel.parent) / f"{name}_{counter}{ext}"
+            counter += 1
+    
+    # 保存结果
+    total_rows = write_chunks(chunks, final_output_excel, parquet_writer)
+    output_files = []
+    if parquet_writer is not None:
+        output_files.append(output_parquet)
+        print(f"结果已保存到: {output_parquet}")
+    if final_output_excel is not None:
+        output_files.append(final_output_excel)
+        print(f"结果已保存到: {final_output_excel}")
+    print(f"总共生成: {total_rows} 行")
+    return output_files
+
 def main():
     # 获取项目根目录
     project_root = get_project_root()
@@ -57,158 +288,22 @@ def main():
     config_file = Path(project_root)  / "config.txt"
     result_dir = get_result_folder_from_config(config_file)
     
-    # 输入文件和模型文件路径
+    # 输入文件路径
     input_excel = Path(result_dir) / "Image_Titles_Doubao.xlsx"
-    model_excel = Path(project_root) / "需要的excel文件" / "型号.xlsx"
-    
-    # 输出文件路径
-    output_excel = Path(result_dir) / "Image_Titles_Add_Model.xlsx"
     
     # 检查输入文件是否存在
     if not input_excel.exists():
         print(f"输入文件不存在: {input_excel}")
         return
     
-    # 检查模型文件是否存在
-    if not model_excel.exists():
-        print(f"模型文件不存在: {model_excel}")
-        return
-    
     print(f"正在读取输入文件: {input_excel}")
-    print(f"正在读取模型文件: {model_excel}")
     
     try:
-        # 读取两个Excel文件
         df_input = pd.read_excel(input_excel)
-        df_model = pd.read_excel(model_excel)
-        
-        print(f"输入文件包含 {len(df_input)} 行数据")
-        print(f"模型文件包含 {len(df_model)} 行数据")
-        
-        # 检查必要的列是否存在
-        required_input_columns = ['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译']
-        missing_input_columns = [col for col in required_input_columns if col not in df_input.columns]
-        if missing_input_columns:
-            print(f"输入文件缺少必要的列: {missing_input_columns}")
+        chunks = add_models(df_input, project_root)
+        if chunks is None:
             return
-        
-        required_model_columns = ['手机型号', '尺寸']
-        missing_model_columns = [col for col in required_model_columns if col not in df_model.columns]
-        if missing_model_columns:
-            print(f"模型文件缺少必要的列: {missing_model_columns}")
-            return
-        
-        # 创建结果列表
-        results = []
-        
-        total_combinations = len(df_input) * len(df_model)
-        current_combination = 0
-        
-        # 对于输入文件中的每一行，与模型文件中的所有行组合
-        for idx_input, row_input in df_input.iterrows():
-            image_name = row_input['图片名称']
-            parent_class_id = row_input['父类编号']  # 读取父类编号
-            amazon_title = row_input['亚马逊产品标题']
-            amazon_title_translation = row_input['亚马逊产品标题翻译']
-            short_title = row_input['短标题']
-            short_title_translation = row_input['短标题翻译']
-            
-            # 与模型文件中的每一行组合
-            for idx_model, row_model in df_model.iterrows():
-                current_combination += 1
-                model_name = row_model['手机型号']
-                size = row_model['尺寸']
-                
-                # 组合图片名称和手机型号（移除型号中的空格）
-                # 示例: iPhone X -> iPhoneX
-                model_name_no_space = model_name.replace(" ", "")
-                combined_image_name = f"{image_name}{model_name_no_space}"
-                
-                # 替换标题中的手机型号信息
-                # 标题格式应该是: for iPhone X Case 5.8 inch ...
-                # 我们需要替换标题中的型号信息以匹配特定型号并添加尺寸
-                
-                # 从型号中提取基本型号名称（移除"iPhone"前缀）
-                base_model = model_name.replace("iPhone", "").strip()
-                
-                # 构造新标题
-                if pd.isna(amazon_title) or str(amazon_title).strip() == "":
-                    # 如果原标题为空，构造一个新标题
-                    new_title = f"for iPhone {base_model} Case {size} Premium Quality Protective Phone Case with Stylish Design for Daily Use"
-                elif "for iPhone" in str(amazon_title):
-                    # 对于现有标题，确保包含尺寸信息且格式正确
-                    # 首先提取原标题的主要内容（移除"for iPhone"部分）
-                    title_content = str(amazon_title).replace("for iPhone", "", 1).strip()
-                    
-                    # 检查是否已经存在型号信息
-                    models_list = [model.replace("iPhone", "").strip() for model in df_model['手机型号'].unique()]
-                    starts_with_model = False
-                    model_prefix = ""
-                    for model in models_list:
-                        if title_content.startswith(model):
-                            starts_with_model = True
-                            model_prefix = model
-                            break
-                    
-                    if starts_with_model:
-                        # 如果已经存在型号信息，移除它
-                        title_content = title_content[len(model_prefix):].strip()
-                    
-                    # 移除多余的"Case"关键字
-                    title_content = title_content.replace("Case", "", 1).strip()
-                    
-                    # 构造带有型号和尺寸的新标题，格式: for iPhone X Case 5.8 inch ...
-                    new_title = f"for iPhone {base_model} Case {size} {title_content}"
-                else:
-                    # 如果标题不包含"for iPhone"，添加完整信息
-                    new_title = f"for iPhone {base_model} Case {size} {str(amazon_title)}"
-                
-                # 添加到结果列表
-                results.append({
-                    '图片编号': image_name,  # 添加图片编号列，值为原始图片名称
-                    '型号': model_name,  # 添加型号列，值为手机型号
-                    '父类编号': parent_class_id,  # 添加父类编号列
-                    '图片名称': combined_image_name,
-                    '亚马逊产品标题': new_title,
-                    '亚马逊产品标题翻译': amazon_title_translation,  # 保留翻译
-                    '短标题': short_title,  # 保留短标题
-                    '短标题翻译': short_title_translation  # 保留短标题翻译
-                })
-                
-                # 每处理100个组合显示一次进度
-                if current_combination % 100 == 0:
-                    print(f"进度: {current_combination}/{total_combinations} 个组合已处理")
-        
-        # 创建结果DataFrame
-        df_result = pd.DataFrame(results)
-        
-        # 重新排列列顺序
-        desired_order = ['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译', '图片编号', '型号']
-        # 确保所有需要的列都在
-        available_cols = [col for col in desired_order if col in df_result.columns]
-        # 添加任何不在期望顺序中的剩余列
-        remaining_cols = [col for col in df_result.columns if col not in available_cols]
-        final_order = available_cols + remaining_cols
-        df_result = df_result[final_order]
-        
-        # 显示一些结果示例
-        print("处理完成。前5行结果:")
-        print(df_result.head())
-        
-        # 检查文件是否存在，如果存在则重命名
-        final_output_excel = output_excel
-        counter = 1
-        while final_output_excel.exists():
-            # 获取文件名和扩展名
-            name, ext = final_output_excel.stem, final_output_excel.suffix
-            # 在文件名中添加计数器
-            final_output_excel = Path(final_output_excel.parent) / f"{name}_{counter}{ext}"
-            counter += 1
-        
-        # 保存结果到Excel文件
-        df_result.to_excel(final_output_excel, index=False, engine='openpyxl')
-        print(f"结果已保存到: {final_output_excel}")
-        print(f"总共生成: {len(df_result)} 行")
+        save_combinations(chunks, result_dir, config_file)
         
     except Exception as e:
         print(f"处理文件时出错: {str(e)}")
@@ -0,0 +1,246 @@
+import os
+import re
+import string
+from pathlib import Path
+import pandas as pd
+
+# 各品牌的亚马逊标题模板：{model} 为去掉品牌名的型号，{size} 为尺寸，{content} 为原标题去掉型号后的主体
+BRAND_TITLE_TEMPLATES = {
+    'iPhone': "for iPhone {model} Case {size} {content}",
+    'Samsung': "for Samsung {model} Case {size} {content}",
+}
+# 其他品牌使用完整型号名称
+DEFAULT_TITLE_TEMPLATE = "for {model} Case {size} {content}"
+# 原标题为空时使用的标题主体
+DEFAULT_TITLE_CONTENT = "Premium Quality Protective Phone Case with Stylish Design for Daily Use"
+
+class PhoneModel:
+    """型号文件中的一行：原始名称、去空格名称、品牌、标题中使用的型号名称和尺寸"""
+
+    def __init__(self, name, size):
+        self.name = name  # 例如: iPhone 15 Pro
+        self.normalized_name = name.replace(" ", "")  # 例如: iPhone15Pro，用于拼接SKU
+        self.brand = detect_brand(name)
+        self.base_model = strip_brand(name, self.brand)  # 例如: 15 Pro，用于"for iPhone 15 Pro Case"
+        self.size = size
+
+def detect_brand(name):
+    """根据型号名称判断品牌：iPhone / Samsung，其他品牌使用名称的第一个单词"""
+    if 'iPhone' in name:
+        return 'iPhone'
+    lowered = name.lower()
+    if 'samsung' in lowered or 'galaxy' in lowered:
+        return 'Samsung'
+    words = name.split()
+    return words[0] if words else ""
+
+def strip_brand(name, brand):
+    """去掉型号名称中的品牌名（只处理有标题模板的品牌），例如 Samsung Galaxy S24 -> Galaxy S24"""
+    if brand == 'iPhone':
+        return name.replace("iPhone", "").strip()
+    if brand in BRAND_TITLE_TEMPLATES:
+        return re.sub(re.escape(brand), "", name, count=1, flags=re.IGNORECASE).strip()
+    return name.strip()
+
+class TitleTemplate:
+    """预先解析的标题模板，对整列数据一次性展开"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(pattern)]
+
+    def expand(self, fields):
+        """
+        Args:
+            fields: {字段名: 字符串Series}，所有Series的索引相同
+        """
+        result = ""
+        for literal, field in self.parts:
+            if literal:
+                result = result + literal
+            if field is not None:
+                result = result + fields[field]
+        return result
+
+def build_alternation(names):
+    """按长度从长到短拼接正则分支，使匹配结果总是最长的名称"""
+    names = sorted({name for name in names if name}, key=len, reverse=True)
+    if not names:
+        return None
+    return "(?:" + "|".join(re.escape(name) for name in names) + ")"
+
+class ModelCatalog:
+    """
+    从型号.xlsx加载一次的手机型号目录，供各个处理步骤共享
+
+    - prefix_pattern: 匹配标题开头型号的正则（如"15 Pro Max Case ..."中的"15 Pro Max"），最长匹配优先
+    - find_by_sku: 根据SKU结尾的去空格型号名称（如"GYCYF000188iPhone15Pro"）找到对应型号
+    """
+
+    def __init__(self, models):
+        self.models = models
+        self.by_name = {model.name: model for model in models}
+        self.by_normalized_name = {}
+        for model in models:
+            self.by_normalized_name.setdefault(model.normalized_name, model)
+
+        self.templates = {brand: TitleTemplate(pattern) for brand, pattern in BRAND_TITLE_TEMPLATES.items()}
+        self.default_template = TitleTemplate(DEFAULT_TITLE_TEMPLATE)
+        # 原标题开头的"for iPhone"、"for Samsung"等
+        self.title_lead_pattern = build_alternation(f"for {brand}" for brand in BRAND_TITLE_TEMPLATES)
+
+        prefix = build_alternation(model.base_model for model in models)
+        self.prefix_pattern = "^" + prefix if prefix else None
+        self._prefix_regex = re.compile(self.prefix_pattern) if prefix else None
+        suffix = build_alternation(self.by_normalized_name)
+        self._suffix_regex = re.compile(suffix + "$") if suffix else None
+
+    @classmethod
+    def from_dataframe(cls, df_model):
+        models = []
+        for name, size in zip(df_model['手机型号'], df_model['尺寸']):
+            if pd.isna(name) or not str(name).strip():
+                continue
+            models.append(PhoneModel(str(name), size))
+        return cls(models)
+
+    def __len__(self):
+        return len(self.models)
+
+    def strip_model_prefix(self, text):
+        """移除文本开头最长的型号名称，返回剩余部分"""
+        if self._prefix_regex is None:
+            return text
+        return self._prefix_regex.sub("", text, count=1)
+
+    def find_by_sku(self, sku):
+        """根据SKU结尾的去空格型号名称查找型号（最长匹配），找不到时返回None"""
+        if self._suffix_regex is None:
+            return None
+        match = self._suffix_regex.search(sku)
+        if match is None:
+            return None
+        return self.by_normalized_name[match.group(0)]
+
+    def brand_for_sku(self, sku):
+        model = self.find_by_sku(sku)
+        return model.brand if model is not None else None
+
+    def normalize_titles(self, titles):
+        """
+        将原标题整理为标题主体（每张图片只需处理一次）
+
+        以"for iPhone"等开头的标题移除该部分、开头的型号（最长匹配）和第一个"Case"；
+        其他标题保留原文；空标题使用DEFAULT_TITLE_CONTENT
+        """
+        title_text = titles.astype(str)
+        is_empty = titles.isna() | (title_text.str.strip() == "")
+        has_lead = ~is_empty & title_text.str.contains(self.title_lead_pattern, regex=True)
+
+        content = title_text.str.replace(self.title_lead_pattern, "", n=1, regex=True).str.strip()
+        if self.prefix_pattern:
+            content = content.str.replace(self.prefix_pattern, "", n=1, regex=True).str.strip()
+        content = content.str.replace("Case", "", n=1, regex=False).str.strip()
+
+        content = title_text.where(~has_lead, content)
+        return content.mask(is_empty, DEFAULT_TITLE_CONTENT)
+
+    def expand_titles(self, brands, **fields):
+        """
+        按品牌模板批量生成标题
+
+        Args:
+            brands: 每一行的品牌Series
+            fields: 模板字段（model、size、content）对应的字符串Series，索引与brands相同
+        """
+        titles = pd.Series("", index=brands.index, dtype=object)
+        for brand in brands.unique():
+            mask = brands == brand
+            template = self.templates.get(brand, self.default_template)
+            titles[mask] = template.expand({name: values[mask] for name, values in fields.items()})
+        return titles
+
+class CompatibilityRules:
+    """
+    兼容型号表（需要的excel文件/兼容型号.xlsx）：限制每张图片只与部分型号组合
+
+    每行包含"图片前缀"和"兼容型号"两列：
+    - 图片前缀：图片名称的前缀（取最长匹配的前缀），或完整的父类编号
+    - 兼容型号：手机型号（如 iPhone 15 Pro）或品牌（如 Samsung），多个用逗号分隔
+    没有匹配规则的图片仍与所有型号组合
+    """
+
+    def __init__(self, catalog, rules):
+        self.catalog = catalog
+        self.rules = rules  # {图片前缀: 允许的型号在catalog.models中的位置（升序）}
+        prefix = build_alternation(rules)
+        self._prefix_regex = re.compile("^" + prefix) if prefix else None
+
+    @classmethod
+    def from_dataframe(cls, df_rules, catalog):
+        positions_by_name = {}
+        positions_by_brand = {}
+        for position, model in enumerate(catalog.models):
+            positions_by_name.setdefault(model.name.lower(), []).append(position)
+            positions_by_name.setdefault(model.normalized_name.lower(), []).append(position)
+            positions_by_brand.setdefault(model.brand.lower(), []).append(position)
+
+        rules = {}
+        for key, allowed in zip(df_rules['图片前缀'], df_rules['兼容型号']):
+            if pd.isna(key) or not str(key).strip():
+                continue
+            positions = rules.setdefault(str(key).strip(), set())
+            if pd.isna(allowed):
+                continue
+            for token in re.split(r"[,，、;；\n]", str(allowed)):
+                token = token.strip().lower()
+                if not token:
+                    continue
+                matched = positions_by_name.get(token) or positions_by_brand.get(token)
+                if matched:
+                    positions.update(matched)
+                else:
+                    print(f"警告: 兼容型号表中的型号或品牌不在型号文件中: {token}")
+        return cls(catalog, {key: sorted(positions) for key, positions in rules.items()})
+
+    def allowed_models(self, image_name, parent_id=None):
+        """返回允许的型号位置列表；没有匹配规则时返回None（允许所有型号）"""
+        if self._prefix_regex is not None:
+            match = self._prefix_regex.match(str(image_name))
+            if match is not None:
+                return self.rules[match.group(0)]
+        if parent_id is not None and not pd.isna(parent_id):
+            return self.rules.get(str(parent_id))
+        return None
+
+def load_compatibility_rules(rules_excel, catalog):
+    """读取兼容型号表，文件不存在时返回None（所有图片与所有型号组合）"""
+    rules_excel = Path(rules_excel)
+    if not rules_excel.exists():
+        return None
+    df_rules = pd.read_excel(rules_excel)
+    missing_columns = [col for col in ('图片前缀', '兼容型号') if col not in df_rules.columns]
+    if missing_columns:
+        print(f"兼容型号表缺少必要的列: {missing_columns}，忽略该文件")
+        return None
+    return CompatibilityRules.from_dataframe(df_rules, catalog)
+
+_catalog_cache = {}
+
+def load_model_catalog(model_excel):
+    """
+    读取型号.xlsx并返回ModelCatalog（同一文件未修改时直接返回已加载的目录）
+
+    Returns:
+        tuple: (ModelCatalog, 型号文件的DataFrame)
+    """
+    model_excel = Path(model_excel)
+    cache_key = (os.path.abspath(model_excel), model_excel.stat().st_mtime_ns)
+    cached = _catalog_cache.get(cache_key)
+    if cached is None:
+        df_model = pd.read_excel(model_excel)
+        catalog = ModelCatalog.from_dataframe(df_model) if '手机型号' in df_model.columns and '尺寸' in df_model.columns else None
+        cached = (catalog, df_model)
+        _catalog_cache.clear()
+        _catalog_cache[cache_key] = cached
+    return cached
@@ -1,8 +1,8 @@
 import os
 import sys
+import importlib.util
 from pathlib import Path
 from openpyxl import load_workbook
-import shutil
 import pandas as pd
 
 def get_project_root():
@@ -27,6 +27,17 @@ def get_project_root():
         project_root = os.path.dirname(os.path.dirname(script_dir))
     return project_root
 
+def load_shared_module(module_name, script_name):
+    """加载同目录下的共用模块（如Model Catalog.py），各个步骤共用同一个模块对象和其中的缓存"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        module_path = Path(os.path.dirname(os.path.abspath(__file__))) / script_name
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return module
+
 def get_result_folder_from_config(config_file):
     """从配置文件中读取结果文件夹路径"""
     result_folder = None
@@ -49,13 +60,245 @@ def get_result_folder_from_config(config_file):
     os.makedirs(result_folder, exist_ok=True)
     return result_folder
 
-def split_excel_by_phone_model():
+def next_output_file(output_file):
+    """文件已存在时添加序号"""
+    counter = 1
+    while output_file.exists():
+        name, ext = output_file.stem, output_file.suffix
+        output_file = Path(output_file.parent) / f"{name}_{counter}{ext}"
+        counter += 1
+    return output_file
+
+def write_phone_model_file(wb, ws, rows, output_file, parent_prefix, data_start_row=8):
+    """
+    将"模板"工作表的数据行替换为指定品牌的行，并保存为新文件
+    
+    Args:
+        wb: 工作簿（保存后"模板"工作表中只保留该品牌的数据行）
+        ws: "模板"工作表
+        rows: 要写入的数据行（每行为单元格值列表）
+        output_file: 保存路径（文件已存在时添加序号）
+        parent_prefix: "父条目的库存单位"列添加的前缀，如"P-"
+    """
+    output_file = next_output_file(output_file)
+    
+    # 删除原来的数据行（从第8行开始），一次删除整个区间
+    if ws.max_row >= data_start_row:
+        ws.delete_rows(data_start_row, ws.max_row - data_start_row + 1)
+    
+    # 写入数据行
+    current_row = data_start_row
+    for row in rows:
+        for col_idx, value in enumerate(row, 1):
+            ws.cell(row=current_row, column=col_idx).value = value
+        current_row += 1
+    
+    # 查找"父条目的库存单位"列并添加前缀
+    parent_sku_col = None
+    for cell in ws[4]:  # 第4行是标题行
+        if cell.value and "父条目的库存单位" in str(cell.value):
+            parent_sku_col = cell.column
+            break
+    
+    if parent_sku_col:
+        # 从第8行开始处理数据行
+        for row_idx in range(8, ws.max_row + 1):
+            cell_value = ws.cell(row=row_idx, column=parent_sku_col).value
+            if cell_value:
+                ws.cell(row=row_idx, column=parent_sku_col).value = parent_prefix + str(cell_value)
+    
+    load_shared_module('stage_data', "Stage Data.py").save_workbook(wb, output_file)
+    return output_file
+
+def split_rows_by_phone_model(data_rows, df_input, project_root):
+    """
+    从"模板"工作表的数据行中分离iPhone和Samsung行，并在每组子类行之前排列对应的父类行
+    
+    Args:
+        data_rows: 数据行（每行为单元格值列表，第一个值为SKU）
+        df_input: Add Model生成的DataFrame，用于读取父类信息；为None时不重新排列父类行
+        project_root: 项目根目录，用于读取型号文件
+    
+    Returns:
+        tuple: (iPhone行, Samsung行)
+    """
+    # 读取父类信息
+    parent_info = {}  # 存储SKU到父类编号的映射
+    if df_input is not None and '父类编号' in df_input.columns and '图片名称' in df_input.columns:
+        for idx, row in df_input.iterrows():
+            sku = row['图片名称']
+            parent_id = row['父类编号']
+            parent_info[sku] = parent_id
+    
+    # 读取型号目录，根据SKU结尾的型号判断品牌
+    catalog = None
+    try:
+        model_excel = Path(project_root) / "需要的excel文件" / "型号.xlsx"
+        if model_excel.exists():
+            catalog, _ = load_shared_module('model_catalog', "Model Catalog.py").load_model_catalog(model_excel)
+    except Exception as e:
+        print(f"读取型号文件时出错: {e}")
+    
+    def get_phone_brand(cell_value):
+        """
+        返回SKU对应的品牌；型号目录中找不到时按SKU中是否包含iPhone/samsung判断
+        
+        品牌与Add Model使用同一个型号目录，Galaxy型号（SKU中没有samsung）也归入Samsung文件
+        """
+        if catalog is not None:
+            brand = catalog.brand_for_sku(cell_value)
+            if brand is not None:
+                return brand
+        if 'iPhone' in cell_value:
+            return 'iPhone'
+        if 'samsung' in cell_value.lower():
+            return 'Samsung'
+        return None
+    
+    # 分离iPhone和samsung行，同时正确排列父类行和子类行
+    def organize_rows_by_phone_model(phone_type):
+        """根据手机类型分离行并正确排列父类行和子类行"""
+        organized_rows = []
+        processed_parents = set()  # 已处理的父类
+        
+        # 遍历所有数据行
+        for row in data_rows:
+            if row and row[0]:  # 确保A列有值
+                cell_value = str(row[0])
+                # 检查是否符合指定的手机类型
+                if get_phone_brand(cell_value) == phone_type:
+                    # 检查是否有对应的父类信息
+                    if cell_value in parent_info:
+                        parent_id = parent_info[cell_value]
+                        # 如果这是该父类的第一行且尚未处理过，则先添加父类行
+                        if parent_id not in processed_parents:
+                            processed_parents.add(parent_id)
+                            # 查找并添加父类行
+                            for parent_row in data_rows:
+                                if parent_row and parent_row[0] and str(parent_row[0]) == parent_id:
+                                    organized_rows.append(parent_row)
+                                    break
+                    # 添加当前行
+                    organized_rows.append(row)
+        return organized_rows
+    
+    # 为iPhone和Samsung行正确排列父类行和子类行
+    iphone_rows = organize_rows_by_phone_model('iPhone')
+    samsung_rows = organize_rows_by_phone_model('Samsung')
+    
+    # 其他行保持不变
+    other_rows = []
+    for row in data_rows:
+        if row and row[0]:  # 确保A列有值
+            cell_value = str(row[0])
+            if get_phone_brand(cell_value) not in ('iPhone', 'Samsung'):
+                other_rows.append(row)
+        else:
+            # 如果A列没有值，也归类到other_rows
+            other_rows.append(row)
+    
+    print(f"找到 {len(iphone_rows)} 行包含'iPhone'")
+    print(f"找到 {len(samsung_rows)} 行包含'samsung'")
+    print(f"找到 {len(other_rows)} 行包含其他内容")
+    
+    return iphone_rows, samsung_rows
+
+def split_workbook_by_phone_model(wb, df_input, project_root, result_dir):
+    """
+    对"模板"工作表中的数据进行整理，生成Final_Template_iPhone.xlsm和Final_Template_Samsung.xlsm：
+    1. 在iPhone文件中只保留iPhone数据行
+    2. 在Samsung文件中只保留Samsung数据行
+    
+    两个文件依次由同一个工作簿保存（保持所有格式和其他工作表），调用后工作簿中只保留最后保存的品牌的数据行
+    
+    Args:
+        wb: Ultimately生成的工作簿
+        df_input: Add Model生成的DataFrame，用于读取父类信息；为None时不重新排列父类行
+        project_root: 项目根目录，用于读取型号文件
+        result_dir: 结果文件夹
+    
+    Returns:
+        list: 保存的文件路径
+    """
+    ws = wb["模板"]
+    
+    # 获取所有行数据
+    max_row = ws.max_row
+    max_col = ws.max_column
+    
+    print(f"工作表共有 {max_row} 行, {max_col} 列")
+    
+    # 读取所有行数据（从第8行开始是数据行）
+    data_start_row = 8
+    data_rows = []
+    
+    # 读取数据行（从第8行开始）
+    for row_idx in range(data_start_row, max_row + 1):
+        row_data = []
+        for col_idx in range(1, max_col + 1):
+            cell_value = ws.cell(row=row_idx, column=col_idx).value
+            row_data.append(cell_value)
+        data_rows.append(row_data)
+    
+    iphone_rows, samsung_rows = split_rows_by_phone_model(data_rows, df_input, project_root)
+    
+    def write_file(rows, output_file, parent_prefix):
+        return write_phone_model_file(wb, ws, rows, output_file, parent_prefix, data_start_row)
+    
+    return save_phone_model_files(iphone_rows, samsung_rows, result_dir, write_file)
+
+def split_filled_template_by_phone_model(filled, df_input, project_root, result_dir):
     """
-    对"模板"工作表中的数据进行整理：
-    1. 复制原始文件生成两个新文件（保持所有格式和其他工作表）
-    2. 在iPhone文件中只保留iPhone数据行
-    3. 在Samsung文件中只保留Samsung数据行
+    与split_workbook_by_phone_model相同，但使用Ultimately（TEMPLATE_WRITER=xml）填写后保存在内存中的"模板"工作表，
+    品牌文件同样按行流式生成，不需要用openpyxl读取Final_Template
+    
+    Args:
+        filled: Ultimately.fill_template_xml返回的FilledTemplateXml
     """
+    data_rows = filled.data_rows()
+    print(f"工作表共有 {filled.data_start_row - 1 + len(data_rows)} 行, {filled.max_column} 列")
+    
+    iphone_rows, samsung_rows = split_rows_by_phone_model(data_rows, df_input, project_root)
+    
+    # 与write_phone_model_file相同，在第4行（标题行）中查找"父条目的库存单位"列
+    parent_sku_col = None
+    for column, cell in sorted(filled.sheet.rows.get(4, {}).items()):
+        if cell.value and "父条目的库存单位" in str(cell.value):
+            parent_sku_col = column
+            break
+    
+    def write_file(rows, output_file, parent_prefix):
+        output_file = next_output_file(output_file)
+        if parent_sku_col:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                if len(row) >= parent_sku_col and row[parent_sku_col - 1]:
+                    row[parent_sku_col - 1] = parent_prefix + str(row[parent_sku_col - 1])
+        return filled.write_rows(output_file, rows)
+    
+    return save_phone_model_files(iphone_rows, samsung_rows, result_dir, write_file)
+
+def save_phone_model_files(iphone_rows, samsung_rows, result_dir, write_file):
+    """依次保存iPhone和Samsung文件，write_file(行, 保存路径, 父条目前缀)返回实际保存的路径"""
+    output_files = []
+    
+    # 处理iPhone文件
+    if iphone_rows:
+        iphone_output_file = write_file(iphone_rows, Path(result_dir) / "Final_Template_iPhone.xlsm", "P-")
+        output_files.append(iphone_output_file)
+        print(f"iPhone数据已保存到: {iphone_output_file}")
+    
+    # 处理Samsung文件
+    if samsung_rows:
+        samsung_output_file = write_file(samsung_rows, Path(result_dir) / "Final_Template_Samsung.xlsm", "S-")
+        output_files.append(samsung_output_file)
+        print(f"Samsung数据已保存到: {samsung_output_file}")
+    
+    print("文件拆分完成！")
+    return output_files
+
+def split_excel_by_phone_model():
+    """读取结果文件夹中的Final_Template.xlsm，按品牌拆分为两个文件"""
     
     # 获取项目根目录
     project_root = get_project_root()
@@ -76,185 +319,20 @@ def split_excel_by_phone_model():
     print(f"正在读取文件: {input_file}")
     
     try:
-        # 加载工作簿并选择"模板"工作表
+        # 加载工作簿
         wb = load_workbook(input_file, keep_vba=True)
-        ws = wb["模板"]
-        
-        # 获取所有行数据
-        max_row = ws.max_row
-        max_col = ws.max_column
-        
-        print(f"工作表共有 {max_row} 行, {max_col} 列")
         
-        # 读取所有行数据（从第8行开始是数据行）
-        data_start_row = 8
-        data_rows = []
-        
-        # 读取数据行（从第8行开始）
-        for row_idx in range(data_start_row, max_row + 1):
-            row_data = []
-            for col_idx in range(1, max_col + 1):
-                cell_value = ws.cell(row=row_idx, column=col_idx).value
-                row_data.append(cell_value)
-            data_rows.append(row_data)
-        
-        # 读取父类信息
-        parent_info = {}  # 存储SKU到父类编号的映射
+        # 从Add Model生成的Image_Titles_Add_Model（xlsx或parquet）读取父类信息
+        df_input = None
         try:
-            # 从Image_Titles_Add_Model.xlsx读取父类信息
-            input_excel = Path(result_dir) / "Image_Titles_Add_Model.xlsx"
-            if input_excel.exists():
-                df_input = pd.read_excel(input_excel)
-                if '父类编号' in df_input.columns and '图片名称' in df_input.columns:
-                    for idx, row in df_input.iterrows():
-                        sku = row['图片名称']
-                        parent_id = row['父类编号']
-                        parent_info[sku] = parent_id
+            stage_data = load_shared_module('stage_data', "Stage Data.py")
+            input_path = stage_data.find_stage_table(result_dir, "Image_Titles_Add_Model")
+            if input_path is not None:
+                df_input = stage_data.read_stage_table(input_path)
         except Exception as e:
             print(f"读取父类信息时出错: {e}")
         
-        # 分离iPhone和samsung行，同时正确排列父类行和子类行
-        def organize_rows_by_phone_model(phone_type):
-            """根据手机类型分离行并正确排列父类行和子类行"""
-            organized_rows = []
-            processed_parents = set()  # 已处理的父类
-            
-            # 遍历所有数据行
-            for row in data_rows:
-                if row and row[0]:  # 确保A列有值
-                    cell_value = str(row[0])
-                    # 检查是否符合指定的手机类型
-                    if (phone_type == 'iPhone' and 'iPhone' in cell_value) or \
-                       (phone_type == 'Samsung' and 'samsung' in cell_value.lower()):
-                        # 检查是否有对应的父类信息
-                        if cell_value in parent_info:
-                            parent_id = parent_info[cell_value]
-                            # 如果这是该父类的第一行且尚未处理过，则先添加父类行
-                            if parent_id not in processed_parents:
-                                processed_parents.add(parent_id)
-                                # 查找并添加父类行
-                                for parent_row in data_rows:
-                                    if parent_row and parent_row[0] and str(parent_row[0]) == parent_id:
-                                        organized_rows.append(parent_row)
-                                        break
-                        # 添加当前行
-                        organized_rows.append(row)
-            return organized_rows
-        
-        # 为iPhone和Samsung行正确排列父类行和子类行
-        iphone_rows = organize_rows_by_phone_model('iPhone')
-        samsung_rows = organize_rows_by_phone_model('Samsung')
-        
-        # 其他行保持不变
-        other_rows = []
-        for row in data_rows:
-            if row and row[0]:  # 确保A列有值
-                cell_value = str(row[0])
-                if 'iPhone' not in cell_value and 'samsung' not in cell_value.lower():
-                    other_rows.append(row)
-            else:
-                # 如果A列没有值，也归类到other_rows
-                other_rows.append(row)
-        
-        print(f"找到 {len(iphone_rows)} 行包含'iPhone'")
-        print(f"找到 {len(samsung_rows)} 行包含'samsung'")
-        print(f"找到 {len(other_rows)} 行包含其他内容")
-        
-        # 处理iPhone文件
-        if iphone_rows:
-            # 复制原始文件为iPhone版本
-            iphone_output_file = Path(result_dir) / "Final_Template_iPhone.xlsm"
-            counter = 1
-            while iphone_output_file.exists():
-                name, ext = iphone_output_file.stem, iphone_output_file.suffix
-                iphone_output_file = Path(iphone_output_file.parent) / f"{name}_{counter}{ext}"
-                counter += 1
-            
-            # 复制文件
-            shutil.copy2(input_file, iphone_output_file)
-            
-            # 打开复制的文件并修改"模板"工作表
-            iphone_wb = load_workbook(iphone_output_file, keep_vba=True)
-            iphone_ws = iphone_wb["模板"]
-            
-            # 删除原来的数据行（从第8行开始）
-            for row_idx in range(max_row, data_start_row - 1, -1):
-                iphone_ws.delete_rows(row_idx)
-            
-            # 写入iPhone数据行
-            current_row = data_start_row
-            for row in iphone_rows:
-                for col_idx, value in enumerate(row, 1):
-                    iphone_ws.cell(row=current_row, column=col_idx).value = value
-                current_row += 1
-            
-            # 查找"父条目的库存单位"列并添加前缀"P"
-            parent_sku_col = None
-            for cell in iphone_ws[4]:  # 第4行是标题行
-                if cell.value and "父条目的库存单位" in str(cell.value):
-                    parent_sku_col = cell.column
-                    break
-            
-            if parent_sku_col:
-                # 从第8行开始处理数据行
-                for row_idx in range(8, iphone_ws.max_row + 1):
-                    cell_value = iphone_ws.cell(row=row_idx, column=parent_sku_col).value
-                    if cell_value:
-                        # 添加前缀"P"
-                        iphone_ws.cell(row=row_idx, column=parent_sku_col).value = "P-" + str(cell_value)
-            
-            # 保存iPhone文件
-            iphone_wb.save(iphone_output_file)
-            print(f"iPhone数据已保存到: {iphone_output_file}")
-        
-        # 处理Samsung文件
-        if samsung_rows:
-            # 复制原始文件为Samsung版本
-            samsung_output_file = Path(result_dir) / "Final_Template_Samsung.xlsm"
-            counter = 1
-            while samsung_output_file.exists():
-                name, ext = samsung_output_file.stem, samsung_output_file.suffix
-                samsung_output_file = Path(samsung_output_file.parent) / f"{name}_{counter}{ext}"
-                counter += 1
-            
-            # 复制文件
-            shutil.copy2(input_file, samsung_output_file)
-            
-            # 打开复制的文件并修改"模板"工作表
-            samsung_wb = load_workbook(samsung_output_file, keep_vba=True)
-            samsung_ws = samsung_wb["模板"]
-            
-            # 删除原来的数据行（从第8行开始）
-            for row_idx in range(max_row, data_start_row - 1, -1):
-                samsung_ws.delete_rows(row_idx)
-            
-            # 写入Samsung数据行
-            current_row = data_start_row
-            for row in samsung_rows:
-                for col_idx, value in enumerate(row, 1):
-                    samsung_ws.cell(row=current_row, column=col_idx).value = value
-                current_row += 1
-            
-            # 查找"父条目的库存单位"列并添加前缀"S"
-            parent_sku_col = None
-            for cell in samsung_ws[4]:  # 第4行是标题行
-                if cell.value and "父条目的库存单位" in str(cell.value):
-                    parent_sku_col = cell.column
-                    break
-            
-            if parent_sku_col:
-                # 从第8行开始处理数据行
-                for row_idx in range(8, samsung_ws.max_row + 1):
-                    cell_value = samsung_ws.cell(row=row_idx, column=parent_sku_col).value
-                    if cell_value:
-                        # 添加前缀"S"
-                        samsung_ws.cell(row=row_idx, column=parent_sku_col).value = "S-" + str(cell_value)
-            
-            # 保存Samsung文件
-            samsung_wb.save(samsung_output_file)
-            print(f"Samsung数据已保存到: {samsung_output_file}")
-        
-        print("文件拆分完成！")
+        split_workbook_by_phone_model(wb, df_input, project_root, result_dir)
         
     except Exception as e:
         print(f"处理文件时出错: {str(e)}")
@@ -266,4 +344,4 @@ def main():
     split_excel_by_phone_model()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,340 @@
+import os
+import re
+import numbers
+import zipfile
+import posixpath
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+SHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+DOC_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+# 每次写入压缩包的行数
+WRITE_BATCH_ROWS = 1000
+
+def _tag(name):
+    return f"{{{SHEET_NS}}}{name}"
+
+def _quote(value):
+    return '"' + escape(value, {'"': "&quot;"}) + '"'
+
+def rels_part(part_name):
+    """部件对应的关系文件，例如 xl/workbook.xml -> xl/_rels/workbook.xml.rels"""
+    folder, name = posixpath.split(part_name)
+    return posixpath.join(folder, "_rels", name + ".rels")
+
+def element_text(element):
+    """<si>或<is>中的文本（富文本各段拼接，忽略拼音<rPh>）"""
+    text = element.find(_tag('t'))
+    if text is not None:
+        return text.text or ""
+    return "".join(run.findtext(_tag('t')) or "" for run in element.findall(_tag('r')))
+
+def cast_number(text):
+    """与openpyxl读取数字单元格相同：整数返回int，其他返回float"""
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+class TemplateCell:
+    """
+    模板工作表中的一个单元格
+
+    - value: 与openpyxl读取结果相同的值（公式为"="开头的字符串），用于查找表头和判断数据行
+    - style / data_type / content: 复制到输出行时使用的s属性、t属性和<c>元素内部的XML
+    """
+
+    def __init__(self, column, style, value, data_type, content):
+        self.column = column
+        self.style = style
+        self.value = value
+        self.data_type = data_type
+        self.content = content
+
+# 不存在的单元格
+EMPTY_CELL = TemplateCell(None, None, None, None, "")
+
+class TemplateSheet:
+    """
+    从xlsx/xlsm中读取的一个工作表：<sheetData>之前和之后的XML原样保留，行和单元格解析后用于生成新的行
+
+    提供与openpyxl工作表相同的cell(row=, column=).value和max_row/max_column，可直接用于按表头查找列
+    """
+
+    def __init__(self, part_name, xml_text, shared_strings):
+        self.part_name = part_name
+
+        root_tag = re.search(r'<(\w+:)?worksheet\b[^>]*>', xml_text)
+        if root_tag is None:
+            raise ValueError(f"无法解析工作表: {part_name}")
+        self.prefix = root_tag.group(1) or ""
+        declarations = re.findall(r'\sxmlns(?::(\w+))?="([^"]*)"', root_tag.group(0))
+        self.namespaces = {uri: prefix for prefix, uri in declarations}
+        self.namespaces["http://www.w3.org/XML/1998/namespace"] = "xml"
+
+        p = re.escape(self.prefix)
+        data_tag = re.compile(rf'<{p}sheetData\b[^>]*?(/?)>').search(xml_text, root_tag.end())
+        if data_tag is None:
+            raise ValueError(f"工作表中没有<sheetData>: {part_name}")
+        self.head = xml_text[:data_tag.start()]
+        if data_tag.group(1):
+            content = ""
+            self.tail = xml_text[data_tag.end():]
+        else:
+            close = xml_text.index(f"</{self.prefix}sheetData>", data_tag.end())
+            content = xml_text[data_tag.end():close]
+            self.tail = xml_text[close + len(f"</{self.prefix}sheetData>"):]
+
+        dimension = re.search(rf'<{p}dimension\b[^>]*\bref="([^":]*)', self.head)
+        self.dimension_start = dimension.group(1) if dimension else "A1"
+
+        # 用根元素的命名空间声明包装<sheetData>的内容后再解析
+        wrapper = (f"<{self.prefix}sheetData" + "".join(re.findall(r'\sxmlns(?::\w+)?="[^"]*"', root_tag.group(0)))
+                   + ">" + content + f"</{self.prefix}sheetData>")
+        self.rows = {}  # {行号: {列号: TemplateCell}}
+        self.row_attributes = {}  # {行号: 除r和spans以外的<row>属性}
+        self._parse_rows(ET.fromstring(wrapper), shared_strings)
+
+        self.max_row = max(self.rows, default=0)
+        self.max_column = max((column for cells in self.rows.values() for column in cells), default=0)
+
+    def _parse_rows(self, sheet_data, shared_strings):
+        shared_formulas = {}  # {si: (公式, 所在单元格)}
+        row_idx = 0
+        for row in sheet_data.findall(_tag('row')):
+            row_idx = int(row.get('r', row_idx + 1))
+            self.row_attributes[row_idx] = "".join(
+                f" {self._name(name)}={_quote(value)}" for name, value in row.attrib.items()
+                if name not in ('r', 'spans'))
+            cells = {}
+            column = 0
+            for cell in row.findall(_tag('c')):
+                if cell.get('r'):
+                    column = column_index_from_string(coordinate_from_string(cell.get('r'))[0])
+                else:
+                    column += 1
+                coordinate = f"{get_column_letter(column)}{row_idx}"
+                cells[column] = self._parse_cell(cell, column, coordinate, shared_strings, shared_formulas)
+            self.rows[row_idx] = cells
+
+    def _parse_cell(self, cell, column, coordinate, shared_strings, shared_formulas):
+        style = cell.get('s')
+        data_type = cell.get('t', 'n')
+        formula = cell.find(_tag('f'))
+        text = cell.findtext(_tag('v'))
+
+        if formula is not None:
+            formula_type = formula.get('t')
+            if formula_type == 'shared':
+                # 与openpyxl相同，将共享公式展开为每个单元格各自的公式（行会被复制和移动）
+                si = formula.get('si')
+                if formula.text:
+                    shared_formulas[si] = ("=" + formula.text, coordinate)
+                    value = "=" + formula.text
+                elif si in shared_formulas:
+                    master, origin = shared_formulas[si]
+                    value = Translator(master, origin=origin).translate_formula(coordinate)
+                else:
+                    value = "="
+                content = f"<{self.prefix}f>{escape(value[1:])}</{self.prefix}f>"
+            elif formula_type in ('array', 'dataTable'):
+                value = "=" + (formula.text or "")
+                content = self._serialize(formula)
+            else:
+                value = "=" + (formula.text or "")
+                content = f"<{self.prefix}f>{escape(formula.text or '')}</{self.prefix}f>"
+            # 公式不保留缓存的计算结果（openpyxl保存时也不写入）
+            return TemplateCell(column, style, value, None, content)
+
+        content = "".join(self._serialize(child) for child in cell)
+        if data_type == 's':
+            value = shared_strings[int(text)] if text is not None else None
+        elif data_type == 'inlineStr':
+            inline = cell.find(_tag('is'))
+            value = element_text(inline) if inline is not None else None
+        elif data_type == 'b':
+            value = bool(int(text)) if text is not None else None
+        elif data_type == 'n':
+            value = cast_number(text) if text else None
+        else:
+            value = text
+        return TemplateCell(column, style, value, None if data_type == 'n' else data_type, content)
+
+    def _name(self, name):
+        """将{命名空间}名称转换为带前缀的名称"""
+        if name[0] != '{':
+            return name
+        uri, local = name[1:].split('}', 1)
+        if uri not in self.namespaces:
+            raise ValueError(f"工作表使用了未在根元素声明的命名空间: {uri}")
+        prefix = self.namespaces[uri]
+        return f"{prefix}:{local}" if prefix else local
+
+    def _serialize(self, element):
+        name = self._name(element.tag)
+        attributes = "".join(f" {self._name(key)}={_quote(value)}" for key, value in element.attrib.items())
+        inner = escape(element.text or "") + "".join(
+            self._serialize(child) + escape(child.tail or "") for child in element)
+        if not inner:
+            return f"<{name}{attributes}/>"
+        return f"<{name}{attributes}>{inner}</{name}>"
+
+    def cell(self, row, column):
+        return self.rows.get(row, {}).get(column, EMPTY_CELL)
+
+    def value_content(self, value):
+        """新写入的值对应的(t属性, <c>元素内部的XML)，与openpyxl写入的类型一致"""
+        p = self.prefix
+        if value is None:
+            return None, ""
+        if isinstance(value, bool):
+            return 'b', f"<{p}v>{int(value)}</{p}v>"
+        if isinstance(value, numbers.Integral):
+            return None, f"<{p}v>{int(value)}</{p}v>"
+        if isinstance(value, numbers.Real):
+            return None, f"<{p}v>{float(value)!r}</{p}v>"
+        text = str(value)
+        if text.startswith('=') and len(text) > 1:
+            return None, f"<{p}f>{escape(text[1:])}</{p}f>"
+        text = ILLEGAL_CHARACTERS_RE.sub("", text)
+        return 'inlineStr', f'<{p}is><{p}t xml:space="preserve">{escape(text)}</{p}t></{p}is>'
+
+    def row_xml(self, row_idx, source_row, values=None):
+        """
+        生成输出的一行：复制模板第source_row行的单元格，并写入values中的新值
+
+        Args:
+            row_idx: 输出的行号（行高等行属性与openpyxl相同，按行号沿用模板中该行的属性）
+            source_row: 复制单元格的模板行号，为None时不复制模板单元格（只写入values中的值，不带格式）
+            values: {列号: 新值}，新值为None时只保留该单元格的格式
+        """
+        p = self.prefix
+        cells = dict(self.rows.get(source_row, {}))
+        for column, value in (values or {}).items():
+            source = cells.get(column, EMPTY_CELL)
+            data_type, content = self.value_content(value)
+            cells[column] = TemplateCell(column, source.style, value, data_type, content)
+
+        parts = [f'<{p}row r="{row_idx}"{self.row_attributes.get(row_idx, "")}>']
+        for column in sorted(cells):
+            cell = cells[column]
+            if cell.style is None and not cell.content:
+                continue
+            attributes = f' r="{get_column_letter(column)}{row_idx}"'
+            if cell.style is not None:
+                attributes += f' s="{cell.style}"'
+            if cell.data_type is not None and cell.content:
+                attributes += f' t="{cell.data_type}"'
+            parts.append(f"<{p}c{attributes}>{cell.content}</{p}c>" if cell.content else f"<{p}c{attributes}/>")
+        parts.append(f"</{p}row>")
+        return "".join(parts)
+
+class TemplatePackage:
+    """
+    xlsx/xlsm压缩包：读取工作表，并在生成新文件时原样复制其他部件（VBA、其他工作表、样式、图片等）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            root_rels = self._relationships(archive, "")
+            self.workbook_part = next(target for rel_type, target in root_rels.values()
+                                      if rel_type.endswith("/officeDocument"))
+            self.workbook_rels = self._relationships(archive, self.workbook_part)
+            workbook = ET.fromstring(archive.read(self.workbook_part))
+            self.sheet_parts = {}
+            for sheet in workbook.iter(_tag('sheet')):
+                rel_id = sheet.get(f"{{{DOC_REL_NS}}}id")
+                self.sheet_parts[sheet.get('name')] = self.workbook_rels[rel_id][1]
+            self.shared_strings = []
+            for rel_type, target in self.workbook_rels.values():
+                if rel_type.endswith("/sharedStrings"):
+                    self.shared_strings = self._read_shared_strings(archive, target)
+
+    @staticmethod
+    def _relationships(archive, part_name):
+        """{关系Id: (类型, 目标部件)}，part_name为空字符串时读取包的关系（_rels/.rels）"""
+        rels_name = rels_part(part_name) if part_name else "_rels/.rels"
+        if rels_name not in archive.namelist():
+            return {}
+        folder = posixpath.dirname(part_name)
+        relationships = {}
+        for rel in ET.fromstring(archive.read(rels_name)).iter(f"{{{PKG_REL_NS}}}Relationship"):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target.lstrip('/')
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            relationships[rel.get('Id')] = (rel.get('Type'), target)
+        return relationships
+
+    @staticmethod
+    def _read_shared_strings(archive, part_name):
+        strings = []
+        with archive.open(part_name) as f:
+            for _, element in ET.iterparse(f):
+                if element.tag == _tag('si'):
+                    strings.append(element_text(element))
+                    element.clear()
+        return strings
+
+    def load_sheet(self, sheet_names):
+        """按名称读取第一个存在的工作表，都不存在时抛出ValueError（与openpyxl方式的提示相同）"""
+        for name in sheet_names:
+            if name in self.sheet_parts:
+                print(f"找到工作表: {name}")
+                with zipfile.ZipFile(self.path) as archive:
+                    xml_text = archive.read(self.sheet_parts[name]).decode('utf-8')
+                return TemplateSheet(self.sheet_parts[name], xml_text, self.shared_strings)
+        raise ValueError(f"模板文件中未找到工作表: {sheet_names}。可用的工作表: {list(self.sheet_parts)}")
+
+    def write(self, output_file, sheet, rows, max_row, max_column):
+        """
+        生成新文件：sheet的<sheetData>由rows（每行的XML字符串）流式写入，其他部件原样复制
+
+        计算链（calcChain.xml）记录的公式位置已不准确，与openpyxl相同不再保留，由Excel重新计算
+        """
+        calc_chain = next((target for rel_type, target in self.workbook_rels.values()
+                           if rel_type.endswith("/calcChain")), None)
+        p = sheet.prefix
+        dimension = f"{sheet.dimension_start}:{get_column_letter(max(max_column, 1))}{max(max_row, 1)}"
+        head = re.sub(rf'(<{re.escape(p)}dimension\b[^>]*\bref=")[^"]*(")', rf'\g<1>{dimension}\g<2>', sheet.head, count=1)
+
+        temp_file = f"{output_file}.tmp"
+        with zipfile.ZipFile(self.path) as source, \
+                zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as target:
+            for info in source.infolist():
+                if info.filename == calc_chain:
+                    continue
+                if info.filename == sheet.part_name:
+                    sheet_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    sheet_info.compress_type = zipfile.ZIP_DEFLATED
+                    with target.open(sheet_info, 'w', force_zip64=True) as f:
+                        f.write(head.encode('utf-8'))
+                        f.write(f"<{p}sheetData>".encode('utf-8'))
+                        batch = []
+                        for row in rows:
+                            batch.append(row)
+                            if len(batch) >= WRITE_BATCH_ROWS:
+                                f.write("".join(batch).encode('utf-8'))
+                                batch = []
+                        f.write("".join(batch).encode('utf-8'))
+                        f.write(f"</{p}sheetData>".encode('utf-8'))
+                        f.write(sheet.tail.encode('utf-8'))
+                    continue
+                data = source.read(info.filename)
+                if calc_chain is not None and info.filename == CONTENT_TYPES_PART:
+                    data = re.sub(rb'<Override[^>]*PartName="/' + re.escape(calc_chain.encode('utf-8')) + rb'"[^>]*/>',
+                                  b"", data)
+                elif calc_chain is not None and info.filename == rels_part(self.workbook_part):
+                    data = re.sub(rb'<Relationship[^>]*Type="[^"]*/calcChain"[^>]*/>', b"", data)
+                target.writestr(info, data)
+        os.replace(temp_file, output_file)
@@ -0,0 +1,145 @@
+import os
+from io import BytesIO
+from pathlib import Path
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 步骤之间传递数据的格式：xlsx（默认）或 parquet（需要安装pyarrow）
+INTERMEDIATE_FORMATS = ('xlsx', 'parquet')
+
+def read_config_value(config_file, name, default=None):
+    """从配置文件中读取一个配置项"""
+    if os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    if key.strip() == name:
+                        return value.strip()
+    return default
+
+def get_intermediate_format(config_file):
+    """读取INTERMEDIATE_FORMAT；选择parquet但未安装pyarrow时使用xlsx"""
+    value = (read_config_value(config_file, 'INTERMEDIATE_FORMAT') or 'xlsx').lower()
+    if value not in INTERMEDIATE_FORMATS:
+        print(f"警告: INTERMEDIATE_FORMAT配置值无效: {value}，使用xlsx")
+        return 'xlsx'
+    if value == 'parquet' and pq is None:
+        print("警告: 未安装pyarrow，INTERMEDIATE_FORMAT=parquet 不可用，使用xlsx")
+        return 'xlsx'
+    return value
+
+def export_intermediate_xlsx(config_file):
+    """读取EXPORT_INTERMEDIATE_XLSX：使用parquet时是否同时导出供人工查看的xlsx"""
+    value = read_config_value(config_file, 'EXPORT_INTERMEDIATE_XLSX') or 'true'
+    return value.lower() in ('true', '1', 'yes')
+
+def to_parquet_frame(df, string_columns=()):
+    """
+    将文本列中的非空值统一转为字符串（Excel读取的列可能混合数字和文本，parquet要求每列类型一致）
+
+    Args:
+        string_columns: 始终作为文本列处理的列（即使这一块中全部为空或都是数字）
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in string_columns or not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value)).astype(object)
+    return df
+
+def parquet_schema(df):
+    """
+    parquet文件的schema：文本列固定为string，数字列按类型推断
+
+    不直接使用第一块推断的类型：某一列在第一块中全部为空时会被推断为null类型，之后有内容的块无法写入
+    """
+    fields = []
+    for field in pa.Schema.from_pandas(df, preserve_index=False):
+        if not pd.api.types.is_numeric_dtype(df[field.name]):
+            field = pa.field(field.name, pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+class ParquetChunkWriter:
+    """
+    分块写入parquet文件，写完后再替换目标文件，避免后续步骤读到不完整的文件
+
+    Args:
+        string_columns: 始终写为string的列（如Add Model的OUTPUT_COLUMNS），其他列按第一块的类型确定
+    """
+
+    def __init__(self, output_path, string_columns=()):
+        self.output_path = Path(output_path)
+        self.temp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+        self.string_columns = list(string_columns)
+        self._writer = None
+        self._schema = None
+
+    def write(self, df_chunk):
+        df_chunk = to_parquet_frame(df_chunk, self.string_columns)
+        if self._writer is None:
+            self._schema = parquet_schema(df_chunk)
+            self._writer = pq.ParquetWriter(self.temp_path, self._schema)
+        self._writer.write_table(pa.Table.from_pandas(df_chunk, schema=self._schema, preserve_index=False))
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self.temp_path, self.output_path)
+
+def find_stage_table(result_dir, stem):
+    """
+    查找步骤之间的中间结果文件（如 Image_Titles_Add_Model）
+
+    parquet和xlsx都存在时使用较新的文件（切换格式后不会读到旧结果）；都不存在时返回None
+    """
+    candidates = [path for path in (Path(result_dir) / f"{stem}.parquet", Path(result_dir) / f"{stem}.xlsx")
+                  if path.exists()]
+    if not candidates:
+        return None
+    if pq is None:
+        candidates = [path for path in candidates if path.suffix != '.parquet'] or candidates
+    return max(candidates, key=lambda path: path.stat().st_mtime_ns)
+
+_table_cache = {}
+
+def read_stage_table(path):
+    """
+    读取中间结果文件（parquet使用内存映射）
+
+    同一文件未修改时直接返回已读取的DataFrame（多个步骤共用，调用方不要修改）
+    """
+    path = Path(path)
+    cache_key = (os.path.abspath(path), path.stat().st_mtime_ns)
+    df = _table_cache.get(cache_key)
+    if df is None:
+        if path.suffix == '.parquet':
+            df = pd.read_parquet(path, engine='pyarrow', memory_map=True)
+        else:
+            df = pd.read_excel(path)
+        _table_cache.clear()
+        _table_cache[cache_key] = df
+    return df
+
+def save_workbook(wb, output_file):
+    """
+    保存工作簿；同一个工作簿可以多次保存（如Organize从同一个工作簿依次保存iPhone和Samsung文件）
+
+    openpyxl保存时会关闭模板中图片的文件对象，因此第一次保存前读取图片数据，每次保存前重新设置
+    """
+    for ws in wb.worksheets:
+        for image in getattr(ws, '_images', []):
+            data = getattr(image, '_stage_data', None)
+            if data is None:
+                data = image._data()
+                image._stage_data = data
+            image.ref = BytesIO(data)
+    wb.save(output_file)
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+# 保存在结果文件夹中的构建清单，删除该文件后所有步骤都会重新运行
+MANIFEST_NAME = ".pipeline_manifest.json"
+
+def file_digest(path):
+    """计算文件内容的SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+class StageManifest:
+    """
+    记录每个步骤的输入内容哈希和输出文件，再次运行时跳过输入未变化的步骤
+
+    - 步骤的键由输入文件的内容哈希和上游步骤的键计算，上游步骤重新运行后下游步骤也会重新运行
+    - 上次的输出文件被删除或修改后，该步骤也会重新运行
+    - 文件大小和修改时间未变化时使用清单中记录的哈希，不重新读取文件
+    """
+
+    def __init__(self, manifest_path):
+        self.path = Path(manifest_path)
+        self.files = {}  # {文件绝对路径: {size, mtime_ns, sha256}}
+        self.stages = {}  # {步骤名称: {key, outputs: {输出文件路径: sha256}}}
+        self._used_files = set()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.files = data.get('files', {})
+                self.stages = data.get('stages', {})
+            except (OSError, ValueError) as e:
+                print(f"读取构建清单时出错: {e}，所有步骤将重新运行")
+
+    def digest(self, path):
+        """返回文件内容的哈希，文件不存在时返回None"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        stat = path.stat()
+        file_key = os.path.abspath(path)
+        self._used_files.add(file_key)
+        cached = self.files.get(file_key)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+        sha256 = file_digest(path)
+        self.files[file_key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        return sha256
+
+    def stage_key(self, inputs, upstream=()):
+        """
+        计算步骤的键
+
+        Args:
+            inputs: {名称: 文件路径}，不存在的文件也参与计算（之后添加该文件时步骤会重新运行）
+            upstream: 上游步骤的键
+        """
+        payload = {
+            'inputs': {name: self.digest(path) for name, path in inputs.items()},
+            'upstream': list(upstream),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def current_outputs(self, stage, key):
+        """步骤的键与上次运行相同且输出文件未被修改时返回上次的输出文件列表，否则返回None"""
+        record = self.stages.get(stage)
+        if record is None or record.get('key') != key:
+            return None
+        outputs = record.get('outputs', {})
+        for output_path, sha256 in outputs.items():
+            if self.digest(output_path) != sha256:
+                return None
+        return [Path(output_path) for output_path in outputs]
+
+    def record(self, stage, key, outputs):
+        """记录步骤成功运行后的键和输出文件，并立即保存清单（后续步骤出错时已完成的步骤仍可跳过）"""
+        self.stages[stage] = {
+            'key': key,
+            'outputs': {str(output_path): self.digest(output_path) for output_path in outputs},
+        }
+        self.save()
+
+    def save(self):
+        # 只保留本次运行用到的文件哈希，避免清单无限增长
+        data = {
+            'files': {path: info for path, info in self.files.items() if path in self._used_files},
+            'stages': self.stages,
+        }
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
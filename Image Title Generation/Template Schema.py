@@ -0,0 +1,87 @@
+import os
+import json
+from pathlib import Path
+
+# 缓存格式的版本，TemplateSchema的字段变化时加1，旧的缓存会被重新生成
+SCHEMA_VERSION = 1
+
+def schema_path(template_file):
+    """模板结构缓存文件，与模板放在同一文件夹，例如 需要的excel文件/.上架模板.xlsm.schema.json"""
+    template_file = Path(template_file)
+    return template_file.with_name(f".{template_file.name}.schema.json")
+
+class TemplateSchema:
+    """
+    上架模板"模板"工作表的结构（行号、列号从1开始）
+
+    只与模板文件内容有关：解析一次后按模板内容哈希保存，之后的运行直接读取，模板修改后重新解析
+    """
+
+    def __init__(self, header_row, data_start_row, parent_reference_row, headers, image_columns,
+                 product_name_col, image_number_columns, model_columns, parent_sku_col, image_url_prefixes):
+        self.header_row = header_row  # 表头所在行
+        self.data_start_row = data_start_row  # 数据起始行
+        self.parent_reference_row = parent_reference_row  # 父类模板行复制的参考行
+        self.headers = headers  # {表头文本: 第一个该表头所在的列}，按列顺序
+        self.image_columns = image_columns  # 主图像链接地址及其后6列
+        self.product_name_col = product_name_col
+        self.image_number_columns = image_number_columns  # 编号列
+        self.model_columns = model_columns  # 型号列
+        self.parent_sku_col = parent_sku_col  # "父条目的库存单位"列，未找到时为None
+        self.image_url_prefixes = image_url_prefixes  # 各图片链接列的链接前缀（来自数据起始行的链接）
+
+    def find_column(self, header_texts):
+        """第一个表头包含任一文本的列，未找到时返回None"""
+        for header, column in self.headers.items():
+            if any(header_text in header for header_text in header_texts):
+                return column
+        return None
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['headers'] = {header: int(column) for header, column in data['headers'].items()}
+        return cls(**data)
+
+def load_template_schema(template_file, template_digest, settings, build_schema):
+    """
+    读取模板结构缓存；模板内容或解析设置变化、缓存不存在或无法读取时调用build_schema()重新解析并保存
+
+    Args:
+        template_digest: 模板文件内容的SHA-256
+        settings: build_schema使用的所有设置（表头行、表头关键字、列字母等），与缓存中记录的不同时重新解析
+        build_schema: 解析模板并返回TemplateSchema的函数
+
+    Returns:
+        tuple: (TemplateSchema, 是否使用了缓存)
+    """
+    cache_file = schema_path(template_file)
+    if cache_file.exists():
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('version') == SCHEMA_VERSION and data.get('template_sha256') == template_digest
+                    and data.get('settings') == settings):
+                return TemplateSchema.from_dict(data['schema']), True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"读取模板结构缓存时出错: {e}，重新解析模板")
+
+    schema = build_schema()
+    data = {
+        'version': SCHEMA_VERSION,
+        'template_sha256': template_digest,
+        'settings': settings,
+        'schema': schema.to_dict(),
+    }
+    temp_file = cache_file.with_name(cache_file.name + ".tmp")
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        # 模板文件夹不可写时只是下次仍需解析
+        print(f"警告: 无法保存模板结构缓存: {e}")
+    return schema, False
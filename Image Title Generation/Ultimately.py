@@ -1,9 +1,13 @@
 import os
+import re
 import sys
+import importlib.util
 from pathlib import Path
 import pandas as pd
 from openpyxl import load_workbook
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.utils import column_index_from_string
+from openpyxl.worksheet.cell_range import CellRange
 
 def get_project_root():
     """获取项目根目录，兼容开发环境和PyInstaller打包环境"""
@@ -27,6 +31,17 @@ def get_project_root():
         project_root = os.path.dirname(os.path.dirname(script_dir))
     return project_root
 
+def load_shared_module(module_name, script_name):
+    """加载同目录下的共用模块（如Model Catalog.py），各个步骤共用同一个模块对象和其中的缓存"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        module_path = Path(os.path.dirname(os.path.abspath(__file__))) / script_name
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    return module
+
 def get_result_folder_from_config(config_file):
     """从配置文件中读取结果文件夹路径"""
     result_folder = None
@@ -49,74 +64,186 @@ def get_result_folder_from_config(config_file):
     os.makedirs(result_folder, exist_ok=True)
     return result_folder
 
-def find_column_by_header(worksheet, header_text, row=4):
+# 复制行格式时使用的样式编号（对应字体、边框、填充、数字格式、保护、对齐）
+STYLE_ID_FIELDS = ('fontId', 'borderId', 'fillId', 'numFmtId', 'protectionId', 'alignmentId')
+
+class RowStyleSnapshot:
     """
-    在指定行中查找包含特定文本的列
+    参考行（如第7行父类模板行）每一列的样式编号，用于把该行的格式复制到新行
     
-    Args:
-        worksheet: Excel工作表对象
-        header_text: 要查找的表头文本
-        row: 查找的行号，默认为4
+    每一列只在第一次复制时按字体、边框等样式对象赋值一次，记录得到的样式编号，
+    之后的单元格直接写入这些编号，不再为每个单元格复制样式对象（保存时也不需要逐个去重）
+    """
     
-    Returns:
-        int: 找到的列号，如果未找到返回None
+    def __init__(self, worksheet, row):
+        self.worksheet = worksheet
+        self.row = row
+        self._style_ids = {}  # {列号: 样式编号元组}
+    
+    def apply(self, target_cell):
+        """将参考行同一列的格式复制到target_cell"""
+        style_ids = self._style_ids.get(target_cell.column)
+        if style_ids is None:
+            source_cell = self.worksheet.cell(row=self.row, column=target_cell.column)
+            target_cell.font = source_cell.font.copy()
+            target_cell.border = source_cell.border.copy()
+            target_cell.fill = source_cell.fill.copy()
+            target_cell.number_format = source_cell.number_format
+            target_cell.protection = source_cell.protection.copy()
+            target_cell.alignment = source_cell.alignment.copy()
+            self._style_ids[target_cell.column] = tuple(
+                getattr(target_cell._style, field) for field in STYLE_ID_FIELDS)
+        else:
+            if target_cell._style is None:
+                target_cell._style = StyleArray()
+            for field, style_id in zip(STYLE_ID_FIELDS, style_ids):
+                setattr(target_cell._style, field, style_id)
+
+# 以下设置都是模板结构缓存的键（见template_schema_settings），修改后缓存会自动重新生成
+# 上架模板的固定行：第4行为表头，第7行为父类模板行的参考行，数据从第8行开始
+HEADER_ROW = 4
+PARENT_REFERENCE_ROW = 7
+DATA_START_ROW = 8
+
+# 定义需要填入“编号”（如 GYCYF000188）和“型号”（如 iPhone X）的列字母列表
+# 你可以直接在这里修改列字母，例如 ["CU", "B", "BC"]
+IMAGE_NUMBER_COL_LETTERS = ["BC", "BK"]  #编号
+MODEL_COL_LETTERS = ["BE", "BX", "CU"]
+
+# 查找各列时使用的表头关键字（表头包含任一关键字即可）
+MAIN_IMAGE_HEADERS = ["主图像链接地址", "Main Image URL"]
+IMAGE_COLUMN_COUNT = 7  # 主图像链接地址列及其后面6列
+PRODUCT_NAME_HEADERS = ["产品名称", "产品名", "Product Name", "item_name"]
+DEFAULT_PRODUCT_NAME_COL = 4  # 未找到产品名称列时使用的列
+PARENT_SKU_HEADERS = ["父条目的库存单位"]
+
+# 模板第8行图片链接的格式，例如 http://geyishuma.com/GYFGCX0031GYFGCX0060/GYFGCX0031iPhone12.MAIN.jpg
+IMAGE_URL_PATTERN = r'(http://[^/]+/)([^/]+/)([^.]+)(\..+)$'
+# 模板中没有可用的图片链接时使用的链接前缀
+DEFAULT_IMAGE_URL_PREFIX = "http://geyishuma.com/GYFGCX0031GYFGCX0060/"
+
+def image_url_prefix(template_url):
+    """
+    从模板中的图片链接提取新链接使用的前缀
+    
+    例如: http://geyishuma.com/GYFGCX0031GYFGCX0060/GYFGCX0031iPhone12.MAIN.jpg -> http://geyishuma.com/GYFGCX0031GYFGCX0060/
+    模板中没有URL、不是字符串或无法解析URL格式时使用DEFAULT_IMAGE_URL_PREFIX
     """
-    for col in range(1, worksheet.max_column + 1):
-        cell_value = worksheet.cell(row=row, column=col).value
-        if cell_value and header_text in str(cell_value):
-            return col
-    return None
+    if template_url and isinstance(template_url, str):
+        match = re.search(IMAGE_URL_PATTERN, template_url)
+        if match:
+            return match.group(1) + match.group(2)
+    return DEFAULT_IMAGE_URL_PREFIX
 
-def find_first_column_by_header(worksheet, header_text, row=4):
+def build_image_url(url_prefix, new_sku, col_idx):
     """
-    在指定行中查找第一个包含特定文本的列（用于有多个同名列的情况）
+    生成新SKU的图片链接
     
     Args:
-        worksheet: Excel工作表对象
-        header_text: 要查找的表头文本
-        row: 查找的行号，默认为4
-    
-    Returns:
-        int: 找到的第一个列号，如果未找到返回None
+        url_prefix: 该列的链接前缀（见image_url_prefix）
+        new_sku: 新的SKU
+        col_idx: 第几个图片链接列（0为主图像链接地址）
     """
-    for col in range(1, worksheet.max_column + 1):
-        cell_value = worksheet.cell(row=row, column=col).value
-        if cell_value and header_text in str(cell_value):
-            return col
-    return None
+    if col_idx == 0:
+        # 第一列（主图像链接地址）使用.MAIN
+        return f"{url_prefix}{new_sku}.MAIN.jpg"
+    # 其他列（其他图片链接地址）使用.PT加两位数字格式
+    return f"{url_prefix}{new_sku}.PT{col_idx:02d}.jpg"
 
-def find_column_by_multiple_headers(worksheet, header_texts, row=4):
+def column_letters_to_indexes(letters, description):
+    """将列字母列表转换为列号列表，无法解析的列字母跳过"""
+    columns = []
+    for letter in letters:
+        try:
+            columns.append(column_index_from_string(letter))
+        except Exception as e:
+            print(f"警告: 无法解析{description}列字母 '{letter}': {e}")
+    return columns
+
+def template_schema_settings():
+    """build_template_schema使用的所有设置，作为模板结构缓存的键（修改其中任一设置后重新解析模板）"""
+    return {
+        'header_row': HEADER_ROW,
+        'parent_reference_row': PARENT_REFERENCE_ROW,
+        'data_start_row': DATA_START_ROW,
+        'image_number_columns': IMAGE_NUMBER_COL_LETTERS,
+        'model_columns': MODEL_COL_LETTERS,
+        'main_image_headers': MAIN_IMAGE_HEADERS,
+        'image_column_count': IMAGE_COLUMN_COUNT,
+        'product_name_headers': PRODUCT_NAME_HEADERS,
+        'default_product_name_col': DEFAULT_PRODUCT_NAME_COL,
+        'parent_sku_headers': PARENT_SKU_HEADERS,
+        'image_url_pattern': IMAGE_URL_PATTERN,
+        'default_image_url_prefix': DEFAULT_IMAGE_URL_PREFIX,
+    }
+
+def build_template_schema(ws):
     """
-    在指定行中查找包含任一文本的列
+    解析"模板"工作表的结构：读取一次第4行表头，确定需要填写的列和第8行的图片链接格式
     
     Args:
-        worksheet: Excel工作表对象
-        header_texts: 要查找的表头文本列表
-        row: 查找的行号，默认为4
+        ws: "模板"工作表（openpyxl工作表，或提供相同cell()/max_column接口的对象）
     
     Returns:
-        int: 找到的列号，如果未找到返回None
+        TemplateSchema
     """
-    for col in range(1, worksheet.max_column + 1):
-        cell_value = worksheet.cell(row=row, column=col).value
-        if cell_value and any(header_text in str(cell_value) for header_text in header_texts):
-            return col
-    return None
-
-def main():
-    # 获取项目根目录
-    project_root = get_project_root()
-    print(f"Ultimately 脚本 - 项目根目录: {project_root}")
+    template_schema = load_shared_module('template_schema', "Template Schema.py")
     
-    # 从配置文件读取结果文件夹路径
-    # config_file = Path(project_root) / "Release" / "config.txt"
-    config_file = Path(project_root)  / "config.txt"
-    result_dir = get_result_folder_from_config(config_file)
+    headers = {}
+    for col in range(1, ws.max_column + 1):
+        cell_value = ws.cell(row=HEADER_ROW, column=col).value
+        if cell_value:
+            headers.setdefault(str(cell_value), col)
+    schema = template_schema.TemplateSchema(
+        header_row=HEADER_ROW, data_start_row=DATA_START_ROW, parent_reference_row=PARENT_REFERENCE_ROW,
+        headers=headers, image_columns=[], product_name_col=None,
+        image_number_columns=column_letters_to_indexes(IMAGE_NUMBER_COL_LETTERS, "编号"),
+        model_columns=column_letters_to_indexes(MODEL_COL_LETTERS, "型号"),
+        parent_sku_col=None, image_url_prefixes=[])
     
-    # 输入文件和模板文件路径
-    input_excel = Path(result_dir) / "Image_Titles_Add_Model.xlsx"
+    # 查找"主图像链接地址"或"Main Image URL"列，确定7个图片链接列（主图像链接地址列及其后面6列）
+    main_image_column = schema.find_column(MAIN_IMAGE_HEADERS)
+    if main_image_column:
+        schema.image_columns = list(range(main_image_column, main_image_column + IMAGE_COLUMN_COUNT))
+        print(f"找到主图像列: 第{main_image_column}列")
+    else:
+        print("警告: 未找到'主图像链接地址'或'Main Image URL'列，请检查列范围")
     
-    # 查找模板文件，模糊匹配包含"上架模板"的文件
+    # 各图片链接列按模板第8行的链接格式生成
+    schema.image_url_prefixes = [image_url_prefix(ws.cell(row=DATA_START_ROW, column=col).value)
+                                 for col in schema.image_columns]
+    
+    schema.product_name_col = schema.find_column(PRODUCT_NAME_HEADERS)
+    if not schema.product_name_col:
+        print(f"警告: 未找到'产品名称'列，默认使用第{DEFAULT_PRODUCT_NAME_COL}列")
+        schema.product_name_col = DEFAULT_PRODUCT_NAME_COL
+    
+    schema.parent_sku_col = schema.find_column(PARENT_SKU_HEADERS)
+    return schema
+
+def get_template_schema(template_file, ws):
+    """
+    返回模板结构：按模板文件内容哈希缓存在模板旁边，模板未修改时不再解析表头
+    
+    Args:
+        template_file: 上架模板文件路径
+        ws: 已加载的"模板"工作表，需要重新解析时使用
+    """
+    template_schema = load_shared_module('template_schema', "Template Schema.py")
+    template_digest = load_shared_module('stage_manifest', "Stage Manifest.py").file_digest(template_file)
+    schema, cached = template_schema.load_template_schema(
+        template_file, template_digest, template_schema_settings(), lambda: build_template_schema(ws))
+    if cached:
+        print(f"使用模板结构缓存: {template_schema.schema_path(template_file).name}")
+    
+    print(f"产品名称列: {schema.product_name_col}")
+    print(f"编号列 (字母: {IMAGE_NUMBER_COL_LETTERS}) -> 索引: {schema.image_number_columns}")
+    print(f"型号列 (字母: {MODEL_COL_LETTERS}) -> 索引: {schema.model_columns}")
+    print(f"图片链接列: {schema.image_columns}")
+    return schema
+
+def find_template_file(project_root):
+    """查找模板文件，模糊匹配"需要的excel文件"中包含"上架模板"的文件"""
     template_dir = Path(project_root) / "需要的excel文件"
     template_file = None
     
@@ -139,570 +266,668 @@ def main():
         for extension in excel_extensions:
             available_files.extend(template_dir.glob(extension))
         raise FileNotFoundError(f"在 {template_dir} 目录中未找到包含'上架模板'的文件。可用的文件: {[f.name for f in available_files]}")
+    return template_file
+
+# Add Model生成的数据中必须包含的列
+REQUIRED_COLUMNS = ['图片名称', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译', '图片编号', '型号']
+
+# 生成Final_Template的方式：openpyxl（默认，加载并修改整个工作簿）或 xml（只重新生成"模板"工作表的XML）
+TEMPLATE_WRITERS = ('openpyxl', 'xml')
+
+def get_template_writer(config_file):
+    """读取TEMPLATE_WRITER配置"""
+    value = (load_shared_module('stage_data', "Stage Data.py").read_config_value(config_file, 'TEMPLATE_WRITER')
+             or 'openpyxl').lower()
+    if value not in TEMPLATE_WRITERS:
+        print(f"警告: TEMPLATE_WRITER配置值无效: {value}，使用openpyxl")
+        return 'openpyxl'
+    return value
+
+def fill_template(df_input, template_file):
+    """
+    将Add Model生成的数据填入上架模板的"模板"工作表，并插入父类模板行
     
-    # 输出文件路径
-    output_file = Path(result_dir) / "Final_Template.xlsm"
+    Args:
+        df_input: Add Model生成的DataFrame
+        template_file: 上架模板文件路径
     
-    # 检查输入文件是否存在
-    if not input_excel.exists():
-        print(f"输入文件不存在: {input_excel}")
-        return
+    Returns:
+        Workbook: 填充后的工作簿（尚未保存）；输入数据缺少必要的列时返回None
+    """
+    print(f"输入数据包含 {len(df_input)} 行")
     
-    # 检查模板文件是否存在
-    if template_file is None or not template_file.exists():
-        print(f"模板文件不存在: {template_file}")
-        return
+    # 检查必要的列是否存在
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df_input.columns]
+    if missing_columns:
+        print(f"输入数据缺少必要的列: {missing_columns}")
+        return None
     
-    print(f"正在读取输入文件: {input_excel}")
-    print(f"正在读取模板文件: {template_file}")
+
+    # 加载模板文件
+    print("正在加载模板文件...")
+    wb = load_workbook(template_file, keep_vba=True)  # 保持VBA宏
     
-    try:
-        # 读取Excel文件
-        df_input = pd.read_excel(input_excel)
-        print(f"输入文件包含 {len(df_input)} 行数据")
-        
-        # 检查必要的列是否存在
-        required_columns = ['图片名称', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译', '图片编号', '型号']
-        missing_columns = [col for col in required_columns if col not in df_input.columns]
-        if missing_columns:
-            print(f"输入文件缺少必要的列: {missing_columns}")
-            return
-        
-        # 加载模板文件
-        print("正在加载模板文件...")
-        wb = load_workbook(template_file, keep_vba=True)  # 保持VBA宏
-        
-        # 尝试获取工作表，支持"模板"和"Template"两种名称
-        template_sheet_names = ["模板", "Template"]
-        ws = None
-        for sheet_name in template_sheet_names:
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                print(f"找到工作表: {sheet_name}")
-                break
-        
-        # 如果都没找到，抛出异常
-        if ws is None:
-            raise ValueError(f"模板文件中未找到工作表: {template_sheet_names}。可用的工作表: {wb.sheetnames}")
-        
-        print(f"工作表最大行数: {ws.max_row}")
-        print(f"工作表最大列数: {ws.max_column}")
-        
-        # 图片区域位置（根据调试信息，我们知道在第4行）
-        image_start_row = 4  # 直接设置为第4行，如调试脚本确认的那样
-        
-        # 动态查找"主图像链接地址"列并确定图片链接列范围
-        image_columns = []
-        main_image_column = None
-        
-        # 查找"主图像链接地址"或"Main Image URL"列
-        main_image_keywords = ["主图像链接地址", "Main Image URL"]
-        for col in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=image_start_row, column=col).value
-            if cell_value and any(keyword in str(cell_value) for keyword in main_image_keywords):
-                main_image_column = col
-                print(f"找到主图像列: {cell_value} (第{col}列)")
-                break
-        
-        # 如果找到了"主图像链接地址"列，则确定7个图片链接列（主图像链接地址列及其后面6列）
-        if main_image_column:
-            image_columns = list(range(main_image_column, main_image_column + 7))
-            print(f"动态找到图片链接列: {image_columns} (从第{main_image_column}列开始的7列)")
-        else:
-            # 如果没找到，使用默认的列范围（回退到原来的处理方式）
-            print("警告: 未找到'主图像链接地址'或'Main Image URL'列，请检查列范围")
-        
-        # 动态查找其他需要替换的列
-        product_name_col = find_column_by_multiple_headers(ws, ["产品名称", "产品名", "Product Name", "item_name"])  # 产品名称列
-        
-        # 定义需要填入“编号”（如 GYCYF000188）和“型号”（如 iPhone X）的列字母列表
-        # 你可以直接在这里修改列字母，例如 ["CU", "B", "BC"]
-        image_number_col_letters = ["BC", "BK"]  #编号
-        model_col_letters = ["BE", "BX", "CU"]
-        
-        # 将列字母转换为索引列表
-        image_number_columns = []
-        for letter in image_number_col_letters:
-            try:
-                col_idx = column_index_from_string(letter)
-                image_number_columns.append(col_idx)
-            except Exception as e:
-                print(f"警告: 无法解析编号列字母 '{letter}': {e}")
+    # 尝试获取工作表，支持"模板"和"Template"两种名称
+    template_sheet_names = ["模板", "Template"]
+    ws = None
+    for sheet_name in template_sheet_names:
+        if sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+            print(f"找到工作表: {sheet_name}")
+            break
+    
+    # 如果都没找到，抛出异常
+    if ws is None:
+        raise ValueError(f"模板文件中未找到工作表: {template_sheet_names}。可用的工作表: {wb.sheetnames}")
+    
+    print(f"工作表最大行数: {ws.max_row}")
+    print(f"工作表最大列数: {ws.max_column}")
+    
+    schema = get_template_schema(template_file, ws)
+    image_columns = schema.image_columns
+    product_name_col = schema.product_name_col
+    image_number_columns = schema.image_number_columns
+    model_columns = schema.model_columns
+    
+    # SKU列
+    sku_col = 1  # A列
+    # product_name_col 已经在上方动态确定了
+    
+    # 创建SKU映射列表（按顺序）
+    sku_mapping_list = []  # 按顺序存储新SKU
+    product_name_mapping_list = []  # 按顺序存储新产品名称
+    image_number_mapping_list = []  # 按顺序存储图片编号
+    model_type_mapping_list = []  # 按顺序存储型号
+    
+    # 填充映射列表
+    for i in range(len(df_input)):
+        new_sku = str(df_input.iloc[i]['图片名称'])
+        new_product_name = str(df_input.iloc[i]['亚马逊产品标题'])
+        image_number = str(df_input.iloc[i]['图片编号'])
+        model_type = str(df_input.iloc[i]['型号'])
+        
+        sku_mapping_list.append(new_sku)
+        product_name_mapping_list.append(new_product_name)
+        image_number_mapping_list.append(image_number)
+        model_type_mapping_list.append(model_type)
+    
+    print(f"映射关系已建立，总计 {len(sku_mapping_list)} 个映射")
+    
+    # 显示前5个映射
+    print("前5个映射:")
+    for i in range(min(5, len(sku_mapping_list))):
+        print(f"  映射 {i}: {sku_mapping_list[i][:30]}...")
+    
+    # 步骤1: 替换SKU和产品名称（替换整列）
+    print("\n开始替换SKU和产品名称...")
+    
+    # 数据从第8行开始（如用户要求）
+    data_start_row = schema.data_start_row
+    print(f"数据从第 {data_start_row} 行开始")
+    
+    # 收集所有有效的SKU行
+    valid_rows = []  # 存储 (行号, 原始SKU) 元组
+    row_idx = data_start_row
+    
+    while row_idx <= ws.max_row:
+        # 检查当前行是否有SKU数据
+        sku_cell = ws.cell(row=row_idx, column=sku_col).value
+        if sku_cell and str(sku_cell).strip():
+            original_sku = str(sku_cell)
+            valid_rows.append((row_idx, original_sku))
+        row_idx += 1
+    
+    print(f"在模板中找到 {len(valid_rows)} 个有效的数据行")
+    
+    # 检查是否需要添加更多行以容纳所有数据
+    if len(df_input) > len(valid_rows):
+        rows_needed = len(df_input) - len(valid_rows)
+        print(f"需要添加 {rows_needed} 行以容纳所有数据")
+        
+        # 新行都使用最后一个数据行的格式（每列的样式只计算一次）
+        last_row_style = RowStyleSnapshot(ws, valid_rows[-1][0] if valid_rows else data_start_row)
+        
+        # 在末尾添加新行
+        for i in range(rows_needed):
+            # 从最后一行复制格式
+            last_row_idx = valid_rows[-1][0] if valid_rows else data_start_row
+            new_row_idx = ws.max_row + 1
+            
+            # 从最后一行复制行格式和公式
+            for col in range(1, ws.max_column + 1):
+                source_cell = ws.cell(row=last_row_idx, column=col)
+                target_cell = ws.cell(row=new_row_idx, column=col)
                 
-        model_columns = []
-        for letter in model_col_letters:
-            try:
-                col_idx = column_index_from_string(letter)
-                model_columns.append(col_idx)
-            except Exception as e:
-                print(f"警告: 无法解析型号列字母 '{letter}': {e}")
-        
-        # 检查是否找到所有必需的列
-        if not product_name_col:
-            print("警告: 未找到'产品名称'列，默认使用第4列")
-            product_name_col = 4
-        
-        print(f"动态找到的列 - 产品名称: {product_name_col}")
-        print(f"指定的编号列 (字母: {image_number_col_letters}) -> 索引: {image_number_columns}")
-        print(f"指定的型号列 (字母: {model_col_letters}) -> 索引: {model_columns}")
-        
-        print(f"图片链接列: {image_columns}")
-        
-        # SKU列
-        sku_col = 1  # A列
-        # product_name_col 已经在上方动态确定了
-        
-        # 创建SKU映射列表（按顺序）
-        sku_mapping_list = []  # 按顺序存储新SKU
-        product_name_mapping_list = []  # 按顺序存储新产品名称
-        image_number_mapping_list = []  # 按顺序存储图片编号
-        model_type_mapping_list = []  # 按顺序存储型号
-        
-        # 填充映射列表
-        for i in range(len(df_input)):
-            new_sku = str(df_input.iloc[i]['图片名称'])
-            new_product_name = str(df_input.iloc[i]['亚马逊产品标题'])
-            image_number = str(df_input.iloc[i]['图片编号'])
-            model_type = str(df_input.iloc[i]['型号'])
+                # 复制值（但我们稍后会覆盖SKU和产品名称）
+                target_cell.value = source_cell.value
+                
+                # 复制格式
+                last_row_style.apply(target_cell)
             
-            sku_mapping_list.append(new_sku)
-            product_name_mapping_list.append(new_product_name)
-            image_number_mapping_list.append(image_number)
-            model_type_mapping_list.append(model_type)
-        
-        print(f"映射关系已建立，总计 {len(sku_mapping_list)} 个映射")
-        
-        # 显示前5个映射
-        print("前5个映射:")
-        for i in range(min(5, len(sku_mapping_list))):
-            print(f"  映射 {i}: {sku_mapping_list[i][:30]}...")
-        
-        # 步骤1: 替换SKU和产品名称（替换整列）
-        print("\n开始替换SKU和产品名称...")
-        
-        # 数据从第8行开始（如用户要求）
-        data_start_row = 8
-        print(f"数据从第 {data_start_row} 行开始")
-        
-        # 收集所有有效的SKU行
-        valid_rows = []  # 存储 (行号, 原始SKU) 元组
-        row_idx = data_start_row
+            # 添加到valid_rows，使用空SKU（稍后会填充）
+            valid_rows.append((new_row_idx, ""))
         
-        while row_idx <= ws.max_row:
-            # 检查当前行是否有SKU数据
-            sku_cell = ws.cell(row=row_idx, column=sku_col).value
-            if sku_cell and str(sku_cell).strip():
-                original_sku = str(sku_cell)
-                valid_rows.append((row_idx, original_sku))
-            row_idx += 1
-        
-        print(f"在模板中找到 {len(valid_rows)} 个有效的数据行")
+        print(f"已添加 {rows_needed} 个新行")
+    
+    # 遍历有效行进行替换
+    sku_replacement_count = 0
+    product_name_replacement_count = 0
+    
+    # 记录要保留的行号
+    rows_to_keep = set()
+    
+    for i, (row_idx, original_sku) in enumerate(valid_rows):
+        # 检查是否有对应的映射
+        if i < len(sku_mapping_list):
+            # 替换SKU
+            new_sku = sku_mapping_list[i]
+            ws.cell(row=row_idx, column=sku_col).value = new_sku
+            sku_replacement_count += 1
+            
+            # 添加到保留集合
+            rows_to_keep.add(row_idx)
+            
+            # 显示前5个替换
+            if sku_replacement_count <= 5:
+                print(f"  替换SKU (第 {row_idx} 行): {original_sku[:30]}... -> {new_sku[:30]}...")
+            
+            # 替换产品名称
+            new_product_name = product_name_mapping_list[i]
+            ws.cell(row=row_idx, column=product_name_col).value = new_product_name
+            product_name_replacement_count += 1
+            
+            # 显示前5个替换
+            if product_name_replacement_count <= 5:
+                print(f"  替换产品名称 (第 {row_idx} 行): {new_product_name[:50]}...")
         
-        # 检查是否需要添加更多行以容纳所有数据
-        if len(df_input) > len(valid_rows):
-            rows_needed = len(df_input) - len(valid_rows)
-            print(f"需要添加 {rows_needed} 行以容纳所有数据")
+        # 显示进度
+        if (i + 1) % 100 == 0:
+            print(f"  已处理 {i + 1} 行...")
+    
+    print(f"总计替换了 {sku_replacement_count} 个SKU")
+    print(f"总计替换了 {product_name_replacement_count} 个产品名称")
+    
+    # 步骤2: 更新图片链接中的SKU（替换整列）
+    print("\n开始更新图片链接...")
+    
+    # 遍历有效行进行图片链接更新
+    processed_rows = 0
+    updated_links_count = 0
+    
+    for i, (row_idx, original_sku) in enumerate(valid_rows):
+        # 检查是否有对应的映射
+        if i < len(sku_mapping_list):
+            new_sku = sku_mapping_list[i]
             
-            # 在末尾添加新行
-            for i in range(rows_needed):
-                # 从最后一行复制格式
-                last_row_idx = valid_rows[-1][0] if valid_rows else data_start_row
-                new_row_idx = ws.max_row + 1
+            # 更新图片链接列（只处理找到的7个图片链接列）
+            row_updated_links = 0
+            for col_idx, col in enumerate(image_columns):
+                link_cell = ws.cell(row=row_idx, column=col)
                 
-                # 从最后一行复制行格式和公式
-                for col in range(1, ws.max_column + 1):
-                    source_cell = ws.cell(row=last_row_idx, column=col)
-                    target_cell = ws.cell(row=new_row_idx, column=col)
-                    
-                    # 复制值（但我们稍后会覆盖SKU和产品名称）
-                    target_cell.value = source_cell.value
-                    
-                    # 复制格式
-                    target_cell.font = source_cell.font.copy()
-                    target_cell.border = source_cell.border.copy()
-                    target_cell.fill = source_cell.fill.copy()
-                    target_cell.number_format = source_cell.number_format
-                    target_cell.protection = source_cell.protection.copy()
-                    target_cell.alignment = source_cell.alignment.copy()
+                # 按模板第8行对应列的图片链接格式生成
+                image_url = build_image_url(schema.image_url_prefixes[col_idx], new_sku, col_idx)
                 
-                # 添加到valid_rows，使用空SKU（稍后会填充）
-                valid_rows.append((new_row_idx, ""))
+                # 设置图片链接
+                link_cell.value = image_url
+                row_updated_links += 1
+                updated_links_count += 1
             
-            print(f"已添加 {rows_needed} 个新行")
-        
-        # 遍历有效行进行替换
-        sku_replacement_count = 0
-        product_name_replacement_count = 0
-        
-        # 记录要保留的行号
-        rows_to_keep = set()
+            if row_updated_links > 0 and processed_rows < 5:  # 显示前5个更新
+                print(f"  更新图片链接 (第 {row_idx} 行) {original_sku[:30]}... -> {new_sku[:30]}... ({row_updated_links} 个链接)")
+            
+            processed_rows += 1
         
+        # 显示进度
+        if (i + 1) % 100 == 0:
+            print(f"  已处理 {i + 1} 行...")
+    
+    print(f"总计处理了 {processed_rows} 行，更新了 {updated_links_count} 个图片链接")
+    
+    # 步骤3: 替换编号列内容（如零件编号）
+    print("\n开始替换编号相关列...")
+    
+    image_number_replaced_count = 0
+    
+    if image_number_columns:
+        for i, (row_idx, original_sku) in enumerate(valid_rows):
+            if i < len(image_number_mapping_list) and row_idx >= data_start_row:
+                new_image_number = image_number_mapping_list[i]
+                for col in image_number_columns:
+                    ws.cell(row=row_idx, column=col).value = new_image_number
+                image_number_replaced_count += 1
+        print(f"总计替换了 {len(image_number_columns)} 个列中的 {image_number_replaced_count} 行编号数据")
+    else:
+        print("未找到任何编号列，跳过替换")
+    
+    # 步骤4: 替换型号相关列内容（如型号、兼容设备等）
+    print("\n开始替换型号相关列...")
+    
+    model_replaced_count = 0
+    
+    if model_columns:
         for i, (row_idx, original_sku) in enumerate(valid_rows):
-            # 检查是否有对应的映射
-            if i < len(sku_mapping_list):
-                # 替换SKU
-                new_sku = sku_mapping_list[i]
-                ws.cell(row=row_idx, column=sku_col).value = new_sku
-                sku_replacement_count += 1
+            if i < len(model_type_mapping_list) and row_idx >= data_start_row:
+                new_model_type = model_type_mapping_list[i]
+                for col in model_columns:
+                    ws.cell(row=row_idx, column=col).value = new_model_type
+                model_replaced_count += 1
+        print(f"总计替换了 {len(model_columns)} 个列中的 {model_replaced_count} 行型号数据")
+    else:
+        print("未找到任何型号列，跳过替换")
+    
+    # 步骤7: 删除多余行
+    print("\n开始删除多余行...")
+    rows_deleted = 0
+    
+    # 将要删除的行合并为连续区间（从下往上），每个区间只调用一次delete_rows
+    # 逐行删除时每次都要移动下方所有单元格，按区间删除的结果相同
+    delete_ranges = []  # [(起始行, 行数), ...]
+    for row_idx in range(ws.max_row, data_start_row - 1, -1):
+        if row_idx in rows_to_keep:
+            continue
+        if delete_ranges and delete_ranges[-1][0] == row_idx + 1:
+            delete_ranges[-1] = (row_idx, delete_ranges[-1][1] + 1)
+        else:
+            delete_ranges.append((row_idx, 1))
+
+    # 从最后一个区间向上删除以避免行号变化
+    for start_row, amount in delete_ranges:
+        ws.delete_rows(start_row, amount)
+        rows_deleted += amount
+
+    print(f"删除了 {rows_deleted} 个多余行")
+    
+    # 步骤8: 统计产品名称列字符数并在最后一列显示
+    print(f"\n开始统计第 {product_name_col} 列字符数...")
+    
+    # 获取最后一列的索引
+    last_col = ws.max_column + 1  # 在最后一列之后添加新列
+    
+    # 统计字符数并写入最后一列
+    char_count_added = 0
+    for i, (row_idx, original_sku) in enumerate(valid_rows):
+        if row_idx >= data_start_row:
+            # 获取产品名称列的值
+            name_cell_value = ws.cell(row=row_idx, column=product_name_col).value
+            if name_cell_value is not None:
+                # 计算字符数
+                char_count = len(str(name_cell_value))
+                # 在最后一列写入字符数
+                ws.cell(row=row_idx, column=last_col).value = char_count
+                char_count_added += 1
                 
-                # 添加到保留集合
-                rows_to_keep.add(row_idx)
+                # 显示前5个统计
+                if char_count_added <= 5:
+                    print(f"  第 {row_idx} 行产品名称字符数: {char_count}")
+    
+    print(f"总计为 {char_count_added} 行添加了字符数统计")
+    
+    # 自动插入父类模板行
+    print("\n开始自动插入父类模板行...")
+    try:
+        # "父条目的库存单位"列
+        parent_sku_col = schema.parent_sku_col
+        
+        if parent_sku_col:
+            print(f"找到'父条目的库存单位'列，位于第 {parent_sku_col} 列")
+            
+            # 父类编号信息来自与填充数据相同的输入数据，检查是否有父类编号列
+            if '父类编号' in df_input.columns:
+                # 按父类编号分组统计数据
+                parent_stats = df_input.groupby('父类编号').size().reset_index(name='count')
+                print(f"找到 {len(parent_stats)} 个父类编号")
                 
-                # 显示前5个替换
-                if sku_replacement_count <= 5:
-                    print(f"  替换SKU (第 {row_idx} 行): {original_sku[:30]}... -> {new_sku[:30]}...")
+                # 收集所有需要处理的SKU及其对应的父类编号
+                sku_to_parent = {}
+                for idx, row in df_input.iterrows():
+                    sku = row['图片名称']
+                    parent_id = row['父类编号']
+                    sku_to_parent[sku] = parent_id
                 
-                # 替换产品名称
-                new_product_name = product_name_mapping_list[i]
-                ws.cell(row=row_idx, column=product_name_col).value = new_product_name
-                product_name_replacement_count += 1
+                # 收集所有唯一的父类编号，按出现顺序排列
+                unique_parents = []
+                seen_parents = set()
+                for sku in sku_to_parent:
+                    parent_id = sku_to_parent[sku]
+                    if parent_id not in seen_parents:
+                        unique_parents.append(parent_id)
+                        seen_parents.add(parent_id)
                 
-                # 显示前5个替换
-                if product_name_replacement_count <= 5:
-                    print(f"  替换产品名称 (第 {row_idx} 行): {new_product_name[:50]}...")
-            
-            # 显示进度
-            if (i + 1) % 100 == 0:
-                print(f"  已处理 {i + 1} 行...")
-        
-        print(f"总计替换了 {sku_replacement_count} 个SKU")
-        print(f"总计替换了 {product_name_replacement_count} 个产品名称")
-        
-        # 步骤2: 更新图片链接中的SKU（替换整列）
-        print("\n开始更新图片链接...")
-        
-        # 遍历有效行进行图片链接更新
-        processed_rows = 0
-        updated_links_count = 0
-        
-        for i, (row_idx, original_sku) in enumerate(valid_rows):
-            # 检查是否有对应的映射
-            if i < len(sku_mapping_list):
-                new_sku = sku_mapping_list[i]
+                print(f"需要处理的父类编号顺序: {unique_parents}")
+                
+                # 先在内存中确定最终的行顺序（每个父类的第一个子类行之前插入父类行），再一次性移动数据区域
+                # 逐个insert_rows时每次插入都要移动下方所有行
+                parent_positions = []  # [(第一个子类行的原行号, 父类编号), ...]，按行号从小到大
+                child_rows = []  # [(原行号, 父类编号), ...]
+                processed_parents = set()
                 
-                # 更新图片链接列（只处理找到的7个图片链接列）
-                row_updated_links = 0
-                for col_idx, col in enumerate(image_columns):
-                    link_cell = ws.cell(row=row_idx, column=col)
+                # 从第8行开始遍历数据行，收集插入位置和子类行
+                max_row = ws.max_row
+                for row_idx in range(data_start_row, max_row + 1):
+                    # 获取SKU值来查找对应的父类编号
+                    sku_cell = ws.cell(row=row_idx, column=1)  # SKU在A列
+                    if sku_cell.value:
+                        sku_value = str(sku_cell.value)
+                        # 在输入数据中查找对应的父类编号
+                        if sku_value in sku_to_parent:
+                            parent_id = sku_to_parent[sku_value]
+                            child_rows.append((row_idx, parent_id))
+                            
+                            # 如果这是该父类的第一行且尚未处理过
+                            if parent_id not in processed_parents:
+                                processed_parents.add(parent_id)
+                                parent_positions.append((row_idx, parent_id))
+                
+                # 原第r行最终下移的行数 = 位于第r行及之前的父类行数量
+                # 按区间从下往上移动：第i个父类行到第i+1个父类行之间的数据整体下移i行
+                max_col = ws.max_column
+                for i in range(len(parent_positions), 0, -1):
+                    segment_start = parent_positions[i - 1][0]
+                    segment_end = parent_positions[i][0] - 1 if i < len(parent_positions) else max_row
+                    if segment_start <= segment_end:
+                        ws.move_range(CellRange(min_col=1, min_row=segment_start,
+                                                max_col=max_col, max_row=segment_end), rows=i)
+                
+                # 在空出的位置写入父类模板行
+                inserted_rows = 0
+                reference_row = schema.parent_reference_row  # 复制第7行的所有内容（参考行）
+                reference_style = RowStyleSnapshot(ws, reference_row)
+                for i, (first_child_row, parent_id) in enumerate(parent_positions):
+                    row_pos = first_child_row + i
+                    for col in range(1, ws.max_column + 1):
+                        source_cell = ws.cell(row=reference_row, column=col)
+                        target_cell = ws.cell(row=row_pos, column=col)
+                        
+                        # 复制值
+                        target_cell.value = source_cell.value
+                        
+                        # 复制格式
+                        reference_style.apply(target_cell)
                     
-                    # 从模板第8行读取对应列的图片链接格式
-                    template_url = ws.cell(row=data_start_row, column=col).value
+                    # 修改特定列的内容
+                    # A列: 父类编号（而不是"父条目"）
+                    ws.cell(row=row_pos, column=1).value = parent_id
                     
-                    # 如果模板中有URL，则基于模板URL构建新的URL；否则使用默认格式
-                    if template_url and isinstance(template_url, str):
-                        # 提取URL的各个部分
-                        # 例如: http://geyishuma.com/GYFGCX0031GYFGCX0060/GYFGCX0031iPhone12.MAIN.jpg
-                        import re
-                        match = re.search(r'(http://[^/]+/)([^/]+/)([^.]+)(\..+)$', template_url)
-                        if match:
-                            base_url = match.group(1)  # http://geyishuma.com/
-                            path_prefix = match.group(2)  # GYFGCX0031GYFGCX0060/
-                            old_sku_part = match.group(3)  # GYFGCX0031iPhone12
-                            suffix = match.group(4)  # .MAIN.jpg 或 .PT01.jpg 等
-                            
-                            # 根据列索引确定后缀
-                            if col_idx == 0:
-                                # 第一列（主图像链接地址）使用.MAIN
-                                new_suffix = ".MAIN.jpg"
-                            else:
-                                # 其他列（其他图片链接地址）使用.PT加两位数字格式
-                                new_suffix = f".PT{col_idx:02d}.jpg"
-                            
-                            # 构造新的图片链接URL
-                            image_url = f"{base_url}{path_prefix}{new_sku}{new_suffix}"
-                        else:
-                            # 如果无法解析URL格式，则使用默认格式
-                            if col_idx == 0:
-                                image_url = f"http://geyishuma.com/GYFGCX0031GYFGCX0060/{new_sku}.MAIN.jpg"
-                            else:
-                                image_url = f"http://geyishuma.com/GYFGCX0031GYFGCX0060/{new_sku}.PT{col_idx:02d}.jpg"
-                    else:
-                        # 如果模板中没有URL或不是字符串，则使用默认格式
-                        if col_idx == 0:
-                            image_url = f"http://geyishuma.com/GYFGCX0031GYFGCX0060/{new_sku}.MAIN.jpg"
-                        else:
-                            image_url = f"http://geyishuma.com/GYFGCX0031GYFGCX0060/{new_sku}.PT{col_idx:02d}.jpg"
+                    # 产品名称列: 父类SKU（保持不变，已经是父类编号）
+                    ws.cell(row=row_pos, column=product_name_col).value = parent_id
+                    
+                    # "父条目的库存单位"列: 父类SKU
+                    ws.cell(row=row_pos, column=parent_sku_col).value = parent_id
                     
-                    # 设置图片链接
-                    link_cell.value = image_url
-                    row_updated_links += 1
-                    updated_links_count += 1
+                    # 清除所有图片链接列，父类行不应包含图片链接
+                    for col in image_columns:
+                        ws.cell(row=row_pos, column=col).value = None
+                    
+                    inserted_rows += 1
+                    print(f"  在第 {row_pos} 行插入父类模板行，父类编号: {parent_id}")
                 
-                if row_updated_links > 0 and processed_rows < 5:  # 显示前5个更新
-                    print(f"  更新图片链接 (第 {row_idx} 行) {original_sku[:30]}... -> {new_sku[:30]}... ({row_updated_links} 个链接)")
+                # 更新所有子类行的"父条目的库存单位"列为对应的父类编号（按移动后的行号）
+                print("开始更新子类行的'父条目的库存单位'列...")
+                updated_subclass_count = 0
+                position_index = 0
+                for row_idx, parent_id in child_rows:
+                    while (position_index < len(parent_positions)
+                           and parent_positions[position_index][0] <= row_idx):
+                        position_index += 1
+                    new_row_idx = row_idx + position_index
+                    ws.cell(row=new_row_idx, column=parent_sku_col).value = parent_id
+                    updated_subclass_count += 1
+                    
+                    # 显示前几个更新
+                    if updated_subclass_count <= 5:
+                        print(f"  更新第 {new_row_idx} 行的'父条目的库存单位'列: {parent_id}")
                 
-                processed_rows += 1
-            
-            # 显示进度
-            if (i + 1) % 100 == 0:
-                print(f"  已处理 {i + 1} 行...")
-        
-        print(f"总计处理了 {processed_rows} 行，更新了 {updated_links_count} 个图片链接")
-        
-        # 步骤3: 替换编号列内容（如零件编号）
-        print("\n开始替换编号相关列...")
-        
-        data_start_row = 8
-        image_number_replaced_count = 0
-        
-        if image_number_columns:
-            for i, (row_idx, original_sku) in enumerate(valid_rows):
-                if i < len(image_number_mapping_list) and row_idx >= data_start_row:
-                    new_image_number = image_number_mapping_list[i]
-                    for col in image_number_columns:
-                        ws.cell(row=row_idx, column=col).value = new_image_number
-                    image_number_replaced_count += 1
-            print(f"总计替换了 {len(image_number_columns)} 个列中的 {image_number_replaced_count} 行编号数据")
+                print(f"总计更新了 {updated_subclass_count} 个子类行的'父条目的库存单位'列")
+                print(f"总计插入了 {inserted_rows} 个父类模板行")
+            else:
+                print("输入文件中未找到'父类编号'列")
         else:
-            print("未找到任何编号列，跳过替换")
-        
-        # 步骤4: 替换型号相关列内容（如型号、兼容设备等）
-        print("\n开始替换型号相关列...")
-        
-        model_replaced_count = 0
-        
-        if model_columns:
-            for i, (row_idx, original_sku) in enumerate(valid_rows):
-                if i < len(model_type_mapping_list) and row_idx >= data_start_row:
-                    new_model_type = model_type_mapping_list[i]
-                    for col in model_columns:
-                        ws.cell(row=row_idx, column=col).value = new_model_type
-                    model_replaced_count += 1
-            print(f"总计替换了 {len(model_columns)} 个列中的 {model_replaced_count} 行型号数据")
+            print("未找到'父条目的库存单位'列，跳过父类模板行插入")
+    except Exception as e:
+        print(f"插入父类模板行时出错: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    return wb
+
+class FilledTemplateXml:
+    """
+    fill_template_xml填写后的"模板"工作表：每个数据行只记录复制的模板行号和新写入的值，
+    Organize直接从这里读取数据行并生成品牌文件，不需要重新读取Final_Template
+    """
+    
+    def __init__(self, output_file, package, sheet, data_start_row, row_sources, max_column):
+        self.output_file = output_file  # 保存的Final_Template路径
+        self.package = package  # 上架模板的TemplatePackage
+        self.sheet = sheet  # 上架模板的"模板"工作表（TemplateSheet）
+        self.data_start_row = data_start_row
+        self.row_sources = row_sources  # 每个数据行的 (复制的模板行号, {列号: 新值})
+        self.max_column = max_column
+    
+    def data_rows(self):
+        """所有数据行的单元格值列表（第1列到最后一列），与openpyxl读取Final_Template得到的值相同"""
+        rows = []
+        for source_row, values in self.row_sources:
+            cells = {column: cell.value for column, cell in self.sheet.rows.get(source_row, {}).items()}
+            cells.update(values)
+            rows.append([cells.get(column) for column in range(1, self.max_column + 1)])
+        return rows
+    
+    def write_rows(self, output_file, rows):
+        """
+        生成数据行替换为rows的新文件：表头行与Final_Template相同，数据行只写入值，不带格式
+        （与Organize用openpyxl删除数据行后逐个写入单元格的结果相同）
+        """
+        header_rows = [row_idx for row_idx in sorted(self.sheet.rows) if row_idx < self.data_start_row]
+        
+        def generate_rows():
+            for row_idx in header_rows:
+                yield self.sheet.row_xml(row_idx, row_idx)
+            for offset, row in enumerate(rows):
+                yield self.sheet.row_xml(self.data_start_row + offset, None, dict(enumerate(row, 1)))
+        
+        if rows:
+            max_row = self.data_start_row - 1 + len(rows)
+            max_column = max(self.max_column, max(len(row) for row in rows))
         else:
-            print("未找到任何型号列，跳过替换")
-        
-        # 步骤7: 删除多余行
-        print("\n开始删除多余行...")
-        rows_deleted = 0
-        
-        # 从最后一行向上删除以避免行号变化
-        row_idx = ws.max_row
-        while row_idx >= data_start_row:
-            if row_idx not in rows_to_keep:
-                ws.delete_rows(row_idx)
-                rows_deleted += 1
-            row_idx -= 1
-        
-        print(f"删除了 {rows_deleted} 个多余行")
-        
-        # 步骤8: 统计产品名称列字符数并在最后一列显示
-        print(f"\n开始统计第 {product_name_col} 列字符数...")
-        
-        # 获取最后一列的索引
-        last_col = ws.max_column + 1  # 在最后一列之后添加新列
-        
-        # 统计字符数并写入最后一列
-        char_count_added = 0
-        for i, (row_idx, original_sku) in enumerate(valid_rows):
-            if row_idx >= data_start_row:
-                # 获取产品名称列的值
-                name_cell_value = ws.cell(row=row_idx, column=product_name_col).value
-                if name_cell_value is not None:
-                    # 计算字符数
-                    char_count = len(str(name_cell_value))
-                    # 在最后一列写入字符数
-                    ws.cell(row=row_idx, column=last_col).value = char_count
-                    char_count_added += 1
-                    
-                    # 显示前5个统计
-                    if char_count_added <= 5:
-                        print(f"  第 {row_idx} 行产品名称字符数: {char_count}")
-        
-        print(f"总计为 {char_count_added} 行添加了字符数统计")
-        
-        # 检查文件是否存在，如果存在则重命名
-        final_output_file = output_file
-        counter = 1
-        while final_output_file.exists():
-            # 获取文件名和扩展名
-            name, ext = final_output_file.stem, final_output_file.suffix
-            # 在文件名中添加计数器
-            final_output_file = Path(final_output_file.parent) / f"{name}_{counter}{ext}"
-            counter += 1
-    
-        # 自动插入父类模板行
-        print("\n开始自动插入父类模板行...")
-        try:
-            # 查找"父条目的库存单位"列
-            parent_sku_col = None
-            for cell in ws[4]:  # 第4行是标题行
-                if cell.value and "父条目的库存单位" in str(cell.value):
-                    parent_sku_col = cell.column
-                    break
+            max_row = max(header_rows, default=0)
+            max_column = max((column for row_idx in header_rows for column in self.sheet.rows[row_idx]), default=0)
+        self.package.write(output_file, self.sheet, generate_rows(), max_row, max_column)
+        return Path(output_file)
+
+def fill_template_xml(df_input, template_file, output_file):
+    """
+    与fill_template的填写结果相同，但不使用openpyxl加载整个工作簿：
+    VBA、其他工作表、样式等部件按原样复制，只按行流式生成"模板"工作表的XML，
+    耗时和内存不随模板中其他内容增加，数据行只保存复制的模板行号和新写入的值
+    
+    Args:
+        df_input: Add Model生成的DataFrame
+        template_file: 上架模板文件路径
+        output_file: 输出文件路径
+    
+    Returns:
+        FilledTemplateXml: 填写后的工作表（output_file为保存的文件路径）；输入数据缺少必要的列时返回None
+    """
+    print(f"输入数据包含 {len(df_input)} 行")
+    
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df_input.columns]
+    if missing_columns:
+        print(f"输入数据缺少必要的列: {missing_columns}")
+        return None
+    
+    print("正在读取模板文件...")
+    sheet_xml = load_shared_module('sheet_xml_writer', "Sheet XML Writer.py")
+    package = sheet_xml.TemplatePackage(template_file)
+    ws = package.load_sheet(["模板", "Template"])
+    
+    print(f"工作表最大行数: {ws.max_row}")
+    print(f"工作表最大列数: {ws.max_column}")
+    
+    schema = get_template_schema(template_file, ws)
+    
+    sku_list = [str(value) for value in df_input['图片名称']]
+    product_name_list = [str(value) for value in df_input['亚马逊产品标题']]
+    image_number_list = [str(value) for value in df_input['图片编号']]
+    model_type_list = [str(value) for value in df_input['型号']]
+    print(f"映射关系已建立，总计 {len(sku_list)} 个映射")
+    
+    # 数据从第8行开始：第k条数据使用模板第k个有效数据行（A列有SKU），超出的数据使用最后一个有效数据行，
+    # 多余的模板行不输出（与fill_template添加行、删除多余行的结果相同）
+    data_start_row = schema.data_start_row
+    valid_rows = []
+    for row_idx in range(data_start_row, ws.max_row + 1):
+        sku_cell = ws.cell(row=row_idx, column=1).value
+        if sku_cell and str(sku_cell).strip():
+            valid_rows.append(row_idx)
+    print(f"在模板中找到 {len(valid_rows)} 个有效的数据行")
+    last_valid_row = valid_rows[-1] if valid_rows else data_start_row
+    source_rows = valid_rows[:len(sku_list)] + [last_valid_row] * (len(sku_list) - len(valid_rows))
+    
+    # 字符数写在所有输出内容的最后一列之后
+    data_columns = [1, schema.product_name_col, *schema.image_columns,
+                    *schema.image_number_columns, *schema.model_columns]
+    used_columns = [column for row_idx in set(range(1, data_start_row)) | set(source_rows)
+                    for column in ws.rows.get(row_idx, {})]
+    if sku_list:
+        used_columns.extend(data_columns)
+    last_col = max(used_columns, default=0) + 1
+    
+    sku_to_parent = None
+    parent_sku_col = schema.parent_sku_col
+    if not parent_sku_col:
+        print("未找到'父条目的库存单位'列，跳过父类模板行插入")
+    elif '父类编号' not in df_input.columns:
+        print("输入文件中未找到'父类编号'列")
+    else:
+        print(f"找到'父条目的库存单位'列，位于第 {parent_sku_col} 列")
+        sku_to_parent = dict(zip(df_input['图片名称'], df_input['父类编号']))
+    
+    counts = {'rows': 0, 'parents': 0}
+    row_sources = []
+    
+    def generate_rows():
+        for row_idx in range(1, data_start_row):
+            if row_idx in ws.rows:
+                yield ws.row_xml(row_idx, row_idx)
+        
+        row_pos = data_start_row
+        seen_parents = set()
+        for i, source_row in enumerate(source_rows):
+            new_sku = sku_list[i]
+            values = {1: new_sku, schema.product_name_col: product_name_list[i]}
+            for col_idx, col in enumerate(schema.image_columns):
+                values[col] = build_image_url(schema.image_url_prefixes[col_idx], new_sku, col_idx)
+            for col in schema.image_number_columns:
+                values[col] = image_number_list[i]
+            for col in schema.model_columns:
+                values[col] = model_type_list[i]
+            name_value = values[schema.product_name_col]
+            if name_value is not None:
+                values[last_col] = len(str(name_value))
             
-            if parent_sku_col:
-                print(f"找到'父条目的库存单位'列，位于第 {parent_sku_col} 列")
-                
-                # 读取Excel文件数据来获取父类编号信息
-                # 使用Add Model.py生成的文件
-                project_root = get_project_root()
-                # 从配置文件中读取结果文件夹路径
-                config_file = Path(project_root) / "config.txt"
-                result_dir_path = "Result"  # 默认路径
-                if config_file.exists():
-                    with open(config_file, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            line = line.strip()
-                            if line and not line.startswith('#') and '=' in line:
-                                key, value = line.split('=', 1)
-                                if key.strip() == 'RESULT_FOLDER_PATH':
-                                    result_dir_path = value.strip()
-                                    break
-                
-                result_dir = Path(result_dir_path)
-                input_excel = result_dir / "Image_Titles_Add_Model.xlsx"
-                print(f"使用Add Model生成的输入文件: {input_excel}")
-                
-                if input_excel.exists():
-                    print(f"正在读取输入文件: {input_excel}")
-                    df_input = pd.read_excel(input_excel)
-                    
-                    # 检查是否有父类编号列
-                    if '父类编号' in df_input.columns:
-                        # 按父类编号分组统计数据
-                        parent_stats = df_input.groupby('父类编号').size().reset_index(name='count')
-                        print(f"找到 {len(parent_stats)} 个父类编号")
-                        
-                        # 收集所有需要处理的SKU及其对应的父类编号
-                        sku_to_parent = {}
-                        for idx, row in df_input.iterrows():
-                            sku = row['图片名称']
-                            parent_id = row['父类编号']
-                            sku_to_parent[sku] = parent_id
-                        
-                        # 收集所有唯一的父类编号，按出现顺序排列
-                        unique_parents = []
-                        seen_parents = set()
-                        for sku in sku_to_parent:
-                            parent_id = sku_to_parent[sku]
-                            if parent_id not in seen_parents:
-                                unique_parents.append(parent_id)
-                                seen_parents.add(parent_id)
-                        
-                        print(f"需要处理的父类编号顺序: {unique_parents}")
-                        
-                        # 在每个父类的第一行插入父类模板行
-                        inserted_rows = 0
-                        processed_parents = set()
-                        
-                        # 收集所有需要插入父类行的位置
-                        insert_positions = []  # [(row_position, parent_id), ...]
-                        
-                        # 从第8行开始遍历数据行，收集插入位置
-                        row_idx = 8
-                        max_row = ws.max_row
-                        
-                        while row_idx <= max_row:
-                            # 获取SKU值来查找对应的父类编号
-                            sku_cell = ws.cell(row=row_idx, column=1)  # SKU在A列
-                            if sku_cell.value:
-                                sku_value = str(sku_cell.value)
-                                # 在输入数据中查找对应的父类编号
-                                if sku_value in sku_to_parent:
-                                    parent_id = sku_to_parent[sku_value]
-                                    
-                                    # 如果这是该父类的第一行且尚未处理过
-                                    if parent_id not in processed_parents:
-                                        processed_parents.add(parent_id)
-                                        insert_positions.append((row_idx + inserted_rows, parent_id))
-                                        print(f"  计划在第 {row_idx + inserted_rows} 行插入父类模板行，父类编号: {parent_id}")
-                            
-                            row_idx += 1
-                        
-                        # 按照行号从高到低排序，这样插入不会影响后续行号
-                        insert_positions.sort(reverse=True)
-                        
-                        # 执行插入操作
-                        for row_pos, parent_id in insert_positions:
-                            # 插入新行
-                            ws.insert_rows(row_pos)
-                            inserted_rows += 1
-                            
-                            # 复制第7行的所有内容（参考行）
-                            reference_row = 7
-                            for col in range(1, ws.max_column + 1):
-                                source_cell = ws.cell(row=reference_row, column=col)
-                                target_cell = ws.cell(row=row_pos, column=col)
-                                
-                                # 复制值
-                                target_cell.value = source_cell.value
-                                
-                                # 复制格式
-                                target_cell.font = source_cell.font.copy()
-                                target_cell.border = source_cell.border.copy()
-                                target_cell.fill = source_cell.fill.copy()
-                                target_cell.number_format = source_cell.number_format
-                                target_cell.protection = source_cell.protection.copy()
-                                target_cell.alignment = source_cell.alignment.copy()
-                            
-                            # 修改特定列的内容
-                            # A列: 父类编号（而不是"父条目"）
-                            ws.cell(row=row_pos, column=1).value = parent_id
-                            
-                            # 产品名称列: 父类SKU（保持不变，已经是父类编号）
-                            ws.cell(row=row_pos, column=product_name_col).value = parent_id
-                            
-                            # "父条目的库存单位"列: 父类SKU
-                            ws.cell(row=row_pos, column=parent_sku_col).value = parent_id
-                            
-                            # 清除所有图片链接列，父类行不应包含图片链接
-                            for col in image_columns:
-                                ws.cell(row=row_pos, column=col).value = None
-                            
-                            print(f"  在第 {row_pos} 行插入父类模板行，父类编号: {parent_id}")
-                        
-                        # 更新所有子类行的"父条目的库存单位"列为对应的父类编号
-                        print("开始更新子类行的'父条目的库存单位'列...")
-                        updated_subclass_count = 0
-                        
-                        # 重新遍历所有行（包括新插入的父类行）
-                        row_idx = 8
-                        max_row = ws.max_row
-                        
-                        while row_idx <= max_row:
-                            # 获取SKU值
-                            sku_cell = ws.cell(row=row_idx, column=1)  # SKU在A列
-                            if sku_cell.value:
-                                sku_value = str(sku_cell.value)
-                                # 检查是否是子类SKU（在输入数据中可以找到）
-                                if sku_value in sku_to_parent:
-                                    parent_id = sku_to_parent[sku_value]
-                                    # 更新"父条目的库存单位"列
-                                    ws.cell(row=row_idx, column=parent_sku_col).value = parent_id
-                                    updated_subclass_count += 1
-                                    
-                                    # 显示前几个更新
-                                    if updated_subclass_count <= 5:
-                                        print(f"  更新第 {row_idx} 行的'父条目的库存单位'列: {parent_id}")
-                            
-                            row_idx += 1
-                        
-                        print(f"总计更新了 {updated_subclass_count} 个子类行的'父条目的库存单位'列")
-                        print(f"总计插入了 {inserted_rows} 个父类模板行")
-                    else:
-                        print("输入文件中未找到'父类编号'列")
-                else:
-                    print(f"输入文件不存在: {input_excel}")
-            else:
-                print("未找到'父条目的库存单位'列，跳过父类模板行插入")
-        except Exception as e:
-            print(f"插入父类模板行时出错: {e}")
-            import traceback
-            traceback.print_exc()
+            if sku_to_parent is not None and new_sku in sku_to_parent:
+                parent_id = sku_to_parent[new_sku]
+                # 每个父类的第一个子类行之前插入复制第7行的父类模板行
+                if parent_id not in seen_parents:
+                    seen_parents.add(parent_id)
+                    parent_values = {1: parent_id, schema.product_name_col: parent_id, parent_sku_col: parent_id}
+                    for col in schema.image_columns:
+                        parent_values[col] = None
+                    yield ws.row_xml(row_pos, schema.parent_reference_row, parent_values)
+                    row_sources.append((schema.parent_reference_row, parent_values))
+                    row_pos += 1
+                    counts['parents'] += 1
+                values[parent_sku_col] = parent_id
+            
+            yield ws.row_xml(row_pos, source_row, values)
+            row_sources.append((source_row, values))
+            row_pos += 1
+            counts['rows'] += 1
+            if counts['rows'] % 10000 == 0:
+                print(f"  已写入 {counts['rows']} 行...")
     
-        # 保存文件
-        print(f"\n正在保存处理后的文件到: {final_output_file}")
-        try:
-            wb.save(final_output_file)
-            print("处理完成!")
-        except Exception as e:
-            raise Exception(f"保存文件时出错: {e}\n请确保Excel文件未被其他程序打开")
-        
+    # 行数和列数只用于<dimension>，写入前按输出内容计算
+    if sku_list:
+        parent_count = 0
+        if sku_to_parent is not None:
+            parent_count = len({sku_to_parent[sku] for sku in sku_list if sku in sku_to_parent})
+        max_row = data_start_row - 1 + len(sku_list) + parent_count
+        max_column = last_col
+    else:
+        max_row = max((row_idx for row_idx in ws.rows if row_idx < data_start_row), default=0)
+        max_column = max(used_columns, default=0)
+    
+    print(f"\n正在写入: {output_file}")
+    package.write(output_file, ws, generate_rows(), max_row, max_column)
+    print(f"总计写入了 {counts['rows']} 个数据行和 {counts['parents']} 个父类模板行")
+    return FilledTemplateXml(Path(output_file), package, ws, data_start_row, row_sources, max_column)
+
+def next_final_template_file(result_dir):
+    """结果文件夹中的Final_Template.xlsm，文件已存在时添加序号"""
+    output_file = Path(result_dir) / "Final_Template.xlsm"
+    
+    # 检查文件是否存在，如果存在则重命名
+    final_output_file = output_file
+    counter = 1
+    while final_output_file.exists():
+        # 获取文件名和扩展名
+        name, ext = final_output_file.stem, final_output_file.suffix
+        # 在文件名中添加计数器
+        final_output_file = Path(final_output_file.parent) / f"{name}_{counter}{ext}"
+        counter += 1
+    return final_output_file
+
+def save_final_template(wb, result_dir):
+    """保存填充后的工作簿为结果文件夹中的Final_Template.xlsm（文件已存在时添加序号），返回保存的路径"""
+    final_output_file = next_final_template_file(result_dir)
+    
+    # 保存文件
+    print(f"\n正在保存处理后的文件到: {final_output_file}")
+    try:
+        load_shared_module('stage_data', "Stage Data.py").save_workbook(wb, final_output_file)
+        print("处理完成!")
+    except Exception as e:
+        raise Exception(f"保存文件时出错: {e}\n请确保Excel文件未被其他程序打开")
+    return final_output_file
+
+def main():
+    # 获取项目根目录
+    project_root = get_project_root()
+    print(f"Ultimately 脚本 - 项目根目录: {project_root}")
+    
+    # 从配置文件读取结果文件夹路径
+    # config_file = Path(project_root) / "Release" / "config.txt"
+    config_file = Path(project_root)  / "config.txt"
+    result_dir = get_result_folder_from_config(config_file)
+    
+    # 输入文件和模板文件路径（Add Model生成的xlsx或parquet，使用较新的文件）
+    stage_data = load_shared_module('stage_data', "Stage Data.py")
+    input_excel = stage_data.find_stage_table(result_dir, "Image_Titles_Add_Model")
+    template_file = find_template_file(project_root)
+    
+    # 检查输入文件是否存在
+    if input_excel is None:
+        print(f"输入文件不存在: {Path(result_dir) / 'Image_Titles_Add_Model.xlsx'}")
+        return
+    
+    print(f"正在读取输入文件: {input_excel}")
+    print(f"正在读取模板文件: {template_file}")
+    
+    try:
+        # 读取输入文件
+        df_input = stage_data.read_stage_table(input_excel)
+        if get_template_writer(config_file) == 'xml':
+            fill_template_xml(df_input, template_file, next_final_template_file(result_dir))
+            return
+        wb = fill_template(df_input, template_file)
+        if wb is not None:
+            save_final_template(wb, result_dir)
     except Exception as e:
         print(f"处理文件时出错: {str(e)}")
         import traceback
         traceback.print_exc()
 
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
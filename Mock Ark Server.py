@@ -0,0 +1,234 @@
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 默认返回的标题（与prompt.txt要求的四个字段一致）
+DEFAULT_TITLES = {
+    "amazon_title": "for iPhone 15 Case Cute Cartoon Cat Pattern Soft TPU Shockproof Protective Phone Cover for Women Girls",
+    "amazon_title_translation": "适用于iPhone 15的可爱卡通猫图案软TPU防摔保护手机壳，适合女性和女孩",
+    "short_title": "Cute Cat Case",
+    "short_title_translation": "可爱猫咪手机壳",
+}
+
+class MockArkOptions:
+    """模拟服务器的行为参数"""
+
+    def __init__(self, latency=1.0, latency_spread=0.3, latency_mode="lognormal",
+                 error_rate=0.0, throttle_rate=0.0, rate_limit=0.0, titles=None,
+                 prompt_tokens_per_image=800, completion_tokens_per_image=120):
+        self.latency = latency  # 平均延迟（秒）
+        self.latency_spread = latency_spread  # 延迟的离散程度
+        self.latency_mode = latency_mode  # fixed / uniform / lognormal
+        self.error_rate = error_rate  # 随机返回500的概率
+        self.throttle_rate = throttle_rate  # 随机返回429的概率
+        self.rate_limit = rate_limit  # 每秒允许的请求数，超出时返回429；0表示不限制
+        self.titles = titles or DEFAULT_TITLES
+        self.prompt_tokens_per_image = prompt_tokens_per_image
+        self.completion_tokens_per_image = completion_tokens_per_image
+
+    def sample_latency(self):
+        """按配置的分布生成一次请求的延迟"""
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_mode == "fixed":
+            return self.latency
+        if self.latency_mode == "uniform":
+            spread = self.latency * self.latency_spread
+            return max(0.0, random.uniform(self.latency - spread, self.latency + spread))
+        # 对数正态分布：均值为latency，带有较长的尾部延迟
+        sigma = self.latency_spread
+        mu = math.log(self.latency) - sigma * sigma / 2
+        return random.lognormvariate(mu, sigma)
+
+class MockArkStats:
+    """记录模拟服务器处理的请求数量"""
+
+    def __init__(self):
+        self.requests = 0
+        self.images = 0
+        self.throttled = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+class TokenBucket:
+    """简单的令牌桶，用于模拟账号级别的限流"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class MockArkHandler(BaseHTTPRequestHandler):
+    """实现 POST .../chat/completions 接口"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 不输出每个请求的访问日志
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": {"code": "InvalidParameter", "message": "invalid json"}})
+            return
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+            return
+
+        # 统计请求中的图片数量（批量请求包含多张图片）
+        image_count = 0
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, list):
+                image_count += sum(1 for part in content if part.get("type") == "image_url")
+        server.stats.add(requests=1, images=image_count)
+
+        options = server.options
+        if ((server.bucket is not None and not server.bucket.try_acquire())
+                or random.random() < options.throttle_rate):
+            server.stats.add(throttled=1)
+            self.send_json(429, {"error": {"code": "RateLimitExceeded", "message": "mock rate limit"}},
+                           headers={"Retry-After": "1"})
+            return
+
+        time.sleep(options.sample_latency())
+
+        if random.random() < options.error_rate:
+            server.stats.add(errors=1)
+            self.send_json(500, {"error": {"code": "InternalServiceError", "message": "mock error"}})
+            return
+
+        if image_count > 1:
+            # 批量请求按图片编号返回JSON数组
+            content = json.dumps([dict(image_index=index, **options.titles)
+                                  for index in range(1, image_count + 1)], ensure_ascii=False)
+        else:
+            content = json.dumps(options.titles, ensure_ascii=False)
+
+        image_count = max(image_count, 1)
+        prompt_tokens = options.prompt_tokens_per_image * image_count
+        completion_tokens = options.completion_tokens_per_image * image_count
+        self.send_json(200, {
+            "id": f"mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+def start_server(options, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动模拟服务器
+
+    Args:
+        options: MockArkOptions
+        host: 监听地址
+        port: 监听端口，0表示自动选择空闲端口
+
+    Returns:
+        ThreadingHTTPServer: 服务器对象，server.base_url 为可直接用于 Ark(base_url=...) 的地址
+    """
+    server = ThreadingHTTPServer((host, port), MockArkHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.stats = MockArkStats()
+    server.bucket = TokenBucket(options.rate_limit) if options.rate_limit > 0 else None
+    server.base_url = f"http://{host}:{server.server_address[1]}/api/v3"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_server_arguments(parser):
+    """添加模拟服务器的命令行参数（基准测试脚本也使用这些参数）"""
+    parser.add_argument('--latency', type=float, default=1.0, help="平均延迟（秒），默认1.0")
+    parser.add_argument('--latency-spread', type=float, default=0.3,
+                        help="延迟离散程度：uniform为相对范围，lognormal为sigma，默认0.3")
+    parser.add_argument('--latency-mode', choices=['fixed', 'uniform', 'lognormal'], default='lognormal',
+                        help="延迟分布，默认lognormal")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="随机返回500的概率，默认0")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="随机返回429的概率，默认0")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="每秒允许的请求数，超出时返回429，默认0（不限制）")
+    parser.add_argument('--response-file', help="JSON文件，包含返回的四个标题字段")
+
+def options_from_args(args):
+    titles = None
+    if args.response_file:
+        with open(args.response_file, 'r', encoding='utf-8') as f:
+            titles = json.load(f)
+    return MockArkOptions(
+        latency=args.latency,
+        latency_spread=args.latency_spread,
+        latency_mode=args.latency_mode,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+        titles=titles,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟豆包（Ark）chat.completions接口，用于测试，不消耗API额度")
+    parser.add_argument('--host', default="127.0.0.1", help="监听地址，默认127.0.0.1")
+    parser.add_argument('--port', type=int, default=8910, help="监听端口，默认8910")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(options_from_args(args), args.host, args.port)
+    print(f"模拟服务器已启动，在config.txt中设置: API_BASE_URL={server.base_url}")
+    print("按 Ctrl-C 退出")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stats = server.stats
+        print(f"\n共处理 {stats.requests} 个请求（{stats.images} 张图片），"
+              f"限流 {stats.throttled} 次，错误 {stats.errors} 次")
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
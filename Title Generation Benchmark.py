@@ -0,0 +1,163 @@
+import os
+import io
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib.util
+from pathlib import Path
+from contextlib import redirect_stdout
+
+script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+
+def load_module(script_name, module_name, project_root=None):
+    """按文件路径加载脚本（与main.py相同的方式），可传入project_root供脚本读取配置"""
+    spec = importlib.util.spec_from_file_location(module_name, script_dir / script_name)
+    module = importlib.util.module_from_spec(spec)
+    if project_root is not None:
+        module.project_root = str(project_root)
+    spec.loader.exec_module(module)
+    return module
+
+def create_sample_images(folder, count, size):
+    """生成用于测试的图片（带随机噪点，使压缩后的大小接近真实商品图）"""
+    from PIL import Image
+    folder.mkdir(parents=True, exist_ok=True)
+    for index in range(count):
+        noise = Image.frombytes('RGB', (size // 4, size // 4), os.urandom((size // 4) ** 2 * 3))
+        image = noise.resize((size, size))
+        image.save(folder / f"BENCH{index:04d}.png")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_level(concurrency, args, image_folder, prompt_text, base_url, work_dir):
+    """使用指定并发数运行一次Title Generation的处理流水线，返回统计结果"""
+    # 每个并发级别使用独立的项目根目录和配置，不影响真实的结果文件夹和缓存
+    project_root = work_dir / f"concurrency_{concurrency}"
+    project_root.mkdir(parents=True, exist_ok=True)
+    (project_root / "prompt.txt").write_text(prompt_text, encoding='utf-8')
+    config_lines = [
+        f"IMAGE_FOLDER_PATH={image_folder}",
+        f"RESULT_FOLDER_PATH={project_root / 'Result'}",
+        f"MODEL_NAME={args.model}",
+        f"API_BASE_URL={base_url}",
+        f"MAX_CONCURRENCY={concurrency}",
+        f"BATCH_SIZE={args.batch_size}",
+        f"PREPROCESS_IMAGES={'false' if args.no_preprocess else 'true'}",
+        "ENABLE_CACHE=false",
+        "PHASH_MAX_DISTANCE=-1",
+    ]
+    (project_root / "config.txt").write_text("\n".join(config_lines) + "\n", encoding='utf-8')
+
+    with redirect_stdout(io.StringIO()):
+        module = load_module("Title Generation.py", f"title_generation_bench_{concurrency}", project_root)
+    image_files = module.scan_image_files(image_folder)[:args.count]
+
+    # 记录每次API调用（含重试）的耗时
+    latencies = []
+    original_create = module.create_chat_completion
+
+    def timed_create_chat_completion(**kwargs):
+        start = time.perf_counter()
+        try:
+            return original_create(**kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    module.create_chat_completion = timed_create_chat_completion
+
+    outcomes = {}
+
+    def on_result(position, success, record):
+        outcomes[position] = success
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        module.run_title_pipeline(image_files, on_result)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for success in outcomes.values() if not success)
+    return {
+        'concurrency': concurrency,
+        'images': len(image_files),
+        'seconds': elapsed,
+        'images_per_second': len(image_files) / elapsed if elapsed > 0 else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'failure_rate': failed / len(image_files) if image_files else 0.0,
+        'requests': len(latencies),
+        'throttled': module.concurrency_controller.throttled_count,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="使用本地模拟服务器测试Title Generation的吞吐量（图片/秒、p50/p95延迟、失败率），不消耗API额度")
+    parser.add_argument('--images', help="测试图片文件夹；不指定时自动生成测试图片")
+    parser.add_argument('--count', type=int, default=40, help="图片数量，默认40")
+    parser.add_argument('--image-size', type=int, default=2000, help="自动生成的图片边长（像素），默认2000")
+    parser.add_argument('--concurrency', default="1,2,4,8,16", help="要测试的并发数列表，默认1,2,4,8,16")
+    parser.add_argument('--batch-size', type=int, default=1, help="BATCH_SIZE，默认1")
+    parser.add_argument('--no-preprocess', action='store_true', help="关闭上传前的图片压缩")
+    parser.add_argument('--model', default="mock-model", help="请求中使用的模型名称")
+    parser.add_argument('--base-url', help="使用已启动的服务器地址，而不是在本进程中启动模拟服务器")
+    parser.add_argument('--seed', type=int, help="随机数种子，用于复现延迟和错误注入")
+    mock_server = load_module("Mock Ark Server.py", "mock_ark_server")
+    mock_server.add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    # 模拟服务器不校验密钥，但Title Generation要求设置DOUBAO_API_KEY
+    os.environ.setdefault('DOUBAO_API_KEY', 'mock-key')
+
+    work_dir = Path(tempfile.mkdtemp(prefix="title_generation_bench_"))
+    try:
+        if args.images:
+            image_folder = Path(args.images)
+        else:
+            image_folder = work_dir / "images"
+            print(f"正在生成 {args.count} 张测试图片 ({args.image_size}x{args.image_size})...")
+            create_sample_images(image_folder, args.count, args.image_size)
+
+        # 优先使用项目中的提示词，使请求大小与真实运行一致
+        prompt_file = script_dir / "prompt.txt"
+        if prompt_file.exists():
+            prompt_text = prompt_file.read_text(encoding='utf-8')
+        else:
+            prompt_text = "请根据图片生成亚马逊手机壳标题，返回包含amazon_title、amazon_title_translation、short_title、short_title_translation的JSON。"
+
+        server = None
+        base_url = args.base_url
+        if base_url is None:
+            server = mock_server.start_server(mock_server.options_from_args(args))
+            base_url = server.base_url
+        print(f"模拟服务器地址: {base_url}")
+        print(f"延迟: {args.latency_mode} 平均 {args.latency}s，错误率 {args.error_rate}，"
+              f"随机限流率 {args.throttle_rate}，限流 {args.rate_limit or '无'} 请求/秒")
+
+        levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+        rows = []
+        for concurrency in levels:
+            row = run_level(concurrency, args, image_folder, prompt_text, base_url, work_dir)
+            rows.append(row)
+            print(f"并发 {concurrency:>3}: {row['images_per_second']:6.2f} 图片/秒")
+
+        print()
+        print(f"{'并发':>6} {'图片':>6} {'耗时(s)':>9} {'图片/秒':>8} {'p50(s)':>8} {'p95(s)':>8} "
+              f"{'失败率':>7} {'请求数':>7} {'限流':>6}")
+        for row in rows:
+            print(f"{row['concurrency']:>6} {row['images']:>6} {row['seconds']:>9.2f} "
+                  f"{row['images_per_second']:>8.2f} {row['p50']:>8.3f} {row['p95']:>8.3f} "
+                  f"{row['failure_rate']:>7.1%} {row['requests']:>7} {row['throttled']:>6}")
+        if server is not None:
+            server.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
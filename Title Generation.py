@@ -3,11 +3,24 @@ import sys
 import base64
 import time
 import json
+import random
+import sqlite3
+import hashlib
+import queue
+import argparse
+import threading
 import pandas as pd
+from datetime import datetime
 from volcenginesdkarkruntime import Ark
 from pathlib import Path
 from dotenv import load_dotenv
 
+try:
+    from PIL import Image
+except ImportError:
+    # 未安装Pillow时跳过图片压缩，直接上传原图
+    Image = None
+
 # 加载.env文件
 load_dotenv()
 
@@ -48,6 +61,30 @@ IMAGE_FOLDER_PATH = ""
 RESULT_FOLDER_PATH = ""
 PARENT_CLASS_GROUP_SIZE = 2  # 默认值为2
 MODEL_NAME = "doubao-seed-1-6-251015"  # 默认模型名称
+FAST_MODEL_NAME = ""  # 先尝试的快速/低价模型，为空表示只使用MODEL_NAME
+MAX_TITLE_LENGTH = 200  # 亚马逊标题的最大字符数，超过时改用MODEL_NAME重新生成
+API_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"  # 豆包API地址
+MAX_CONCURRENCY = 4  # 默认同时进行的请求数
+ENCODE_WORKERS = 2  # 预取并编码图片的线程数
+PREFETCH_COUNT = 8  # 预取队列中最多保存的已编码图片数
+PREFETCH_MAX_MB = 256  # 预取队列中图片数据的总大小上限（MB）
+REQUEST_TIMEOUT = 120  # 单次请求超时时间（秒）
+MAX_RETRIES = 4  # 限流、服务端错误或超时时的最大重试次数
+RETRY_BASE_DELAY = 1.0  # 重试等待的基础时间（秒），每次重试翻倍
+RETRY_MAX_DELAY = 30.0  # 单次重试等待的最长时间（秒）
+BATCH_SIZE = 1  # 每次请求发送的图片数量，1表示逐张请求
+PHASH_MAX_DISTANCE = -1  # 相似图片复用标题的最大汉明距离，-1表示不复用
+RECURSIVE_SCAN = False  # 是否包含子文件夹中的图片
+WATCH_INTERVAL = 10  # 监视模式下检查新图片的间隔（秒）
+PRICE_PER_M_INPUT_TOKENS = 0.8  # 输入token价格（元/百万token），请按实际价格修改
+PRICE_PER_M_OUTPUT_TOKENS = 8.0  # 输出token价格（元/百万token），请按实际价格修改
+ENABLE_CACHE = True  # 默认启用响应缓存
+CACHE_MAX_ENTRIES = 50000  # 缓存最多保留的条目数
+CACHE_MAX_AGE_DAYS = 30  # 缓存条目的最长保留天数
+PREPROCESS_IMAGES = True  # 默认在上传前压缩图片
+UPLOAD_MAX_EDGE = 1568  # 上传图片的最长边（像素）
+UPLOAD_FORMAT = "JPEG"  # 上传图片的格式: JPEG 或 WEBP
+UPLOAD_QUALITY = 85  # 上传图片的压缩质量（1-100）
 if config_file.exists():
     print("配置文件存在，正在读取...")
     with open(config_file, 'r', encoding='utf-8') as f:
@@ -70,6 +107,140 @@ if config_file.exists():
                 elif key.strip() == 'MODEL_NAME':
                     MODEL_NAME = value.strip()
                     print(f"读取到模型名称: {MODEL_NAME}")
+                elif key.strip() == 'FAST_MODEL_NAME':
+                    FAST_MODEL_NAME = value.strip()
+                    print(f"读取到快速模型名称: {FAST_MODEL_NAME or '未设置'}")
+                elif key.strip() == 'MAX_TITLE_LENGTH':
+                    try:
+                        MAX_TITLE_LENGTH = int(value.strip())
+                        print(f"读取到标题最大字符数: {MAX_TITLE_LENGTH}")
+                    except ValueError:
+                        print(f"警告: MAX_TITLE_LENGTH配置值无效，使用默认值200")
+                elif key.strip() == 'API_BASE_URL':
+                    API_BASE_URL = value.strip()
+                    print(f"读取到API地址: {API_BASE_URL}")
+                elif key.strip() == 'MAX_CONCURRENCY':
+                    try:
+                        MAX_CONCURRENCY = max(1, int(value.strip()))
+                        print(f"读取到最大并发数: {MAX_CONCURRENCY}")
+                    except ValueError:
+                        print(f"警告: MAX_CONCURRENCY配置值无效，使用默认值4")
+                elif key.strip() == 'ENCODE_WORKERS':
+                    try:
+                        ENCODE_WORKERS = max(1, int(value.strip()))
+                        print(f"读取到图片编码线程数: {ENCODE_WORKERS}")
+                    except ValueError:
+                        print(f"警告: ENCODE_WORKERS配置值无效，使用默认值2")
+                elif key.strip() == 'PREFETCH_COUNT':
+                    try:
+                        PREFETCH_COUNT = max(1, int(value.strip()))
+                        print(f"读取到预取图片数量: {PREFETCH_COUNT}")
+                    except ValueError:
+                        print(f"警告: PREFETCH_COUNT配置值无效，使用默认值8")
+                elif key.strip() == 'PREFETCH_MAX_MB':
+                    try:
+                        PREFETCH_MAX_MB = max(1, float(value.strip()))
+                        print(f"读取到预取数据大小上限: {PREFETCH_MAX_MB} MB")
+                    except ValueError:
+                        print(f"警告: PREFETCH_MAX_MB配置值无效，使用默认值256")
+                elif key.strip() == 'REQUEST_TIMEOUT':
+                    try:
+                        REQUEST_TIMEOUT = float(value.strip())
+                        print(f"读取到请求超时时间: {REQUEST_TIMEOUT} 秒")
+                    except ValueError:
+                        print(f"警告: REQUEST_TIMEOUT配置值无效，使用默认值120")
+                elif key.strip() == 'MAX_RETRIES':
+                    try:
+                        MAX_RETRIES = max(0, int(value.strip()))
+                        print(f"读取到最大重试次数: {MAX_RETRIES}")
+                    except ValueError:
+                        print(f"警告: MAX_RETRIES配置值无效，使用默认值4")
+                elif key.strip() == 'RETRY_BASE_DELAY':
+                    try:
+                        RETRY_BASE_DELAY = float(value.strip())
+                        print(f"读取到重试基础等待时间: {RETRY_BASE_DELAY} 秒")
+                    except ValueError:
+                        print(f"警告: RETRY_BASE_DELAY配置值无效，使用默认值1")
+                elif key.strip() == 'RETRY_MAX_DELAY':
+                    try:
+                        RETRY_MAX_DELAY = float(value.strip())
+                        print(f"读取到重试最长等待时间: {RETRY_MAX_DELAY} 秒")
+                    except ValueError:
+                        print(f"警告: RETRY_MAX_DELAY配置值无效，使用默认值30")
+                elif key.strip() == 'BATCH_SIZE':
+                    try:
+                        BATCH_SIZE = max(1, int(value.strip()))
+                        print(f"读取到批量请求图片数: {BATCH_SIZE}")
+                    except ValueError:
+                        print(f"警告: BATCH_SIZE配置值无效，使用默认值1")
+                elif key.strip() == 'PHASH_MAX_DISTANCE':
+                    try:
+                        PHASH_MAX_DISTANCE = int(value.strip())
+                        print(f"读取到相似图片最大汉明距离: {PHASH_MAX_DISTANCE}")
+                    except ValueError:
+                        print(f"警告: PHASH_MAX_DISTANCE配置值无效，使用默认值-1（不复用）")
+                elif key.strip() == 'RECURSIVE_SCAN':
+                    RECURSIVE_SCAN = value.strip().lower() in ('1', 'true', 'yes', 'on')
+                    print(f"读取到子文件夹扫描开关: {RECURSIVE_SCAN}")
+                elif key.strip() == 'WATCH_INTERVAL':
+                    try:
+                        WATCH_INTERVAL = max(1.0, float(value.strip()))
+                        print(f"读取到监视间隔: {WATCH_INTERVAL} 秒")
+                    except ValueError:
+                        print(f"警告: WATCH_INTERVAL配置值无效，使用默认值10")
+                elif key.strip() == 'PRICE_PER_M_INPUT_TOKENS':
+                    try:
+                        PRICE_PER_M_INPUT_TOKENS = float(value.strip())
+                        print(f"读取到输入token价格: {PRICE_PER_M_INPUT_TOKENS} 元/百万token")
+                    except ValueError:
+                        print(f"警告: PRICE_PER_M_INPUT_TOKENS配置值无效，使用默认值0.8")
+                elif key.strip() == 'PRICE_PER_M_OUTPUT_TOKENS':
+                    try:
+                        PRICE_PER_M_OUTPUT_TOKENS = float(value.strip())
+                        print(f"读取到输出token价格: {PRICE_PER_M_OUTPUT_TOKENS} 元/百万token")
+                    except ValueError:
+                        print(f"警告: PRICE_PER_M_OUTPUT_TOKENS配置值无效，使用默认值8")
+                elif key.strip() == 'ENABLE_CACHE':
+                    ENABLE_CACHE = value.strip().lower() in ('1', 'true', 'yes', 'on')
+                    print(f"读取到响应缓存开关: {ENABLE_CACHE}")
+                elif key.strip() == 'CACHE_MAX_ENTRIES':
+                    try:
+                        CACHE_MAX_ENTRIES = int(value.strip())
+                        print(f"读取到缓存最大条目数: {CACHE_MAX_ENTRIES}")
+                    except ValueError:
+                        print(f"警告: CACHE_MAX_ENTRIES配置值无效，使用默认值50000")
+                elif key.strip() == 'CACHE_MAX_AGE_DAYS':
+                    try:
+                        CACHE_MAX_AGE_DAYS = float(value.strip())
+                        print(f"读取到缓存最长保留天数: {CACHE_MAX_AGE_DAYS}")
+                    except ValueError:
+                        print(f"警告: CACHE_MAX_AGE_DAYS配置值无效，使用默认值30")
+                elif key.strip() == 'PREPROCESS_IMAGES':
+                    PREPROCESS_IMAGES = value.strip().lower() in ('1', 'true', 'yes', 'on')
+                    print(f"读取到图片压缩开关: {PREPROCESS_IMAGES}")
+                elif key.strip() == 'UPLOAD_MAX_EDGE':
+                    try:
+                        UPLOAD_MAX_EDGE = int(value.strip())
+                        print(f"读取到上传图片最长边: {UPLOAD_MAX_EDGE}")
+                    except ValueError:
+                        print(f"警告: UPLOAD_MAX_EDGE配置值无效，使用默认值1568")
+                elif key.strip() == 'UPLOAD_FORMAT':
+                    if value.strip().upper() in ('JPEG', 'JPG', 'WEBP'):
+                        UPLOAD_FORMAT = 'JPEG' if value.strip().upper() == 'JPG' else value.strip().upper()
+                        print(f"读取到上传图片格式: {UPLOAD_FORMAT}")
+                    else:
+                        print(f"警告: UPLOAD_FORMAT配置值无效，使用默认值JPEG")
+                elif key.strip() == 'UPLOAD_QUALITY':
+                    try:
+                        UPLOAD_QUALITY = min(100, max(1, int(value.strip())))
+                        print(f"读取到上传图片压缩质量: {UPLOAD_QUALITY}")
+                    except ValueError:
+                        print(f"警告: UPLOAD_QUALITY配置值无效，使用默认值85")
+
+# 模型路由：先使用快速模型，结果未通过校验时改用MODEL_NAME
+MODEL_TIERS = [FAST_MODEL_NAME, MODEL_NAME] if FAST_MODEL_NAME and FAST_MODEL_NAME != MODEL_NAME else [MODEL_NAME]
+# 缓存和相似图片索引按模型路由区分，路由配置变化后不复用旧结果
+MODEL_ROUTE_KEY = " -> ".join(MODEL_TIERS)
 
 if not IMAGE_FOLDER_PATH or not os.path.exists(IMAGE_FOLDER_PATH):
     raise ValueError(f"无效的图片文件夹路径: {IMAGE_FOLDER_PATH}")
@@ -94,10 +265,12 @@ DOUBAO_API_KEY = os.getenv('DOUBAO_API_KEY')
 if not DOUBAO_API_KEY:
     raise ValueError("请在.env文件中设置DOUBAO_API_KEY")
 
-# 初始化豆包模型客户端
+# 初始化豆包模型客户端（重试由下方的create_chat_completion统一处理，关闭SDK自带的重试）
 client = Ark(
     api_key=DOUBAO_API_KEY,
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
+    base_url=API_BASE_URL,
+    timeout=REQUEST_TIMEOUT,
+    max_retries=0,
 )
 
 # 设置结果目录和失败目录
@@ -108,24 +281,373 @@ failure_dir = Path(project_root) / "Failure"
 result_dir.mkdir(parents=True, exist_ok=True)
 failure_dir.mkdir(parents=True, exist_ok=True)
 
-# 将本地图片转换为base64编码
-def image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        # 获取文件扩展名
-        _, ext = os.path.splitext(image_path)
-        # 根据文件扩展名确定MIME类型
-        mime_types = {
-            '.jpg': 'jpeg',
-            '.jpeg': 'jpeg',
-            '.png': 'png',
-            '.bmp': 'bmp',
-            '.gif': 'gif',
-            '.tiff': 'tiff',
-            '.webp': 'webp'
+# 四个标题字段的名称（与prompt.txt要求的JSON键一致）
+TITLE_FIELDS = ('amazon_title', 'amazon_title_translation', 'short_title', 'short_title_translation')
+
+class ResponseCache:
+    """
+    豆包响应的本地缓存（SQLite），以 图片内容 + 提示词 + 模型名称 的哈希作为键
+    
+    保存原始响应和解析后的四个标题字段，打开时按保留天数和最大条目数淘汰旧条目
+    """
+    
+    def __init__(self, db_path, max_entries=CACHE_MAX_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                raw_response TEXT,
+                amazon_title TEXT,
+                amazon_title_translation TEXT,
+                short_title TEXT,
+                short_title_translation TEXT,
+                created_at REAL,
+                last_used_at REAL
+            )"""
+        )
+        self._conn.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(image_bytes, prompt, model_name):
+        """计算缓存键: hash(图片字节 + 提示词 + 模型名称)"""
+        digest = hashlib.sha256()
+        digest.update(image_bytes)
+        digest.update(b"\0")
+        digest.update(prompt.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(model_name.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get(self, cache_key):
+        """查找缓存，命中时返回 (原始响应, 四个字段的字典)，否则返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT raw_response, amazon_title, amazon_title_translation,
+                          short_title, short_title_translation
+                   FROM responses WHERE cache_key = ?""",
+                (cache_key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_used_at = ? WHERE cache_key = ?",
+                (time.time(), cache_key),
+            )
+            self._conn.commit()
+            self.hits += 1
+        raw_response, *values = row
+        return raw_response, dict(zip(TITLE_FIELDS, values))
+    
+    def put(self, cache_key, model_name, raw_response, fields):
+        """写入一条缓存"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (cache_key, model_name, raw_response,
+                 *[fields[name] for name in TITLE_FIELDS], now, now),
+            )
+            self._conn.commit()
+    
+    def evict(self):
+        """删除超过保留天数的条目，并在超出最大条目数时删除最久未使用的条目"""
+        with self._lock:
+            removed = 0
+            if self.max_age_days and self.max_age_days > 0:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+                ).rowcount
+            if self.max_entries and self.max_entries > 0:
+                removed += self._conn.execute(
+                    """DELETE FROM responses WHERE cache_key IN (
+                           SELECT cache_key FROM responses
+                           ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                       )""",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        if removed:
+            print(f"响应缓存已淘汰 {removed} 条旧记录")
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# 响应缓存放在结果目录下
+response_cache = ResponseCache(result_dir / "cache" / "doubao_responses.sqlite3") if ENABLE_CACHE else None
+
+class RunJournal:
+    """
+    逐张图片追加写入的运行日志（JSON Lines），用于中断后续跑和重试失败图片
+    
+    每行记录一张图片的处理结果，同一张图片以最后一条记录为准
+    """
+    
+    def __init__(self, journal_path):
+        self.journal_path = Path(journal_path)
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+    
+    def load(self):
+        """读取已有日志，返回 {图片文件名: 最后一条记录}"""
+        entries = {}
+        if not self.journal_path.exists():
+            return entries
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程中断时最后一行可能不完整，直接忽略
+                    continue
+                entries[entry['file']] = entry
+        return entries
+    
+    def open(self, append):
+        """打开日志文件；append为False时开始一份新的日志"""
+        self._file = open(self.journal_path, 'a' if append else 'w', encoding='utf-8')
+    
+    def record(self, image_file, success, record):
+        """追加一条图片处理记录并立即写入磁盘"""
+        entry = {
+            'file': image_file.name,
+            'status': 'success' if success else 'failed',
+            'record': record,
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         }
-        mime_type = mime_types.get(ext.lower(), 'jpeg')  # 默认为jpeg
-        return f"data:image/{mime_type};base64,{encoded_string}"
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# 运行日志放在结果目录下
+run_journal = RunJournal(result_dir / "journal" / "Title_Generation_Journal.jsonl")
+
+# 压缩后的上传图片缓存在结果目录下，按原图内容哈希命名
+upload_image_dir = result_dir / "cache" / "upload_images"
+if PREPROCESS_IMAGES and Image is None:
+    print("警告: 未安装Pillow，跳过上传前的图片压缩")
+
+def prepare_upload_image(image_file, image_bytes):
+    """
+    生成用于上传的压缩图片（限制最长边并重新编码），结果按原图哈希缓存到磁盘
+    
+    Args:
+        image_file: 原图路径
+        image_bytes: 原图内容
+    
+    Returns:
+        tuple: (上传用的文件路径, 上传用的图片内容)；不压缩或压缩后反而更大时返回原图
+    """
+    if not PREPROCESS_IMAGES or Image is None:
+        return image_file, image_bytes
+    
+    extension = '.webp' if UPLOAD_FORMAT == 'WEBP' else '.jpg'
+    source_hash = hashlib.sha256(image_bytes).hexdigest()
+    variant_path = upload_image_dir / f"{source_hash}_{UPLOAD_MAX_EDGE}_q{UPLOAD_QUALITY}{extension}"
+    
+    if not variant_path.exists():
+        try:
+            with Image.open(image_file) as img:
+                img.load()
+                if UPLOAD_MAX_EDGE > 0:
+                    # thumbnail只缩小不放大，并保持宽高比
+                    img.thumbnail((UPLOAD_MAX_EDGE, UPLOAD_MAX_EDGE), Image.LANCZOS)
+                if UPLOAD_FORMAT == 'JPEG' and img.mode != 'RGB':
+                    # JPEG不支持透明通道，透明部分使用白色背景
+                    rgba = img.convert('RGBA')
+                    background = Image.new('RGB', rgba.size, (255, 255, 255))
+                    background.paste(rgba, mask=rgba.getchannel('A'))
+                    img = background
+                elif UPLOAD_FORMAT == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA')
+                upload_image_dir.mkdir(parents=True, exist_ok=True)
+                # 先写入临时文件再改名，避免并发时读到未写完的文件
+                temp_path = variant_path.with_name(f"{variant_path.name}.{threading.get_ident()}.tmp")
+                img.save(temp_path, format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY)
+                os.replace(temp_path, variant_path)
+        except (OSError, Image.DecompressionBombError) as e:
+            # Pillow无法打开或解码的图片直接上传原图
+            with print_lock:
+                print(f"  {Path(image_file).name} 无法压缩（{type(e).__name__}），上传原图")
+            return image_file, image_bytes
+    
+    with open(variant_path, "rb") as f:
+        variant_bytes = f.read()
+    if len(variant_bytes) >= len(image_bytes):
+        return image_file, image_bytes
+    return variant_path, variant_bytes
+
+def compute_dhash(image_file):
+    """计算图片的64位差异哈希（dHash），相似图片的哈希汉明距离较小"""
+    with Image.open(image_file) as img:
+        # 缩小为9x8灰度图，比较每行相邻像素的亮度
+        small = img.convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+class PerceptualHashIndex:
+    """
+    相似图片索引：以dHash为键保存已生成的标题，用BK树按汉明距离查找
+    
+    索引以JSON Lines追加保存，只加载与当前提示词和模型一致的记录；
+    加载时同一提示词和模型下相同哈希只保留最新的一条，有重复或无法解析的行时重写索引文件
+    """
+    
+    def __init__(self, index_path, max_distance, fingerprint):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_distance = max_distance
+        self.fingerprint = fingerprint
+        self.reused_count = 0
+        self._root = None  # BK树节点: [哈希, 记录, {距离: 子节点}]
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load()
+    
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        latest = {}  # {(指纹, 哈希): 记录}，后追加的记录覆盖先前的记录
+        line_count = 0
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line_count += 1
+                try:
+                    entry = json.loads(line)
+                    key = (entry.get('fingerprint'), entry['hash'])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+                latest.pop(key, None)
+                latest[key] = entry
+        for (fingerprint, image_hash), entry in latest.items():
+            if fingerprint == self.fingerprint:
+                self._insert(int(image_hash, 16), entry)
+        if len(latest) < line_count:
+            self._compact(latest.values())
+        print(f"相似图片索引已加载 {self._size} 条记录")
+    
+    def _compact(self, entries):
+        """重写索引文件，去掉重复和无法解析的行"""
+        temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"警告: 无法整理相似图片索引: {e}")
+    
+    def _insert(self, image_hash, entry):
+        if self._root is None:
+            self._root = [image_hash, entry, {}]
+            self._size += 1
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(image_hash, node[0])
+            if distance == 0:
+                # 完全相同的哈希保留最新的标题
+                node[1] = entry
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, entry, {}]
+                self._size += 1
+                return
+            node = child
+    
+    def find(self, image_hash):
+        """查找距离不超过max_distance的最近记录，返回 (距离, 记录) 或None"""
+        with self._lock:
+            if self._root is None:
+                return None
+            best = None
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                distance = hamming_distance(image_hash, node[0])
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, node[1])
+                # BK树剪枝：只有距离在[d - max, d + max]内的子树可能包含结果
+                for child_distance, child in node[2].items():
+                    if distance - self.max_distance <= child_distance <= distance + self.max_distance:
+                        stack.append(child)
+            if best is not None:
+                self.reused_count += 1
+        return best
+    
+    def add(self, image_hash, image_name, fields):
+        """加入一张已生成标题的图片并追加写入索引文件"""
+        entry = {
+            'hash': f"{image_hash:016x}",
+            'fingerprint': self.fingerprint,
+            'image': image_name,
+            'fields': fields,
+        }
+        with self._lock:
+            self._insert(image_hash, entry)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+# 相似图片索引放在结果目录下，提示词或模型变化后旧记录不再复用
+phash_index = None
+if PHASH_MAX_DISTANCE >= 0:
+    if Image is None:
+        print("警告: 未安装Pillow，无法复用相似图片的标题")
+    else:
+        phash_fingerprint = hashlib.sha256(f"{MODEL_ROUTE_KEY}\0{prompt_content}".encode('utf-8')).hexdigest()[:16]
+        phash_index = PerceptualHashIndex(result_dir / "cache" / "phash_index.jsonl",
+                                          PHASH_MAX_DISTANCE, phash_fingerprint)
+
+# 将本地图片转换为base64编码
+def image_to_base64(image_path, image_bytes=None):
+    if image_bytes is None:
+        with open(image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+    encoded_string = base64.b64encode(image_bytes).decode('utf-8')
+    # 获取文件扩展名
+    _, ext = os.path.splitext(image_path)
+    # 根据文件扩展名确定MIME类型
+    mime_types = {
+        '.jpg': 'jpeg',
+        '.jpeg': 'jpeg',
+        '.png': 'png',
+        '.bmp': 'bmp',
+        '.gif': 'gif',
+        '.tiff': 'tiff',
+        '.webp': 'webp'
+    }
+    mime_type = mime_types.get(ext.lower(), 'jpeg')  # 默认为jpeg
+    return f"data:image/{mime_type};base64,{encoded_string}"
 
 def extract_json_from_response(response_text):
     """从响应文本中提取JSON内容"""
@@ -144,51 +666,358 @@ def extract_json_from_response(response_text):
     
     return None, None
 
-def main():
-    """主函数"""
-    print("开始处理图片...")
+# 多线程打印时避免输出交错
+print_lock = threading.Lock()
+
+def parse_title_fields(generated_content):
+    """从模型响应中解析四个标题字段，解析失败时将整个内容作为amazon_title使用"""
+    # 从响应中提取JSON（假设它被包装在一些文本中）
+    _, parsed_data = extract_json_from_response(generated_content)
+    if isinstance(parsed_data, dict):
+        return {name: parsed_data.get(name, "") for name in TITLE_FIELDS}
+    return {
+        'amazon_title': generated_content,
+        'amazon_title_translation': "",
+        'short_title': "",
+        'short_title_translation': "",
+    }
+
+def has_title_fields(fields):
+    """检查四个标题字段是否都是非空字符串（响应被正确解析）"""
+    return all(isinstance(fields.get(name), str) and fields[name].strip() for name in TITLE_FIELDS)
+
+def is_valid_title_fields(fields):
+    """检查四个标题字段是否都是非空字符串，且亚马逊标题不超过MAX_TITLE_LENGTH个字符"""
+    if not has_title_fields(fields):
+        return False
+    return MAX_TITLE_LENGTH <= 0 or len(fields['amazon_title']) <= MAX_TITLE_LENGTH
+
+class ConcurrencyController:
+    """
+    AIMD并发控制：请求成功时缓慢增加允许的并发数，遇到限流时减半，其他错误（5xx、超时等）不改变并发数
     
-    # 支持的图片格式
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+    并发数在1和MAX_CONCURRENCY之间浮动，使请求速率保持在账号限流值附近
+    """
     
-    # 获取所有图片文件
-    image_files = []
-    added_files = set()
-    for ext in image_extensions:
-        # 添加小写扩展名的文件
-        for file_path in Path(IMAGE_FOLDER_PATH).glob(f"*{ext}"):
-            if file_path.name.lower() not in added_files:
-                image_files.append(file_path)
-                added_files.add(file_path.name.lower())
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.throttled_count = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """等待直到当前进行中的请求数低于允许的并发数"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+    
+    def release(self, outcome='success'):
+        """请求结束；outcome为'success'（成功）、'throttle'（被限流）或'error'（其他错误）"""
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == 'throttle':
+                self.throttled_count += 1
+                now = time.monotonic()
+                # 同一批并发请求同时被限流时只减半一次
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            elif outcome == 'success':
+                # 每个窗口（约limit个成功请求）并发数加1
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+# 所有请求共用一个并发控制器
+concurrency_controller = ConcurrencyController(MAX_CONCURRENCY)
+
+def classify_api_error(error):
+    """
+    判断API错误类型
+    
+    Returns:
+        str: 'throttle'（限流429）、'transient'（超时、连接错误、5xx，可重试）或None（不可重试）
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code == 429:
+        return 'throttle'
+    if status_code is not None and (status_code >= 500 or status_code == 408):
+        return 'transient'
+    # 超时和连接错误没有状态码，按异常类型名判断
+    error_type_names = [cls.__name__ for cls in type(error).__mro__]
+    if any('Timeout' in name or 'Connection' in name for name in error_type_names):
+        return 'transient'
+    return None
+
+def get_retry_delay(error, attempt):
+    """计算重试等待时间：优先使用服务端的Retry-After，否则使用带随机抖动的指数退避"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+def create_chat_completion(**kwargs):
+    """调用client.chat.completions.create，对限流、5xx和超时进行退避重试，并受并发控制器限制"""
+    attempt = 0
+    while True:
+        concurrency_controller.acquire()
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            error_kind = classify_api_error(e)
+            concurrency_controller.release('throttle' if error_kind == 'throttle' else 'error')
+            if error_kind is None or attempt >= MAX_RETRIES:
+                raise
+            delay = get_retry_delay(e, attempt)
+            attempt += 1
+            with print_lock:
+                print(f"  请求失败（{type(e).__name__}），{delay:.1f} 秒后进行第 {attempt} 次重试，"
+                      f"当前允许并发数: {int(concurrency_controller.limit)}")
+            time.sleep(delay)
+            continue
+        concurrency_controller.release()
+        return response
+
+class RequestMetrics:
+    """
+    记录每次豆包请求的耗时、上传数据大小、token用量和费用（JSON Lines），并在运行结束时汇总
+    """
+    
+    # 耗时分布的区间上限（秒）
+    LATENCY_BUCKETS = (1, 2, 5, 10, 20, 60)
+    
+    def __init__(self, metrics_dir):
+        self.metrics_dir = Path(metrics_dir)
+        self.metrics_path = None
+        self.records = []
+        self._lock = threading.Lock()
+    
+    def record(self, image_names, model_name, wall_time, payload_bytes, usage=None, error=None):
+        """记录一次请求；批量请求的image_names包含多张图片"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+        cost = (prompt_tokens * PRICE_PER_M_INPUT_TOKENS
+                + completion_tokens * PRICE_PER_M_OUTPUT_TOKENS) / 1_000_000
+        entry = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'images': list(image_names),
+            'model': model_name,
+            'status': 'failed' if error is not None else 'success',
+            'error': f"{type(error).__name__}: {error}" if error is not None else "",
+            'wall_time': round(wall_time, 3),
+            'payload_bytes': payload_bytes,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': round(cost, 6),
+        }
+        with self._lock:
+            if self.metrics_path is None:
+                self.metrics_dir.mkdir(parents=True, exist_ok=True)
+                self.metrics_path = self.metrics_dir / f"Title_Generation_Metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+            self.records.append(entry)
+            with open(self.metrics_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def summary(self, slowest_count=5):
+        """生成本次运行的汇总文本"""
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return "本次运行没有发送API请求"
+        
+        wall_times = sorted(entry['wall_time'] for entry in records)
+        image_count = sum(len(entry['images']) for entry in records if entry['status'] == 'success')
+        failed_count = sum(1 for entry in records if entry['status'] == 'failed')
+        prompt_tokens = sum(entry['prompt_tokens'] for entry in records)
+        completion_tokens = sum(entry['completion_tokens'] for entry in records)
+        payload_bytes = sum(entry['payload_bytes'] for entry in records)
+        cost = sum(entry['cost'] for entry in records)
         
-        # 添加大写扩展名的文件
-        for file_path in Path(IMAGE_FOLDER_PATH).glob(f"*{ext.upper()}"):
-            if file_path.name.lower() not in added_files:
-                image_files.append(file_path)
-                added_files.add(file_path.name.lower())
+        def percentile(fraction):
+            return wall_times[min(len(wall_times) - 1, int(round(fraction * (len(wall_times) - 1))))]
+        
+        lines = [
+            f"请求数: {len(records)}（失败 {failed_count}），成功生成标题的图片: {image_count}",
+            f"请求耗时: 平均 {sum(wall_times) / len(wall_times):.2f}s，p50 {percentile(0.5):.2f}s，"
+            f"p95 {percentile(0.95):.2f}s，最长 {wall_times[-1]:.2f}s",
+            f"上传数据: 共 {payload_bytes / 1024 / 1024:.1f} MB，平均每次请求 {payload_bytes / len(records) / 1024:.0f} KB",
+            f"token: 输入 {prompt_tokens}，输出 {completion_tokens}",
+        ]
+        model_counts = {}
+        for entry in records:
+            model_counts[entry['model']] = model_counts.get(entry['model'], 0) + 1
+        lines.append("各模型请求数: " + "，".join(f"{name} {count}" for name, count in model_counts.items()))
+        if image_count:
+            lines.append(f"每张图片平均: 输入 {prompt_tokens / image_count:.0f} token，"
+                         f"输出 {completion_tokens / image_count:.0f} token，费用 {cost / image_count:.4f} 元")
+        lines.append(f"总费用: {cost:.4f} 元")
+        
+        # 耗时分布直方图
+        lines.append("耗时分布:")
+        bounds = list(self.LATENCY_BUCKETS) + [None]
+        counts = [0] * len(bounds)
+        for wall_time in wall_times:
+            for bucket_index, bound in enumerate(bounds):
+                if bound is None or wall_time < bound:
+                    counts[bucket_index] += 1
+                    break
+        max_count = max(counts)
+        lower = 0
+        for bound, count in zip(bounds, counts):
+            label = f"{lower}-{bound}s" if bound is not None else f">{lower}s"
+            bar = "#" * (round(count / max_count * 40) if max_count else 0)
+            lines.append(f"  {label:>8} {count:>6} {bar}")
+            lower = bound
+        
+        # 最慢的请求
+        lines.append(f"最慢的 {min(slowest_count, len(records))} 次请求:")
+        for entry in sorted(records, key=lambda item: item['wall_time'], reverse=True)[:slowest_count]:
+            lines.append(f"  {entry['wall_time']:.2f}s  {', '.join(entry['images'])}"
+                         f"{'  (' + entry['error'] + ')' if entry['error'] else ''}")
+        return "\n".join(lines)
     
-    if not image_files:
-        print(f"在 {IMAGE_FOLDER_PATH} 中没有找到支持的图片文件")
+    def save_summary(self):
+        """打印汇总并保存到与明细文件同名的.txt文件"""
+        text = self.summary()
+        print("\n请求统计:")
+        print(text)
+        if self.metrics_path is not None:
+            summary_path = self.metrics_path.with_suffix('.txt')
+            summary_path.write_text(text + "\n", encoding='utf-8')
+            print(f"请求明细: {self.metrics_path}")
+            print(f"统计汇总: {summary_path}")
+
+# 请求统计保存在结果目录下
+request_metrics = RequestMetrics(result_dir / "metrics")
+
+def timed_chat_completion(encoded_list, **kwargs):
+    """调用create_chat_completion并记录耗时、上传数据大小、token用量和费用"""
+    image_names = [encoded['image_file'].name for encoded in encoded_list]
+    payload_bytes = sum(encoded['payload_size'] for encoded in encoded_list)
+    start = time.perf_counter()
+    try:
+        response = create_chat_completion(**kwargs)
+    except Exception as e:
+        request_metrics.record(image_names, kwargs.get('model'), time.perf_counter() - start,
+                               payload_bytes, error=e)
+        raise
+    request_metrics.record(image_names, kwargs.get('model'), time.perf_counter() - start,
+                           payload_bytes, usage=getattr(response, 'usage', None))
+    return response
+
+def build_result_row(image_file, fields):
+    """将四个标题字段转换为输出Excel的一行"""
+    return {
+        '图片名称': image_file.stem,  # 移除文件扩展名
+        '亚马逊产品标题': fields['amazon_title'],
+        '亚马逊产品标题翻译': fields['amazon_title_translation'],
+        '短标题': fields['short_title'],
+        '短标题翻译': fields['short_title_translation']
+    }
+
+def reuse_similar_titles(encoded):
+    """在相似图片索引中查找相近的图片，找到时将其标题写入encoded['fields']并返回True"""
+    if phash_index is None or encoded['phash'] is None or encoded['fields'] is not None:
+        return False
+    match = phash_index.find(encoded['phash'])
+    if match is None:
+        return False
+    distance, entry = match
+    with print_lock:
+        print(f"  {encoded['image_file'].name} 与已处理图片 {entry['image']} 相似（距离 {distance}），复用其标题")
+    encoded['fields'] = entry['fields']
+    return True
+
+def encode_image(image_file):
+    """
+    读取并编码单张图片（查找响应缓存、压缩、base64编码），不涉及网络请求
+    
+    Returns:
+        dict: image_file, cache_key, fields（缓存命中时的四个标题字段，否则为None）,
+              payload（base64图片数据，缓存命中时为None）, payload_size（payload字节数）
+    """
+    with open(image_file, "rb") as f:
+        image_bytes = f.read()
+    
+    encoded = {
+        'image_file': image_file,
+        'cache_key': None,
+        'fields': None,
+        'payload': None,
+        'payload_size': 0,
+        'phash': None,
+    }
+    
+    # 查找响应缓存，命中时不需要编码图片
+    if response_cache is not None:
+        encoded['cache_key'] = ResponseCache.make_key(image_bytes, prompt_content, MODEL_ROUTE_KEY)
+        cached = response_cache.get(encoded['cache_key'])
+        if cached is not None:
+            _, encoded['fields'] = cached
+            return encoded
+    
+    # 查找相似图片索引，找到相近的图片时复用其标题
+    if phash_index is not None:
+        try:
+            encoded['phash'] = compute_dhash(image_file)
+        except (OSError, Image.DecompressionBombError) as e:
+            # 无法解码的图片只是不参与相似图片复用，仍然正常请求
+            with print_lock:
+                print(f"  {image_file.name} 无法计算感知哈希（{type(e).__name__}），不复用相似图片的标题")
+            encoded['phash'] = None
+        if reuse_similar_titles(encoded):
+            return encoded
+    
+    # 压缩图片后转换为base64编码
+    upload_path, upload_bytes = prepare_upload_image(image_file, image_bytes)
+    encoded['payload'] = image_to_base64(upload_path, upload_bytes)
+    encoded['payload_size'] = len(encoded['payload'])
+    return encoded
+
+def remember_generated_fields(encoded, raw_response, fields, model_name):
+    """
+    将新生成的标题写入响应缓存和相似图片索引
+    
+    只缓存正确解析的响应，避免无法解析或被截断的响应在之后的运行（包括--retry-failed）中被重复使用；
+    标题长度（MAX_TITLE_LENGTH）只决定是否改用下一级模型，最终使用的超长标题同样缓存，再次运行时不重新请求
+    """
+    if not has_title_fields(fields):
         return
+    if response_cache is not None:
+        response_cache.put(encoded['cache_key'], model_name, raw_response, fields)
+    # 只有通过校验的标题才提供给相似图片复用
+    if phash_index is not None and encoded['phash'] is not None and is_valid_title_fields(fields):
+        phash_index.add(encoded['phash'], encoded['image_file'].name, fields)
+
+def request_title(encoded, start_tier=0):
+    """
+    根据encode_image的结果调用豆包模型生成标题，返回结果行
     
-    print(f"找到 {len(image_files)} 个图片文件")
+    配置了FAST_MODEL_NAME时先使用快速模型；请求失败或结果未通过is_valid_title_fields校验时改用MODEL_NAME
     
-    # 存储结果和失败记录
-    results = []
-    failed_images = []
+    Args:
+        encoded: encode_image的结果
+        start_tier: 从MODEL_TIERS中的第几个模型开始尝试
+    """
+    image_file = encoded['image_file']
+    if encoded['fields'] is not None:
+        return build_result_row(image_file, encoded['fields'])
     
-    # 处理每个图片
-    success_count = 0
-    for idx, image_file in enumerate(image_files, 1):
+    for tier_index in range(min(start_tier, len(MODEL_TIERS) - 1), len(MODEL_TIERS)):
+        model_name = MODEL_TIERS[tier_index]
+        is_last_tier = tier_index == len(MODEL_TIERS) - 1
+        
+        # 调用豆包模型
         try:
-            print(f"[{idx}/{len(image_files)}] 正在处理: {image_file.name}")
-            
-            # 将本地图片转换为base64编码
-            image_base64 = image_to_base64(image_file)
-            
-            # 调用豆包模型
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
+            response = timed_chat_completion(
+                [encoded],
+                model=model_name,
                 messages=[
                     {
                         "role": "user",
@@ -196,7 +1025,7 @@ def main():
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": image_base64
+                                    "url": encoded['payload']
                                 },
                             },
                             {"type": "text", "text": prompt_content},
@@ -204,88 +1033,422 @@ def main():
                     }
                 ],
             )
-            
-            # 获取生成的内容
-            generated_content = response.choices[0].message.content.strip()
-            
-            # 解析JSON响应
+        except Exception as e:
+            if is_last_tier:
+                raise
+            with print_lock:
+                print(f"  {image_file.name} 使用 {model_name} 请求失败（{type(e).__name__}），改用 {MODEL_TIERS[-1]}")
+            continue
+        
+        # 获取生成的内容并解析JSON响应
+        generated_content = response.choices[0].message.content.strip()
+        fields = parse_title_fields(generated_content)
+        
+        # 最后一级模型的结果直接使用（与未启用路由时一致）
+        if is_last_tier or is_valid_title_fields(fields):
+            remember_generated_fields(encoded, generated_content, fields, model_name)
+            return build_result_row(image_file, fields)
+        with print_lock:
+            print(f"  {image_file.name} 使用 {model_name} 生成的标题未通过校验，改用 {MODEL_TIERS[-1]}")
+
+def build_batch_prompt(image_count):
+    """在提示词后追加批量请求的输出格式要求"""
+    return (
+        f"{prompt_content}\n\n"
+        f"本次请求包含 {image_count} 张图片，按出现顺序编号为 1 到 {image_count}。"
+        f"请按上述要求分别为每张图片生成标题，只返回一个JSON数组，不要包含其他内容。"
+        f"数组中每个元素是一个对象，包含 image_index（图片编号，整数）以及 "
+        f"{', '.join(TITLE_FIELDS)} 四个字段。"
+    )
+
+def parse_batch_response(response_text, image_count):
+    """
+    解析批量请求返回的JSON数组
+    
+    Returns:
+        dict: {图片编号(从1开始): 四个标题字段}，只包含解析成功且通过is_valid_title_fields校验的图片
+    """
+    start = response_text.find('[')
+    end = response_text.rfind(']') + 1
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(response_text[start:end])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+    
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            image_index = int(item.get('image_index'))
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= image_index <= image_count:
+            continue
+        fields = {name: item.get(name, "") for name in TITLE_FIELDS}
+        if is_valid_title_fields(fields):
+            parsed[image_index] = fields
+    return parsed
+
+def request_titles_batch(encoded_list):
+    """
+    在一次请求中发送多张图片生成标题（使用MODEL_TIERS中的第一个模型）
+    
+    Returns:
+        dict: {encoded_list中的位置: 结果行}；未能解析的图片不在结果中，由调用方改为逐张请求
+    """
+    content = []
+    for image_index, encoded in enumerate(encoded_list, 1):
+        content.append({"type": "text", "text": f"图片 {image_index}:"})
+        content.append({"type": "image_url", "image_url": {"url": encoded['payload']}})
+    content.append({"type": "text", "text": build_batch_prompt(len(encoded_list))})
+    
+    response = timed_chat_completion(
+        encoded_list,
+        model=MODEL_TIERS[0],
+        messages=[{"role": "user", "content": content}],
+    )
+    generated_content = response.choices[0].message.content.strip()
+    parsed = parse_batch_response(generated_content, len(encoded_list))
+    
+    rows = {}
+    for image_index, fields in parsed.items():
+        encoded = encoded_list[image_index - 1]
+        # 每张图片单独缓存自己的那部分结果
+        raw_item = json.dumps(dict(image_index=image_index, **fields), ensure_ascii=False)
+        remember_generated_fields(encoded, raw_item, fields, MODEL_TIERS[0])
+        rows[image_index - 1] = build_result_row(encoded['image_file'], fields)
+    return rows
+
+def generate_title(image_file):
+    """为单张图片调用豆包模型生成标题，返回结果行（优先使用响应缓存）"""
+    return request_title(encode_image(image_file))
+
+class PayloadBudget:
+    """限制预取队列中图片数据的总字节数，避免大文件夹占满内存"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._condition = threading.Condition()
+    
+    def acquire(self, size, stop_event):
+        """等待直到有足够的额度；队列为空时允许单个超过上限的图片通过"""
+        with self._condition:
+            while (self.used_bytes > 0 and self.used_bytes + size > self.max_bytes
+                   and not stop_event.is_set()):
+                self._condition.wait(0.5)
+            self.used_bytes += size
+    
+    def release(self, size):
+        with self._condition:
+            self.used_bytes -= size
+            self._condition.notify_all()
+
+def run_title_pipeline(image_files, on_result):
+    """
+    生产者/消费者流水线：编码线程预取并编码后续图片放入有界队列，请求线程同时调用API
+    
+    Args:
+        image_files: 需要处理的图片列表
+        on_result: 回调函数 on_result(序号, 是否成功, 结果行或失败记录)，序号对应image_files中的位置
+    """
+    total = len(image_files)
+    index_queue = queue.Queue()
+    for position in range(total):
+        index_queue.put(position)
+    # 预取队列最多保存PREFETCH_COUNT张已编码的图片，并限制总字节数
+    payload_queue = queue.Queue(maxsize=PREFETCH_COUNT)
+    budget = PayloadBudget(PREFETCH_MAX_MB * 1024 * 1024)
+    stop_event = threading.Event()
+    
+    def record_failure(position, error):
+        image_file = image_files[position]
+        with print_lock:
+            print(f"✗ 处理失败 {image_file.name}: {str(error)}")
+        # 记录失败的图片（移除文件扩展名）
+        on_result(position, False, {
+            '图片名称': image_file.stem,
+            '错误信息': str(error)
+        })
+    
+    def encoder_worker():
+        while not stop_event.is_set():
             try:
-                # 从响应中提取JSON（假设它被包装在一些文本中）
-                # 找到第一个'{'和最后一个'}'来提取JSON部分
-                start_idx = generated_content.find('{')
-                end_idx = generated_content.rfind('}') + 1
-                
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = generated_content[start_idx:end_idx]
-                    parsed_data = json.loads(json_str)
-                    
-                    # 提取四个字段
-                    amazon_title = parsed_data.get("amazon_title", "")
-                    amazon_title_translation = parsed_data.get("amazon_title_translation", "")
-                    short_title = parsed_data.get("short_title", "")
-                    short_title_translation = parsed_data.get("short_title_translation", "")
-                else:
-                    # 如果未找到JSON，则将整个内容作为amazon_title使用
-                    amazon_title = generated_content
-                    amazon_title_translation = ""
-                    short_title = ""
-                    short_title_translation = ""
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，则将整个内容作为amazon_title使用
-                amazon_title = generated_content
-                amazon_title_translation = ""
-                short_title = ""
-                short_title_translation = ""
-            
-            # 移除文件扩展名
-            image_name_without_extension = image_file.stem
-            
-            # 添加到结果列表
-            results.append({
-                '图片名称': image_name_without_extension,
-                '亚马逊产品标题': amazon_title,
-                '亚马逊产品标题翻译': amazon_title_translation,
-                '短标题': short_title,
-                '短标题翻译': short_title_translation
-            })
-            
-            print(f"✓ 处理成功: {image_file.name}")
-            success_count += 1
-            
+                position = index_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                encoded = encode_image(image_files[position])
+            except Exception as e:
+                record_failure(position, e)
+                continue
+            budget.acquire(encoded['payload_size'], stop_event)
+            while not stop_event.is_set():
+                try:
+                    payload_queue.put((position, encoded), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+    
+    def process_single(position, encoded, start_tier=0):
+        try:
+            row = request_title(encoded, start_tier)
         except Exception as e:
-            print(f"✗ 处理失败 {image_file.name}: {str(e)}")
-            # 移除文件扩展名
-            image_name_without_extension = image_file.stem
-            
-            # 记录失败的图片到失败列表
-            failed_images.append({
-                '图片名称': image_name_without_extension,
-                '错误信息': str(e)
-            })
-    
-    # 创建DataFrame
-    df = pd.DataFrame(results)
-
-    # 计算父类编号
-    parent_class_ids = []
-    image_names = df['图片名称'].tolist()
-    
-    # 根据PARENT_CLASS_GROUP_SIZE分组计算父类编号
-    for i in range(len(image_names)):
-        # 计算当前行所属的组索引
-        group_index = i // PARENT_CLASS_GROUP_SIZE
-        # 计算该组的第一个元素索引
-        first_index_in_group = group_index * PARENT_CLASS_GROUP_SIZE
-        # 使用该组第一个图片的名称作为父类编号
-        parent_class_id = image_names[first_index_in_group]
-        parent_class_ids.append(parent_class_id)
-    
-    # 将父类编号添加到DataFrame中
-    df['父类编号'] = parent_class_ids
-
-    # 重新排列列顺序，将父类编号列放在F列位置（即索引为1的位置）
-    df = df[['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译']]
+            record_failure(position, e)
+            return
+        with print_lock:
+            print(f"✓ 处理成功: {image_files[position].name}")
+        on_result(position, True, row)
+    
+    def process_batch(batch):
+        # 缓存命中的图片不需要发送请求
+        uncached = []
+        for position, encoded in batch:
+            # 预取期间可能已经处理了相似图片，发送请求前再查找一次
+            reuse_similar_titles(encoded)
+            if encoded['fields'] is not None or BATCH_SIZE == 1:
+                process_single(position, encoded)
+            else:
+                uncached.append((position, encoded))
+        if len(uncached) == 1:
+            process_single(*uncached[0])
+        elif uncached:
+            # 批量请求本身失败时从第一个模型开始逐张请求；批量结果中未通过校验的图片直接使用最后一级模型
+            fallback_tier = len(MODEL_TIERS) - 1
+            try:
+                rows = request_titles_batch([encoded for _, encoded in uncached])
+            except Exception as e:
+                with print_lock:
+                    print(f"  批量请求失败（{type(e).__name__}），改为逐张请求")
+                rows = {}
+                fallback_tier = 0
+            for batch_index, (position, encoded) in enumerate(uncached):
+                if batch_index in rows:
+                    with print_lock:
+                        print(f"✓ 处理成功: {image_files[position].name}")
+                    on_result(position, True, rows[batch_index])
+                else:
+                    # 批量结果中缺少或无法解析的图片改为逐张请求
+                    process_single(position, encoded, fallback_tier)
+    
+    def request_worker():
+        finished = False
+        while not finished:
+            item = payload_queue.get()
+            if item is None or stop_event.is_set():
+                return
+            batch = [item]
+            # 批量模式下从预取队列中再取出最多BATCH_SIZE-1张图片
+            while len(batch) < BATCH_SIZE:
+                try:
+                    next_item = payload_queue.get(timeout=0.2)
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    finished = True
+                    break
+                batch.append(next_item)
+            for position, encoded in batch:
+                budget.release(encoded['payload_size'])
+                with print_lock:
+                    print(f"[{position + 1}/{total}] 正在处理: {image_files[position].name}")
+            process_batch(batch)
+    
+    encoders = [threading.Thread(target=encoder_worker, daemon=True)
+                for _ in range(min(ENCODE_WORKERS, max(total, 1)))]
+    requesters = [threading.Thread(target=request_worker, daemon=True)
+                  for _ in range(MAX_CONCURRENCY)]
+    for thread in encoders + requesters:
+        thread.start()
+    
+    try:
+        # 使用带超时的join，保证Ctrl-C能及时响应
+        for thread in encoders:
+            while thread.is_alive():
+                thread.join(0.5)
+        for _ in requesters:
+            payload_queue.put(None)
+        for thread in requesters:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+        raise
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
 
+def scan_image_files(folder, recursive=False, quiet=False):
+    """
+    使用os.scandir单次遍历文件夹查找图片（扩展名不区分大小写）
+    
+    Args:
+        folder: 图片文件夹路径
+        recursive: 是否包含子文件夹中的图片
+        quiet: 不打印重复文件名的警告（监视模式反复扫描时使用）
+    
+    Returns:
+        list: 按相对路径排序的图片路径列表；文件名相同（不区分大小写）的图片只保留第一张
+    """
+    found = []
+    folders = [Path(folder)]
+    while folders:
+        current = folders.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            folders.append(Path(entry.path))
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        found.append(Path(entry.path))
+        except OSError as e:
+            print(f"警告: 无法读取文件夹 {current}: {e}")
+    
+    # 按相对路径排序，保证每次运行的处理顺序（以及父类编号分组）一致
+    found.sort(key=lambda path: path.relative_to(folder).as_posix().lower())
+    
+    image_files = []
+    added_files = set()
+    for file_path in found:
+        if file_path.name.lower() in added_files:
+            if not quiet:
+                print(f"警告: 文件名重复，跳过: {file_path}")
+            continue
+        image_files.append(file_path)
+        added_files.add(file_path.name.lower())
+    return image_files
+
+def save_title_results(outcomes, output_excel):
+    """
+    按原始文件顺序汇总结果，计算父类编号并保存到Excel，同时更新失败记录
+    
+    Args:
+        outcomes: 与图片列表对应的 (是否成功, 结果行或失败记录) 列表，未处理的为None
+        output_excel: 输出Excel文件路径
+    
+    Returns:
+        tuple: (成功结果列表, 失败记录列表)
+    """
+    results = []
+    failed_images = []
+    for outcome in outcomes:
+        if outcome is None:
+            continue
+        success, record = outcome
+        if success:
+            results.append(record)
+        else:
+            failed_images.append(record)
+    
+    if results:
+        # 创建DataFrame
+        df = pd.DataFrame(results)
+    
+        # 计算父类编号
+        parent_class_ids = []
+        image_names = df['图片名称'].tolist()
+        
+        # 根据PARENT_CLASS_GROUP_SIZE分组计算父类编号
+        for i in range(len(image_names)):
+            # 计算当前行所属的组索引
+            group_index = i // PARENT_CLASS_GROUP_SIZE
+            # 计算该组的第一个元素索引
+            first_index_in_group = group_index * PARENT_CLASS_GROUP_SIZE
+            # 使用该组第一个图片的名称作为父类编号
+            parent_class_id = image_names[first_index_in_group]
+            parent_class_ids.append(parent_class_id)
+        
+        # 将父类编号添加到DataFrame中
+        df['父类编号'] = parent_class_ids
+    
+        # 重新排列列顺序，将父类编号列放在F列位置（即索引为1的位置）
+        df = df[['图片名称', '父类编号', '亚马逊产品标题', '亚马逊产品标题翻译', '短标题', '短标题翻译']]
+    
+        # 保存到Excel文件
+        df.to_excel(output_excel, index=False, engine='openpyxl')
+        print(f"结果已保存到: {output_excel}")
+    else:
+        print("没有成功生成标题的图片，未保存结果文件")
+    print(f"总共处理了: {len(results)} 张图片")
+
+    # 如果有失败的图片，保存到失败记录文件（包含运行日志中仍未成功的图片）
+    if failed_images:
+        failure_excel = failure_dir / "Failed_Images.xlsx"
+        failure_df = pd.DataFrame(failed_images)
+        failure_df.to_excel(failure_excel, index=False, engine='openpyxl')
+        print(f"发现 {len(failed_images)} 张图片处理失败，失败记录已保存到: {failure_excel}")
+    else:
+        # 删除之前运行留下的失败记录，失败记录文件只列出目前仍未成功的图片
+        failure_excel = failure_dir / "Failed_Images.xlsx"
+        if failure_excel.exists():
+            failure_excel.unlink()
+            print(f"已删除之前的失败记录: {failure_excel}")
+        print("所有图片都处理成功，没有失败记录。")
+    
+    return results, failed_images
+
+def main(resume=False, retry_failed=False, watch=False):
+    """
+    主函数
+    
+    Args:
+        resume: 跳过运行日志中已有记录的图片，只处理剩余图片
+        retry_failed: 只重新处理运行日志中记录为失败的图片
+        watch: 处理完现有图片后持续监视图片文件夹，新图片到达后立即处理
+    """
+    print("开始处理图片...")
+    
+    # 获取所有图片文件
+    image_files = scan_image_files(IMAGE_FOLDER_PATH, RECURSIVE_SCAN)
+    
+    if not image_files and not watch:
+        print(f"在 {IMAGE_FOLDER_PATH} 中没有找到支持的图片文件")
+        return
+    
+    print(f"找到 {len(image_files)} 个图片文件")
+    
+    # 结果按原始文件顺序存放，保证父类编号分组与顺序处理一致
+    outcomes = [None] * len(image_files)
+    
+    # 读取运行日志，续跑或重试时复用已完成图片的结果
+    journal_entries = run_journal.load() if (resume or retry_failed) else {}
+    pending_indices = []
+    for idx, image_file in enumerate(image_files):
+        entry = journal_entries.get(image_file.name)
+        if entry is None:
+            # 重试模式只处理失败的图片，没有记录的图片不处理
+            if not retry_failed:
+                pending_indices.append(idx)
+        elif retry_failed and entry['status'] == 'failed':
+            pending_indices.append(idx)
+        else:
+            outcomes[idx] = (entry['status'] == 'success', entry['record'])
+    
+    if resume or retry_failed:
+        mode_name = "重试失败图片" if retry_failed else "续跑"
+        print(f"{mode_name}模式: 运行日志中已有 {len(image_files) - len(pending_indices)} 张图片的结果，"
+              f"本次需要处理 {len(pending_indices)} 张")
+    run_journal.open(append=resume or retry_failed)
+    print(f"运行日志: {run_journal.journal_path}")
+    
+    # 并发处理图片：编码线程预取后续图片，请求线程同时调用API
+    print(f"使用最大并发数: {MAX_CONCURRENCY}，编码线程数: {ENCODE_WORKERS}，"
+          f"预取数量: {PREFETCH_COUNT}，预取数据上限: {PREFETCH_MAX_MB} MB")
+    
+    def process_indices(indices):
+        def on_result(position, success, record):
+            idx = indices[position]
+            outcomes[idx] = (success, record)
+            run_journal.record(image_files[idx], success, record)
+        
+        run_title_pipeline([image_files[idx] for idx in indices], on_result)
+    
     # 输出Excel文件路径
     output_excel = result_dir / "Image_Titles_Doubao.xlsx"
 
@@ -298,23 +1461,73 @@ def main():
         # 在文件名中添加计数器
         final_output_excel = result_dir / f"{name}_{counter}{ext}"
         counter += 1
-
-    # 保存到Excel文件
-    df.to_excel(final_output_excel, index=False, engine='openpyxl')
-    print(f"所有图片处理完成。结果已保存到: {final_output_excel}")
-    print(f"总共处理了: {len(results)} 张图片")
-
-    # 如果有失败的图片，保存到失败记录文件
-    if failed_images:
-        failure_excel = failure_dir / "Failed_Images.xlsx"
-        failure_df = pd.DataFrame(failed_images)
-        failure_df.to_excel(failure_excel, index=False, engine='openpyxl')
-        print(f"发现 {len(failed_images)} 张图片处理失败，失败记录已保存到: {failure_excel}")
-    else:
-        print("所有图片都处理成功，没有失败记录。")
+    
+    try:
+        process_indices(pending_indices)
+        
+        if response_cache is not None:
+            print(f"响应缓存: 命中 {response_cache.hits} 次，未命中 {response_cache.misses} 次")
+        if phash_index is not None:
+            print(f"相似图片复用标题: {phash_index.reused_count} 张")
+        
+        results, failed_images = save_title_results(outcomes, final_output_excel)
+        request_metrics.save_summary()
+        print("所有图片处理完成。")
+        
+        if watch:
+            # 监视模式：定期扫描图片文件夹，只处理新增的图片，每批处理后更新同一个结果文件
+            print(f"\n进入监视模式，每 {WATCH_INTERVAL} 秒检查一次新图片，按 Ctrl-C 退出")
+            known_names = {image_file.name.lower() for image_file in image_files}
+            last_sizes = {}
+            while True:
+                time.sleep(WATCH_INTERVAL)
+                new_files = []
+                current_sizes = {}
+                for image_file in scan_image_files(IMAGE_FOLDER_PATH, RECURSIVE_SCAN, quiet=True):
+                    if image_file.name.lower() in known_names:
+                        continue
+                    try:
+                        size = image_file.stat().st_size
+                    except OSError:
+                        continue
+                    # 文件大小在两次扫描之间不再变化时才认为已经复制完成
+                    if size > 0 and last_sizes.get(image_file) == size:
+                        new_files.append(image_file)
+                    else:
+                        current_sizes[image_file] = size
+                last_sizes = current_sizes
+                if not new_files:
+                    continue
+                
+                print(f"\n发现 {len(new_files)} 张新图片")
+                new_indices = list(range(len(image_files), len(image_files) + len(new_files)))
+                image_files.extend(new_files)
+                outcomes.extend([None] * len(new_files))
+                known_names.update(image_file.name.lower() for image_file in new_files)
+                process_indices(new_indices)
+                results, failed_images = save_title_results(outcomes, final_output_excel)
+                request_metrics.save_summary()
+    except KeyboardInterrupt:
+        if watch:
+            print("\n已退出监视模式")
+            return
+        # 已完成的图片都已写入运行日志，可使用 --resume 继续
+        print("\n处理被中断，已完成的图片已记录到运行日志，可使用 --resume 继续处理")
+        raise
+    finally:
+        run_journal.close()
     
     # 返回成功和失败的数量
     return len(results), len(failed_images)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="使用豆包模型为图片生成亚马逊标题")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--resume', action='store_true',
+                            help="跳过运行日志中已处理的图片，只处理剩余图片")
+    mode_group.add_argument('--retry-failed', action='store_true',
+                            help="只重新处理运行日志中记录为失败的图片")
+    parser.add_argument('--watch', action='store_true',
+                        help="处理完现有图片后持续监视图片文件夹，自动处理新增的图片")
+    args = parser.parse_args()
+    main(resume=args.resume, retry_failed=args.retry_failed, watch=args.watch)
\ No newline at end of file
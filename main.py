@@ -5,6 +5,8 @@ import importlib.util
 import traceback
 from pathlib import Path
 from datetime import datetime
+import pandas as pd
+from openpyxl import load_workbook
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -69,6 +71,173 @@ def get_result_folder_from_config(config_file):
     os.makedirs(result_folder, exist_ok=True)
     return result_folder
 
+def load_stage(image_gen_dir, script_name, project_root):
+    """按文件路径加载步骤脚本（不运行其main函数），并传入项目根目录"""
+    spec = importlib.util.spec_from_file_location(
+        script_name.replace(".py", ""),
+        image_gen_dir / script_name
+    )
+    module = importlib.util.module_from_spec(spec)
+    module.project_root = str(project_root)
+    spec.loader.exec_module(module)
+    return module
+
+def run_pipeline(image_gen_dir, project_root, config_file, result_dir):
+    """
+    在同一进程中依次运行Add Model、Ultimately、Organize
+    
+    Add Model的组合结果分块写入中间结果文件的同时保存在内存中，直接传给Ultimately和Organize，
+    中间结果文件只作为输出，不会被重新读取；Ultimately生成的工作簿（TEMPLATE_WRITER=xml时为填写后的"模板"工作表）
+    直接传给Organize
+    
+    SKIP_UNCHANGED_STAGES=true（默认）时，输入文件内容和上游步骤都未变化的步骤直接使用上次的输出文件，
+    记录保存在结果文件夹的.pipeline_manifest.json中。Add Model只有在中间结果为parquet时才会被跳过
+    （由下游步骤读取parquet文件），xlsx中间结果不作为后续步骤的输入
+    """
+    stages = {}
+    for script_name in ("Add Model.py", "Ultimately.py", "Organize.py"):
+        if not (image_gen_dir / script_name).exists():
+            print(f"错误: 找不到脚本 {script_name}")
+            return
+        stages[script_name] = load_stage(image_gen_dir, script_name, project_root)
+    add_model = stages["Add Model.py"]
+    ultimately = stages["Ultimately.py"]
+    organize = stages["Organize.py"]
+    
+    stage_data = add_model.load_shared_module('stage_data', "Stage Data.py")
+    manifest = None
+    if (stage_data.read_config_value(config_file, 'SKIP_UNCHANGED_STAGES') or 'true').lower() in ('true', '1', 'yes'):
+        stage_manifest = add_model.load_shared_module('stage_manifest', "Stage Manifest.py")
+        manifest = stage_manifest.StageManifest(Path(result_dir) / stage_manifest.MANIFEST_NAME)
+    
+    def run_step(index, script_name, step, inputs, upstream=(), reusable=True):
+        """
+        运行一个步骤，输入未变化时跳过
+        
+        Args:
+            step: 返回 (结果, 输出文件列表) 的函数，结果为None表示步骤未完成
+            inputs: {名称: 文件路径}，步骤脚本本身会自动加入
+            upstream: 上游步骤的键
+            reusable: 为False时即使输入未变化也运行步骤（输出文件不能代替步骤的结果时）
+        
+        Returns:
+            tuple: (步骤键, 结果, 输出文件列表)，步骤被跳过时结果为None；步骤未完成时返回None
+        """
+        print(f"\n[{index}/{len(stages)}] 正在运行: {script_name}")
+        print("-" * 50)
+        key = None
+        if manifest is not None:
+            inputs = dict(inputs, **{script_name: image_gen_dir / script_name})
+            key = manifest.stage_key(inputs, upstream)
+            outputs = manifest.current_outputs(script_name, key) if reusable else None
+            if outputs is not None:
+                print(f"输入未变化，跳过: {script_name}")
+                for output_file in outputs:
+                    print(f"使用上次的结果: {output_file}")
+                return key, None, outputs
+        step_start_time = datetime.now()
+        print(f"开始时间: {step_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        result, outputs = step()
+        step_end_time = datetime.now()
+        print(f"完成时间: {step_end_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"执行耗时: {step_end_time - step_start_time}")
+        print(f"完成: {script_name}\n")
+        if result is None:
+            return None
+        if manifest is not None:
+            manifest.record(script_name, key, outputs)
+        return key, result, outputs
+    
+    excel_dir = Path(project_root) / "需要的excel文件"
+    input_excel = Path(result_dir) / "Image_Titles_Doubao.xlsx"
+    model_excel = excel_dir / "型号.xlsx"
+    shared_scripts = {name: image_gen_dir / name for name in ("Model Catalog.py", "Stage Data.py")}
+    
+    def add_model_step():
+        if not input_excel.exists():
+            print(f"输入文件不存在: {input_excel}")
+            return None, []
+        print(f"正在读取输入文件: {input_excel}")
+        df_titles = pd.read_excel(input_excel)
+        chunks = add_model.add_models(df_titles, project_root)
+        if chunks is None:
+            return None, []
+        # 逐块写入中间结果文件（INTERMEDIATE_FORMAT）的同时保留每一块，写入完成后合并为后续步骤使用的DataFrame
+        frames = []
+        
+        def keep_chunks():
+            for chunk in chunks:
+                frames.append(chunk)
+                yield chunk
+        
+        output_files = add_model.save_combinations(keep_chunks(), result_dir, config_file)
+        if frames:
+            df_combined = pd.concat(frames, ignore_index=True)
+        else:
+            df_combined = pd.DataFrame(columns=add_model.OUTPUT_COLUMNS)
+        return df_combined, output_files
+    
+    add_model_result = run_step(1, "Add Model.py", add_model_step, dict(shared_scripts, **{
+        "Image_Titles_Doubao.xlsx": input_excel,
+        "型号.xlsx": model_excel,
+        "兼容型号.xlsx": excel_dir / "兼容型号.xlsx",
+        "config.txt": config_file,
+    }), reusable=stage_data.get_intermediate_format(config_file) == 'parquet')
+    if add_model_result is None:
+        print("Add Model 未生成数据，停止后续步骤")
+        return
+    add_model_key, df_combined, add_model_outputs = add_model_result
+    
+    def get_combined():
+        """Add Model本次生成的组合结果；Add Model被跳过时读取上次的parquet文件（同一文件只读取一次）"""
+        if df_combined is not None:
+            return df_combined
+        return stage_data.read_stage_table(add_model_outputs[0])
+    
+    template_file = ultimately.find_template_file(project_root)
+    template_writer = ultimately.get_template_writer(config_file)
+    
+    def ultimately_step():
+        print(f"正在读取模板文件: {template_file}")
+        if template_writer == 'xml':
+            filled = ultimately.fill_template_xml(
+                get_combined(), template_file, ultimately.next_final_template_file(result_dir))
+            if filled is None:
+                return None, []
+            return filled, [filled.output_file]
+        wb = ultimately.fill_template(get_combined(), template_file)
+        if wb is None:
+            return None, []
+        return wb, [ultimately.save_final_template(wb, result_dir)]
+    
+    ultimately_result = run_step(2, "Ultimately.py", ultimately_step, {
+        "Stage Data.py": shared_scripts["Stage Data.py"],
+        "Sheet XML Writer.py": image_gen_dir / "Sheet XML Writer.py",
+        "Template Schema.py": image_gen_dir / "Template Schema.py",
+        "Stage Manifest.py": image_gen_dir / "Stage Manifest.py",
+        "上架模板": template_file,
+    }, upstream=[add_model_key])
+    if ultimately_result is None:
+        print("Ultimately 未生成模板，停止后续步骤")
+        return
+    ultimately_key, wb, ultimately_outputs = ultimately_result
+    
+    def organize_step():
+        if wb is None:
+            # Ultimately被跳过时才读取上次生成的Final_Template
+            print(f"正在读取文件: {ultimately_outputs[0]}")
+            workbook = load_workbook(ultimately_outputs[0], keep_vba=True)
+            output_files = organize.split_workbook_by_phone_model(workbook, get_combined(), project_root, result_dir)
+        elif template_writer == 'xml':
+            output_files = organize.split_filled_template_by_phone_model(wb, get_combined(), project_root, result_dir)
+        else:
+            output_files = organize.split_workbook_by_phone_model(wb, get_combined(), project_root, result_dir)
+        return output_files, output_files
+    
+    run_step(3, "Organize.py", organize_step, dict(shared_scripts, **{
+        "型号.xlsx": model_excel,
+    }), upstream=[ultimately_key])
+
 def main():
     # 记录开始时间
     start_time = datetime.now()
@@ -90,13 +259,6 @@ def main():
     result_dir = get_result_folder_from_config(config_file)
     print(f"结果目录: {result_dir}")
     
-    # List of scripts to run in order
-    scripts_to_run = [
-        "Add Model.py",
-        "Ultimately.py",
-        "Organize.py"
-    ]
-    
     # 用于存储统计信息
     stats = None
     
@@ -116,45 +278,15 @@ def main():
     except Exception as e:
         print(f"读取配置文件时出错: {e}")
     
-    # Run each script in order
-    total_scripts = len(scripts_to_run)
-    for i, script_name in enumerate(scripts_to_run, 1):
-        script_path = image_gen_dir / script_name
-        print(f"\n[{i}/{total_scripts}] 正在运行: {script_name}")
-        print("-" * 50)
-        
-        if script_path.exists():
-            try:
-                script_start_time = datetime.now()
-                print(f"开始时间: {script_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # Import and call main function
-                spec = importlib.util.spec_from_file_location(
-                    script_name.replace(".py", ""),
-                    script_path
-                )
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                # Call main function if it exists
-                if hasattr(module, 'main') and callable(getattr(module, 'main')):
-                    module.main()
-                
-                script_end_time = datetime.now()
-                script_duration = script_end_time - script_start_time
-                print(f"完成时间: {script_end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"执行耗时: {script_duration}")
-                print(f"完成: {script_name}\n")
-                
-            except Exception as e:
-                print(f"错误: 运行 {script_name} 时发生异常:")
-                print(f"错误类型: {type(e).__name__}")
-                print(f"错误信息: {str(e)}")
-                print("详细错误追踪:")
-                traceback.print_exc()
-                print("\n程序将继续执行下一个脚本...\n")
-        else:
-            print(f"警告: 找不到脚本 {script_name}，跳过...")
+    # Run each stage in order
+    try:
+        run_pipeline(image_gen_dir, project_root, config_file, result_dir)
+    except Exception as e:
+        print(f"错误: 运行处理步骤时发生异常:")
+        print(f"错误类型: {type(e).__name__}")
+        print(f"错误信息: {str(e)}")
+        print("详细错误追踪:")
+        traceback.print_exc()
     
     end_time = datetime.now()
     total_duration = end_time - start_time